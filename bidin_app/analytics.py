@@ -0,0 +1,286 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AutoPlate, BidEvent
+from bid_log import PLACED, RAISED
+from cluster import cluster
+
+# Price buckets per plate: a minute each for the recent past, folded into hours after
+# ANALYTICS_FINE_SECONDS and dropped after ANALYTICS_RETENTION_HOURS, which bounds memory
+FINE_BUCKET = 60
+COARSE_BUCKET = 3600
+ANALYTICS_FINE_SECONDS = int(os.getenv("ANALYTICS_FINE_SECONDS", "7200"))
+ANALYTICS_RETENTION_HOURS = int(os.getenv("ANALYTICS_RETENTION_HOURS", "168"))
+ANALYTICS_COMPACT_SECONDS = float(os.getenv("ANALYTICS_COMPACT_SECONDS", "60"))
+# Newest bid log events replayed at startup, so a restart doesn't start from nothing
+ANALYTICS_WARM_EVENTS = int(os.getenv("ANALYTICS_WARM_EVENTS", "200000"))
+LEADERBOARD_SIZE = 100
+MAX_POINTS = 500
+WARM_CHUNK = 10000
+
+# A bucket is [start, open, high, low, close, bids]
+START, OPEN, HIGH, LOW, CLOSE, BIDS = range(6)
+
+
+def _merge(bucket: list, other: list):
+    # `other` is the later of the two
+    bucket[HIGH] = max(bucket[HIGH], other[HIGH])
+    bucket[LOW] = min(bucket[LOW], other[LOW])
+    bucket[CLOSE] = other[CLOSE]
+    bucket[BIDS] += other[BIDS]
+
+
+def _timestamp(value: datetime) -> float:
+    # The bid log stores naive UTC
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class PlateSeries:
+    __slots__ = ("fine", "coarse", "last_bid_at")
+
+    def __init__(self):
+        self.fine: List[list] = []
+        self.coarse: List[list] = []
+        self.last_bid_at = 0.0
+
+    def add(self, amount: Decimal, at: float):
+        start = at - at % FINE_BUCKET
+        last = self.fine[-1] if self.fine else None
+        if last is not None and start <= last[START]:
+            # Same minute, or a bid from another worker whose clock is slightly behind
+            _merge(last, [start, amount, amount, amount, amount, 1])
+        else:
+            self.fine.append([start, amount, amount, amount, amount, 1])
+        self.last_bid_at = max(self.last_bid_at, at)
+
+    def bids_since(self, since: float) -> int:
+        count = 0
+        for bucket in reversed(self.fine):
+            if bucket[START] + FINE_BUCKET <= since:
+                break
+            count += bucket[BIDS]
+        return count
+
+    def compact(self, fine_before: float, drop_before: float):
+        folded = 0
+        while self.fine and self.fine[0][START] < fine_before:
+            bucket = self.fine.pop(0)
+            start = bucket[START] - bucket[START] % COARSE_BUCKET
+            if self.coarse and self.coarse[-1][START] == start:
+                _merge(self.coarse[-1], bucket)
+            else:
+                self.coarse.append([start, *bucket[OPEN:]])
+            folded += 1
+        while self.coarse and self.coarse[0][START] < drop_before:
+            self.coarse.pop(0)
+        return folded
+
+    def points(self, resolution: int, since: Optional[float] = None) -> List[list]:
+        # Buckets merged down to `resolution` seconds; hour buckets can't be split finer
+        points: List[list] = []
+        for bucket in self.coarse + self.fine:
+            if since is not None and bucket[START] + FINE_BUCKET <= since:
+                continue
+            start = bucket[START] - bucket[START] % resolution
+            if points and points[-1][START] >= start:
+                _merge(points[-1], bucket)
+            else:
+                points.append([start, *bucket[OPEN:]])
+        return points
+
+    def __len__(self):
+        return len(self.fine) + len(self.coarse)
+
+
+class BidAnalytics:
+    # Aggregates kept up to date by every accepted bid, so the analytics endpoints never
+    # touch the bids table: bid velocity and price series per plate, and a leaderboard of
+    # active plates by price. Everything runs on the event loop.
+    def __init__(self, fine_seconds: int = ANALYTICS_FINE_SECONDS, retention_hours: int = ANALYTICS_RETENTION_HOURS,
+                 compact_interval: float = ANALYTICS_COMPACT_SECONDS):
+        self.fine_seconds = fine_seconds
+        self.retention_hours = retention_hours
+        self.compact_interval = compact_interval
+        self._series: Dict[int, PlateSeries] = {}
+        # Plates with a bid in the fine window, the only candidates for "hot"
+        self._recent: Dict[int, PlateSeries] = {}
+        self._prices: Dict[int, Decimal] = {}
+        # (-price, plate_id), the LEADERBOARD_SIZE highest; rebuilt from _prices when a member
+        # drops out while plates outside it might deserve its place
+        self._top: List[Tuple[Decimal, int]] = []
+        self._top_dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.folded = 0
+        self.compactions = 0
+
+    def record(self, plate_id: int, amount, at: Optional[float] = None):
+        # An accepted bid; it is the plate's new price
+        amount = Decimal(str(amount))
+        series = self._series.get(plate_id)
+        if series is None:
+            series = self._series[plate_id] = PlateSeries()
+        series.add(amount, at if at is not None else time.time())
+        self._recent[plate_id] = series
+        self.set_price(plate_id, amount)
+        self.recorded += 1
+
+    def set_price(self, plate_id: int, amount):
+        # None once the plate leaves the leaderboard (closed, deleted, or no bids left)
+        previous = self._prices.get(plate_id)
+        if previous is not None:
+            index = bisect_left(self._top, (-previous, plate_id))
+            if index < len(self._top) and self._top[index] == (-previous, plate_id):
+                del self._top[index]
+                if len(self._prices) > LEADERBOARD_SIZE:
+                    self._top_dirty = True
+        if amount is None:
+            self._prices.pop(plate_id, None)
+            return
+        amount = Decimal(str(amount))
+        self._prices[plate_id] = amount
+        if len(self._top) < LEADERBOARD_SIZE or (-amount, plate_id) < self._top[-1]:
+            insort(self._top, (-amount, plate_id))
+            if len(self._top) > LEADERBOARD_SIZE:
+                self._top.pop()
+
+    def top_prices(self, limit: int) -> List[Tuple[int, Decimal]]:
+        if self._top_dirty:
+            self._top = heapq.nsmallest(LEADERBOARD_SIZE, ((-price, plate_id) for plate_id, price in self._prices.items()))
+            self._top_dirty = False
+        return [(plate_id, -neg_price) for neg_price, plate_id in self._top[:limit]]
+
+    def hot_plates(self, window: int, limit: int, now: Optional[float] = None) -> List[Tuple[int, int]]:
+        # (plate_id, bids in the last `window` seconds), busiest first
+        since = (now if now is not None else time.time()) - window
+        counts = ((series.bids_since(since), plate_id) for plate_id, series in self._recent.items()
+                  if series.last_bid_at > since)
+        return [(plate_id, count) for count, plate_id in heapq.nlargest(limit, counts) if count]
+
+    def price_series(self, plate_id: int, resolution: Optional[int] = None,
+                     since: Optional[float] = None) -> Tuple[int, List[list]]:
+        # Returns the resolution used (a multiple of a minute, coarse enough for MAX_POINTS
+        # when not given) and the points
+        series = self._series.get(plate_id)
+        if series is None:
+            return resolution or FINE_BUCKET, []
+        if resolution is None:
+            first = series.coarse[0] if series.coarse else series.fine[0]
+            span = series.last_bid_at - max(first[START], since or 0)
+            resolution = max(1, int(span // (MAX_POINTS * FINE_BUCKET)) + 1) * FINE_BUCKET
+        return resolution, series.points(resolution, since)
+
+    def compact(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        fine_before = now - self.fine_seconds
+        drop_before = now - self.retention_hours * COARSE_BUCKET
+        folded = 0
+        for plate_id, series in list(self._series.items()):
+            folded += series.compact(fine_before, drop_before)
+            if not series.fine:
+                self._recent.pop(plate_id, None)
+            if not len(series):
+                del self._series[plate_id]
+        self.folded += folded
+        self.compactions += 1
+        return folded
+
+    def buckets(self) -> int:
+        return sum(len(series) for series in self._series.values())
+
+    async def warm_up(self, db: AsyncSession, limit: int = ANALYTICS_WARM_EVENTS):
+        # Series from the bid log's newest events (read backwards by id, so only they are
+        # touched), then the leaderboard from the plates' summary columns
+        since = time.time() - self.retention_hours * COARSE_BUCKET
+        events: List[Tuple[int, Decimal, float]] = []
+        before = None
+        done = False
+        while not done and len(events) < limit:
+            query = select(BidEvent.id, BidEvent.plate_id, BidEvent.amount, BidEvent.created_at, BidEvent.kind)
+            if before is not None:
+                query = query.where(BidEvent.id < before)
+            rows = (await db.execute(query.order_by(BidEvent.id.desc()).limit(WARM_CHUNK))).all()
+            done = len(rows) < WARM_CHUNK
+            for event_id, plate_id, amount, created_at, kind in rows:
+                at = _timestamp(created_at)
+                if at < since:
+                    done = True
+                    break
+                if kind in (PLACED, RAISED):
+                    events.append((plate_id, amount, at))
+                before = event_id
+        self.clear()
+        for plate_id, amount, at in reversed(events[:limit]):
+            series = self._series.get(plate_id)
+            if series is None:
+                series = self._series[plate_id] = PlateSeries()
+            series.add(Decimal(str(amount)), at)
+            self._recent[plate_id] = series
+        result = await db.execute(
+            select(AutoPlate.id, AutoPlate.current_highest_amount)
+            .where(AutoPlate.is_active == True, AutoPlate.bid_count > 0)
+        )
+        self._prices = {plate_id: Decimal(str(amount)) for plate_id, amount in result.all()}
+        self._top_dirty = True
+        self.compact()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            self.compact()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "plates": len(self._series),
+            "buckets": self.buckets(),
+            "priced_plates": len(self._prices),
+            "recorded": self.recorded,
+            "folded": self.folded,
+            "compactions": self.compactions,
+        }
+
+    def clear(self):
+        self._series.clear()
+        self._recent.clear()
+        self._prices.clear()
+        self._top = []
+        self._top_dirty = False
+        self.recorded = self.folded = self.compactions = 0
+
+
+analytics = BidAnalytics()
+
+
+def _apply_feed(payload: dict):
+    # Bids accepted by other workers
+    event = json.loads(payload["message"])
+    if event["type"] == "bid":
+        analytics.record(event["plate_id"], event["amount"])
+    elif event["type"] == "bid_deleted":
+        analytics.set_price(event["plate_id"], event["highest_amount"])
+    elif event["type"] == "closed":
+        analytics.set_price(event["plate_id"], None)
+
+
+cluster.subscribe("feed", _apply_feed)
@@ -0,0 +1,141 @@
+# Analytics from the incremental aggregates (analytics.py) against the same answers
+# computed ad hoc from the bid log, the only table that has the history.
+#
+#   cd bidin_app && python -m benchmarks.bench_analytics --events 1000000
+#
+# record       cost of analytics.record per accepted bid, what the bid paths pay
+# compact      one compaction pass once those bids have aged past the fine window
+# hot          plates with most bids in the last --window seconds
+# top_prices   plates by current price
+# series       one plate's price per --resolution seconds
+# warm_up      rebuilding the aggregates from the log tail at startup
+# Each query is timed both ways, "sql" scanning bid_events the way an ad hoc query would.
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("analytics")
+
+from sqlalchemy import Integer, cast, func, insert, select
+
+from analytics import BidAnalytics
+from bid_log import RAISED, bid_event
+from database import AsyncSessionLocal, Base, engine
+from models import AutoPlate, BidEvent
+
+HOUR = 3600
+
+
+def history(args):
+    # --events raises spread evenly over --hours, a few plates much busier than the rest
+    rng = random.Random(args.seed)
+    prices = [100] * (args.plates + 1)
+    start = datetime.utcnow() - timedelta(hours=args.hours)
+    step = args.hours * HOUR / args.events
+    for i in range(args.events):
+        plate_id = min(int(rng.paretovariate(1.2)), args.plates)
+        prices[plate_id] += rng.randint(1, 50)
+        yield bid_event(RAISED, plate_id, 1, plate_id, prices[plate_id], start + timedelta(seconds=i * step))
+
+
+def seed(args):
+    Base.metadata.create_all(bind=engine)
+    batch = []
+    with engine.begin() as connection:
+        for event in history(args):
+            batch.append(event)
+            if len(batch) == 50_000:
+                connection.execute(insert(BidEvent.__table__), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(BidEvent.__table__), batch)
+        highest = select(BidEvent.plate_id, func.max(BidEvent.amount)).group_by(BidEvent.plate_id)
+        deadline = datetime.now() + timedelta(days=1)
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": plate_id, "plate_number": f"AN{plate_id:06d}", "description": "", "deadline": deadline,
+             "is_active": True, "created_by_id": 1, "current_highest_amount": amount, "bid_count": 1}
+            for plate_id, amount in connection.execute(highest).all()
+        ])
+
+
+def timed(fn, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return round((time.perf_counter() - started) / repeat * 1000, 3), result
+
+
+async def timed_sql(query, repeat: int):
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = (await db.execute(query)).all()
+    return round((time.perf_counter() - started) / repeat * 1000, 3), result
+
+
+async def measure(args) -> dict:
+    results = {"events": args.events, "plates": args.plates, "hours": args.hours}
+
+    stats = BidAnalytics()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    now = time.time()
+    for i in range(args.records):
+        stats.record(rng.randint(1, args.plates), 100 + i, at=now + i * 0.01)
+    seconds = time.perf_counter() - started
+    results["record"] = {"bids": args.records, "us_per_bid": round(seconds / args.records * 1e6, 2)}
+    # Once all of those minutes are older than the fine window
+    before = stats.buckets()
+    compact_ms, _ = timed(lambda: stats.compact(now + stats.fine_seconds + 2 * HOUR), 1)
+    results["compact"] = {"ms": compact_ms, "buckets_before": before, "buckets_after": stats.buckets()}
+
+    stats = BidAnalytics()
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        await stats.warm_up(db, limit=args.events)
+        results["warm_up"] = {"seconds": round(time.perf_counter() - started, 2), "buckets": stats.buckets()}
+
+    since = datetime.utcnow() - timedelta(seconds=args.window)
+    hot_sql = (select(BidEvent.plate_id, func.count()).where(BidEvent.created_at > since)
+               .group_by(BidEvent.plate_id).order_by(func.count().desc()).limit(10))
+    mem_ms, _ = timed(lambda: stats.hot_plates(args.window, 10), args.repeat)
+    sql_ms, _ = await timed_sql(hot_sql, args.repeat)
+    results["hot"] = {"memory_ms": mem_ms, "sql_ms": sql_ms}
+
+    top_sql = (select(BidEvent.plate_id, func.max(BidEvent.amount).label("price")).group_by(BidEvent.plate_id)
+               .order_by(func.max(BidEvent.amount).desc()).limit(10))
+    mem_ms, _ = timed(lambda: stats.top_prices(10), args.repeat)
+    sql_ms, _ = await timed_sql(top_sql, args.repeat)
+    results["top_prices"] = {"memory_ms": mem_ms, "sql_ms": sql_ms}
+
+    # Plate 1 is the busiest
+    bucket = cast(func.strftime("%s", BidEvent.created_at), Integer) // args.resolution
+    series_sql = (select(bucket, func.min(BidEvent.amount), func.max(BidEvent.amount), func.count())
+                  .where(BidEvent.plate_id == 1).group_by(bucket))
+    mem_ms, (_, points) = timed(lambda: stats.price_series(1, args.resolution), args.repeat)
+    sql_ms, rows = await timed_sql(series_sql, args.repeat)
+    results["series"] = {"memory_ms": mem_ms, "sql_ms": sql_ms, "points": len(points), "sql_points": len(rows)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics aggregates against ad hoc SQL")
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--plates", type=int, default=20_000)
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--window", type=int, default=300)
+    parser.add_argument("--resolution", type=int, default=HOUR)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=23)
+    args = parser.parse_args()
+    seed(args)
+    report(asyncio.run(measure(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Compares the async request path against the previous sync stack.
+#
+#   cd bidin_app && python -m benchmarks.bench_async_stack --requests 2000 --concurrency 100
+#
+# The sync baseline reproduces the old handlers: `def` endpoints on the blocking
+# SessionLocal (one threadpool slot per request) and an `async def` login that
+# runs bcrypt on the event loop.
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, run_load, use_temp_database
+
+use_temp_database("async_stack")
+
+import httpx
+from fastapi import Depends, FastAPI, Form, HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, SessionLocal, engine
+from dependencies import create_access_token, get_password_hash, verify_password
+from main import app as async_app
+from models import AutoPlate, Bid, User
+
+
+def seed(plates: int, bids_per_plate: int):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    password = get_password_hash("benchpassword")
+    users = [
+        User(id=i, username=f"bidder{i}", email=f"bidder{i}@example.com", hashed_password=password)
+        for i in range(1, bids_per_plate + 1)
+    ]
+    db.add_all(users)
+    deadline = datetime.now() + timedelta(days=30)
+    for plate_id in range(1, plates + 1):
+        db.add(AutoPlate(id=plate_id, plate_number=f"P{plate_id:06d}", description="bench",
+                         deadline=deadline + timedelta(minutes=plate_id), created_by_id=1))
+        for user in users:
+            db.add(Bid(plate_id=plate_id, user_id=user.id, amount=100 + user.id))
+    db.commit()
+    db.close()
+
+
+# One connection per threadpool slot (anyio's default limit is 40). With the default
+# pool of 5+10 the old stack deadlocks: threads wait for connections whose release
+# is itself queued behind them on the threadpool.
+sync_engine = create_engine(
+    os.environ["DATABASE_URL"], connect_args={"check_same_thread": False}, pool_size=40
+)
+SyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+
+
+def get_sync_db():
+    db = SyncSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def build_sync_app() -> FastAPI:
+    sync_app = FastAPI()
+
+    @sync_app.get("/plates/")
+    def list_plates(db=Depends(get_sync_db)):
+        plates = db.query(AutoPlate).filter(AutoPlate.is_active == True).all()
+        return [
+            {"id": p.id, "plate_number": p.plate_number, "description": p.description,
+             "deadline": p.deadline, "is_active": p.is_active, "created_by_id": p.created_by_id}
+            for p in plates
+        ]
+
+    @sync_app.get("/plates/{plate_id}")
+    def plate_details(plate_id: int, db=Depends(get_sync_db)):
+        plate = db.query(AutoPlate).filter(AutoPlate.id == plate_id).first()
+        bids = db.query(Bid).filter(Bid.plate_id == plate_id).order_by(Bid.created_at.asc()).all()
+        return {
+            "id": plate.id, "plate_number": plate.plate_number, "description": plate.description,
+            "deadline": plate.deadline, "is_active": plate.is_active,
+            "bids": [{"amount": b.amount, "user": b.user_id, "created_at": b.created_at} for b in bids],
+        }
+
+    @sync_app.post("/auth/login")
+    async def login(username: str = Form(...), password: str = Form(...), db=Depends(get_sync_db)):
+        user = db.query(User).filter(User.username == username).first()
+        if not user or not verify_password(password, user.hashed_password):
+            raise HTTPException(status_code=400, detail="Incorrect username or password")
+        return {"access_token": create_access_token(data={"sub": user.username}), "token_type": "bearer"}
+
+    return sync_app
+
+
+async def drive(app: FastAPI, args) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def send(i: int) -> int:
+            if args.login_every and i % args.login_every == 0:
+                response = await client.post(
+                    "/auth/login", data={"username": "bidder1", "password": "benchpassword"}
+                )
+            elif i % 4 == 0:
+                response = await client.get("/plates/")
+            else:
+                response = await client.get(f"/plates/{i % args.plates + 1}")
+            return response.status_code
+
+        return await run_load(send, args.requests, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async vs sync request stack")
+    parser.add_argument("--plates", type=int, default=200)
+    parser.add_argument("--bids-per-plate", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--login-every", type=int, default=100,
+                        help="every Nth request is a bcrypt login (0 disables)")
+    args = parser.parse_args()
+
+    seed(args.plates, args.bids_per_plate)
+    results = {
+        "sync": asyncio.run(drive(build_sync_app(), args)),
+        "async": asyncio.run(drive(async_app, args)),
+    }
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
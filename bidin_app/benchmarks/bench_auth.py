@@ -0,0 +1,85 @@
+# Per-request authentication overhead of get_current_user.
+#
+#   cd bidin_app && python -m benchmarks.bench_auth --iterations 5000
+#
+# "legacy" replays the old path (JWT decode + username query on every call),
+# "cold" clears both caches before each call, "warm" is the steady state.
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("auth")
+
+from jose import jwt
+from sqlalchemy import event, select
+
+from database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine
+from dependencies import (
+    ALGORITHM, SECRET_KEY, create_user_token, get_current_user, principal_cache, token_cache,
+)
+from models import User
+
+queries = 0
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global queries
+    queries += 1
+
+
+async def legacy_get_current_user(token, db):
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    result = await db.execute(select(User).where(User.username == payload["sub"]))
+    return result.scalars().first()
+
+
+async def measure(iterations, call, before_each=None):
+    global queries
+    queries = 0
+    elapsed = 0.0
+    async with AsyncSessionLocal() as db:
+        for _ in range(iterations):
+            if before_each:
+                before_each()
+            started = time.perf_counter()
+            await call(db)
+            elapsed += time.perf_counter() - started
+    return {
+        "us_per_request": round(elapsed / iterations * 1e6, 1),
+        "queries_per_request": round(queries / iterations, 3),
+    }
+
+
+def clear_caches():
+    token_cache.clear()
+    principal_cache.clear()
+
+
+async def run(iterations):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(username="bench", email="bench@example.com", hashed_password="x", is_staff=False)
+    db.add(user)
+    db.commit()
+    token = create_user_token(user)
+    db.close()
+
+    return {
+        "legacy": await measure(iterations, lambda db: legacy_get_current_user(token, db)),
+        "cold": await measure(iterations, lambda db: get_current_user(token, db), clear_caches),
+        "warm": await measure(iterations, lambda db: get_current_user(token, db)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_current_user overhead")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    report(asyncio.run(run(args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
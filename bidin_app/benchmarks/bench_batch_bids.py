@@ -0,0 +1,95 @@
+# A bidding agent placing bids across many plates: POST /bids/batch vs looping POST /bids/.
+#
+#   cd bidin_app && python -m benchmarks.bench_batch_bids --plates 2000 --batch-size 100
+#
+# Each agent bids once on every plate; the looped agents go first on their share of
+# plates, then the batched ones, so both paths insert the same number of new bids.
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("batch_bids")
+
+import httpx
+from sqlalchemy import insert
+
+from database import Base, SessionLocal, engine
+from dependencies import create_user_token
+from main import app
+from models import AutoPlate, User
+
+
+def seed(plates: int):
+    Base.metadata.create_all(bind=engine)
+    deadline = datetime.now() + timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": i, "username": f"agent{i}", "email": f"agent{i}@example.com", "hashed_password": "x"}
+            for i in (1, 2)
+        ])
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": i, "plate_number": f"AG{i:06d}", "description": "", "deadline": deadline,
+             "is_active": True, "created_by_id": 1, "current_highest_amount": 0, "bid_count": 0}
+            for i in range(1, plates + 1)
+        ])
+    db = SessionLocal()
+    tokens = {user.id: {"Authorization": f"Bearer {create_user_token(user)}"} for user in db.query(User)}
+    db.close()
+    return tokens
+
+
+async def run(args):
+    tokens = seed(args.plates)
+    plate_ids = list(range(1, args.plates + 1))
+    transport = httpx.ASGITransport(app=app)
+    results = {"plates": args.plates, "batch_size": args.batch_size}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        accepted = 0
+        for plate_id in plate_ids:
+            response = await client.post("/bids/", json={"plate_id": plate_id, "amount": 100},
+                                         headers=tokens[1])
+            accepted += response.status_code == 200
+        elapsed = time.perf_counter() - started
+        results["single"] = {
+            "requests": len(plate_ids),
+            "accepted": accepted,
+            "seconds": round(elapsed, 3),
+            "bids_per_sec": round(len(plate_ids) / elapsed, 1),
+        }
+
+        started = time.perf_counter()
+        accepted = requests = 0
+        for start in range(0, len(plate_ids), args.batch_size):
+            chunk = plate_ids[start:start + args.batch_size]
+            response = await client.post(
+                "/bids/batch", json={"bids": [{"plate_id": plate_id, "amount": 200} for plate_id in chunk]},
+                headers=tokens[2],
+            )
+            requests += 1
+            accepted += response.json()["accepted"]
+        elapsed = time.perf_counter() - started
+        results["batch"] = {
+            "requests": requests,
+            "accepted": accepted,
+            "seconds": round(elapsed, 3),
+            "bids_per_sec": round(len(plate_ids) / elapsed, 1),
+        }
+    results["speedup"] = round(results["batch"]["bids_per_sec"] / results["single"]["bids_per_sec"], 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch vs single bid submission")
+    parser.add_argument("--plates", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Hundreds of bidders racing on one plate through POST /bids/ and PUT /bids/{id}.
+#
+#   cd bidin_app && python -m benchmarks.bench_bid_contention --bidders 300 --rounds 3
+#
+# Every bidder keeps raising by a random step for several rounds. Afterwards the
+# run is checked for lost bids (a 200 whose amount is not in the table) and for
+# out-of-order acceptance (the plate summary disagreeing with the bids table).
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("bid_contention")
+
+import httpx
+
+from database import Base, SessionLocal, engine
+from dependencies import create_user_token
+from main import app
+from models import AutoPlate, Bid, User
+
+
+def seed(bidders: int):
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    users = [User(id=i, username=f"bidder{i}", email=f"bidder{i}@example.com", hashed_password="x")
+             for i in range(1, bidders + 1)]
+    db.add_all(users)
+    db.add(AutoPlate(id=1, plate_number="HOT001", description="bench",
+                     deadline=datetime.now() + timedelta(days=1), created_by_id=1))
+    db.commit()
+    tokens = {user.id: {"Authorization": f"Bearer {create_user_token(user)}"} for user in users}
+    db.close()
+    return tokens
+
+
+async def run(args):
+    tokens = seed(args.bidders)
+    statuses = Counter()
+    accepted = {}
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def bidder(user_id):
+            amount, bid_id = 0.0, None
+            for _ in range(args.rounds):
+                amount = round(amount + random.uniform(1, 1000), 2)
+                if bid_id is None:
+                    response = await client.post(
+                        "/bids/", json={"plate_id": 1, "amount": amount}, headers=tokens[user_id]
+                    )
+                else:
+                    response = await client.put(
+                        f"/bids/{bid_id}", json={"plate_id": 1, "amount": amount}, headers=tokens[user_id]
+                    )
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    bid_id = response.json()["id"]
+                    accepted[user_id] = amount
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bidder(user_id) for user_id in tokens))
+        elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    rows = {bid.user_id: float(bid.amount) for bid in db.query(Bid).filter(Bid.plate_id == 1)}
+    plate = db.get(AutoPlate, 1)
+    db.close()
+    accepted_count = statuses[200]
+    return {
+        "bidders": args.bidders,
+        "attempts": sum(statuses.values()),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "attempts_per_sec": round(sum(statuses.values()) / elapsed, 1),
+        "accepted_bids_per_sec": round(accepted_count / elapsed, 1),
+        # Each bidder's last accepted amount must be exactly what the table holds
+        "lost_bids": sum(1 for user_id, amount in accepted.items() if rows.get(user_id) != amount),
+        "summary_consistent": (
+            float(plate.current_highest_amount) == max(rows.values(), default=0)
+            and plate.bid_count == len(rows)
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent bidding on a single plate")
+    parser.add_argument("--bidders", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
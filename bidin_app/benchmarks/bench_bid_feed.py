@@ -0,0 +1,78 @@
+# Fan-out capacity of the in-process bid feed hub.
+#
+#   cd bidin_app && python -m benchmarks.bench_bid_feed --subscribers 100 1000 10000 --events 200
+#
+# Each subscriber is a consumer task like the WebSocket/SSE endpoints run; the
+# socket write itself is not included. A subscriber count is "sustained" when
+# p99 delivery latency stays under --target-ms and nothing was dropped.
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import percentile, report
+
+from bid_feed import BidFeedHub
+
+
+async def run_once(subscribers: int, events: int, interval: float, buffer_size: int) -> dict:
+    hub = BidFeedHub(buffer_size=buffer_size)
+    latencies = []
+    delivered = 0
+
+    async def consume(subscription):
+        nonlocal delivered
+        while True:
+            message = await subscription.get()
+            if message is None:
+                return
+            latencies.append(time.perf_counter() - json.loads(message)["sent_at"])
+            delivered += 1
+
+    subscriptions = [hub.subscribe(1) for _ in range(subscribers)]
+    consumers = [asyncio.create_task(consume(subscription)) for subscription in subscriptions]
+
+    started = time.perf_counter()
+    for sequence in range(events):
+        hub.publish(1, {"type": "bid", "amount": 100 + sequence, "sent_at": time.perf_counter()})
+        await asyncio.sleep(interval)
+    # Let consumers drain before closing
+    while any(subscription.queue for subscription in subscriptions):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    for subscription in subscriptions:
+        hub.unsubscribe(subscription)
+    await asyncio.gather(*consumers)
+
+    return {
+        "subscribers": subscribers,
+        "events": events,
+        "delivered_per_sec": round(delivered / elapsed, 1),
+        "dropped": sum(subscription.dropped for subscription in subscriptions),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(args):
+    results = []
+    for subscribers in args.subscribers:
+        result = await run_once(subscribers, args.events, args.interval, args.buffer_size)
+        result["sustained"] = result["dropped"] == 0 and result["p99_ms"] <= args.target_ms
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bid feed fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between published bids")
+    parser.add_argument("--buffer-size", type=int, default=32)
+    parser.add_argument("--target-ms", type=float, default=100.0)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
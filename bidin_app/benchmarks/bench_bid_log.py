@@ -0,0 +1,137 @@
+# Bid event log: append throughput and recovery time.
+#
+#   cd bidin_app && python -m benchmarks.bench_bid_log --events 10000000 --tail 100000
+#
+# append_per_bid   one event per transaction through bid_log.append, as the bid paths do it
+#                  (the bid's own UPDATE/INSERT left out, so this is the log's share)
+# append_bulk      the --events history written in chunks of --chunk (how the history is
+#                  seeded): --plates plates with --bidders-per-plate bidders each
+# recover_full     no snapshot: every event replayed, what a log without snapshots costs
+# checkpoint       writing the snapshot of everything but the last --tail events
+# recover_snapshot the newest snapshot plus the --tail events after it, what a restart costs
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("bid_log")
+
+from sqlalchemy import func, insert, select
+
+from bid_log import PLACED, RAISED, WITHDRAWN, append, bid_event, load_state, write_snapshot
+from database import AsyncSessionLocal, Base, engine
+from models import BidEvent, BidLogSnapshot
+
+
+def history(count: int, plates: int, users: int, bidders: int, seed: int):
+    # A plausible mix: each plate's few bidders raising over each other, their first bids,
+    # and a few withdrawals
+    rng = random.Random(seed)
+    live = {}
+    prices = [100] * (plates + 1)
+    now = datetime.utcnow()
+    for event_id in range(1, count + 1):
+        plate_id = rng.randint(1, plates)
+        user_id = (plate_id * 7919 + rng.randint(1, bidders)) % users + 1
+        key = (plate_id, user_id)
+        if key in live and rng.random() < 0.01:
+            yield bid_event(WITHDRAWN, plate_id, user_id, live.pop(key), prices[plate_id], now)
+            continue
+        prices[plate_id] += rng.randint(1, 50)
+        if key in live:
+            yield bid_event(RAISED, plate_id, user_id, live[key], prices[plate_id], now)
+        else:
+            live[key] = event_id
+            yield bid_event(PLACED, plate_id, user_id, event_id, prices[plate_id], now)
+
+
+def append_bulk(events, chunk: int) -> int:
+    written = 0
+    batch = []
+    with engine.begin() as connection:
+        for event in events:
+            batch.append(event)
+            if len(batch) == chunk:
+                connection.execute(insert(BidEvent.__table__), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            connection.execute(insert(BidEvent.__table__), batch)
+            written += len(batch)
+    return written
+
+
+async def append_per_bid(count: int, plates: int) -> float:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            await append(db, [bid_event(RAISED, i % plates + 1, 1, 1, 100 + i)])
+            await db.commit()
+    return time.perf_counter() - started
+
+
+async def timed_recovery():
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        state, replayed = await load_state(db)
+    return time.perf_counter() - started, state, replayed
+
+
+async def timed_checkpoint(until_tail: int):
+    async with AsyncSessionLocal() as db:
+        newest = await db.scalar(select(func.max(BidEvent.id)))
+        started = time.perf_counter()
+        # What checkpoint() does, with everything but the tail counted as settled
+        state, _ = await load_state(db, newest - until_tail)
+        await write_snapshot(db, state)
+        size = await db.scalar(select(func.length(BidLogSnapshot.state)).order_by(BidLogSnapshot.id.desc()).limit(1))
+    return time.perf_counter() - started, state, size
+
+
+async def measure(args) -> dict:
+    results = {"events": args.events, "plates": args.plates, "users": args.users, "tail": args.tail}
+
+    seconds = await append_per_bid(args.per_bid, args.plates)
+    results["append_per_bid"] = {"events": args.per_bid, "per_sec": round(args.per_bid / seconds, 1)}
+    async with AsyncSessionLocal() as db:
+        await db.execute(BidEvent.__table__.delete())
+        await db.commit()
+
+    started = time.perf_counter()
+    written = append_bulk(history(args.events, args.plates, args.users, args.bidders_per_plate, args.seed), args.chunk)
+    seconds = time.perf_counter() - started
+    results["append_bulk"] = {"events": written, "seconds": round(seconds, 2), "per_sec": round(written / seconds)}
+
+    seconds, full_state, replayed = await timed_recovery()
+    results["recover_full"] = {"replayed": replayed, "seconds": round(seconds, 2), "live_bids": len(full_state)}
+
+    seconds, _, size = await timed_checkpoint(args.tail)
+    results["checkpoint"] = {"seconds": round(seconds, 2), "snapshot_bytes": size}
+
+    seconds, state, replayed = await timed_recovery()
+    results["recover_snapshot"] = {"replayed": replayed, "seconds": round(seconds, 2),
+                                   "matches_full_replay": state.plates == full_state.plates}
+    results["recovery_speedup"] = round(results["recover_full"]["seconds"] / seconds, 1) if seconds else None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bid event log append and recovery")
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--tail", type=int, default=100_000)
+    parser.add_argument("--plates", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--bidders-per-plate", type=int, default=10)
+    parser.add_argument("--per-bid", type=int, default=2000)
+    parser.add_argument("--chunk", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    Base.metadata.create_all(bind=engine)
+    report(asyncio.run(measure(args)))
+
+
+if __name__ == "__main__":
+    main()
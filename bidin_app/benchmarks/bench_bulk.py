@@ -0,0 +1,134 @@
+# Bulk plate import/export throughput.
+#
+#   cd bidin_app && python -m benchmarks.bench_bulk --rows 100000
+#
+# "one_by_one" is the old path (crud.create_plate per row) on a small sample, the
+# import goes through POST /plates/import as a streamed CSV upload, and the export
+# times both formats of GET /plates/export's generator.
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, use_temp_database
+
+use_temp_database("bulk")
+
+import httpx
+from sqlalchemy import insert
+
+import bulk
+import crud
+from database import AsyncSessionLocal, Base, SessionLocal, engine
+from dependencies import create_user_token
+from main import app
+from models import Bid, User
+from schemas import AutoPlateCreate
+
+
+def seed_admin():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    admin = User(id=1, username="admin", email="admin@example.com", hashed_password="x", is_staff=True)
+    db.add(admin)
+    db.commit()
+    token = create_user_token(admin)
+    db.close()
+    return {"Authorization": f"Bearer {token}"}
+
+
+def write_csv(path: str, rows: int, prefix: str):
+    deadline = (datetime.now() + timedelta(days=30)).isoformat()
+    with open(path, "w") as handle:
+        handle.write("plate_number,description,deadline\n")
+        for i in range(rows):
+            handle.write(f'{prefix}{i:07d},"Imported plate {i}",{deadline}\n')
+
+
+async def one_by_one(rows: int) -> float:
+    deadline = datetime.now() + timedelta(days=30)
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        for i in range(rows):
+            await crud.create_plate(db, AutoPlateCreate(
+                plate_number=f"S{i:07d}", description=f"Single plate {i}", deadline=deadline
+            ), user_id=1)
+    return rows / (time.perf_counter() - started)
+
+
+async def upload(path: str, headers: dict) -> dict:
+    async def body():
+        async for chunk in bulk.file_chunks(path):
+            yield chunk
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.post(
+            "/plates/import", content=body(), headers={**headers, "Content-Type": "text/csv"}
+        )
+    return response.json()
+
+
+def seed_bids(plates: int, per_plate: int):
+    # Every tenth plate gets a few bids from different users
+    users = [{"id": 100 + n, "username": f"bidder{n}", "email": f"bidder{n}@example.com", "hashed_password": "x"}
+             for n in range(per_plate)]
+    rows = [{"plate_id": plate_id, "user_id": 100 + n, "amount": 100 + n}
+            for plate_id in range(1, plates + 1, 10) for n in range(per_plate)]
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), users)
+        connection.execute(insert(Bid.__table__), rows)
+    return len(rows)
+
+
+async def export(fmt: str):
+    started = time.perf_counter()
+    size = 0
+    async for chunk in bulk.export_plates(fmt):
+        size += len(chunk)
+    return time.perf_counter() - started, size
+
+
+async def run(args):
+    headers = seed_admin()
+    results = {"rows": args.rows}
+    results["one_by_one_rows_per_sec"] = round(await one_by_one(args.baseline_rows), 1)
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), "plates.csv")
+    write_csv(path, args.rows, "B")
+    started = time.perf_counter()
+    outcome = await upload(path, headers)
+    elapsed = time.perf_counter() - started
+    results["import"] = {
+        "inserted": outcome["inserted"],
+        "failed": outcome["failed"],
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round(outcome["rows"] / elapsed, 1),
+    }
+
+    bids = seed_bids(args.rows + args.baseline_rows, 3)
+    plates = args.rows + args.baseline_rows
+    for fmt in bulk.FORMATS:
+        elapsed, size = await export(fmt)
+        results[f"export_{fmt}"] = {
+            "plates": plates,
+            "bids": bids,
+            "megabytes": round(size / 1e6, 1),
+            "seconds": round(elapsed, 2),
+            "plates_per_sec": round(plates / elapsed, 1),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export throughput")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--baseline-rows", type=int, default=2000)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
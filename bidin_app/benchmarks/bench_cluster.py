@@ -0,0 +1,197 @@
+# Throughput of coordinated workers (serve.py) as they go from 1 to 8.
+#
+#   cd bidin_app && python -m benchmarks.bench_cluster --workers 1 2 4 8
+#   cd bidin_app && python -m benchmarks.bench_cluster --workers 4 --backend off
+#
+# Each worker process runs the app, lifespan included so it joins the cluster, and drives its
+# share of the clients through ASGITransport. The broker runs in this process, as it does
+# under serve.py. Clients bid on random plates and read plate details (--read-ratio), so with
+# N workers about (N-1)/N of the bids are forwarded to the plate's owner. --backend off runs
+# the same workers uncoordinated, to show what the coordination costs.
+#
+# forwarded   bids sent to another worker's owner, summed over the workers
+# consistent  afterwards every plate's price equals its highest bid
+# Scaling needs as many cores as workers (os.cpu_count() is reported); bids all still take
+# SQLite's single write lock, reads don't.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.common import report, summarize, use_temp_database
+
+
+def seed(args) -> Dict:
+    from sqlalchemy import insert
+    from database import Base, engine
+    from dependencies import create_user_token
+    from models import AutoPlate, User
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    users = [User(id=i, username=f"user{i}", email=f"user{i}@example.com", hashed_password="x", is_staff=False)
+             for i in range(1, args.concurrency + 1)]
+    deadline = datetime.now() + timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": user.id, "username": user.username, "email": user.email, "hashed_password": "x", "is_staff": False}
+            for user in users
+        ])
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": plate_id, "plate_number": f"CL{plate_id:06d}", "description": f"Plate {plate_id}",
+             "deadline": deadline, "is_active": True, "created_by_id": 1, "current_highest_amount": 100}
+            for plate_id in range(1, args.plates + 1)
+        ])
+    return {"users": [(user.id, create_user_token(user)) for user in users],
+            "plate_ids": list(range(1, args.plates + 1))}
+
+
+def inconsistent_plates() -> int:
+    from sqlalchemy import func, select
+    from database import SessionLocal
+    from models import AutoPlate, Bid
+
+    highest = select(Bid.plate_id, func.max(Bid.amount).label("amount")).group_by(Bid.plate_id).subquery()
+    db = SessionLocal()
+    try:
+        return db.scalar(
+            select(func.count()).select_from(AutoPlate)
+            .join(highest, highest.c.plate_id == AutoPlate.id)
+            .where(AutoPlate.current_highest_amount != highest.c.amount)
+        )
+    finally:
+        db.close()
+
+
+async def drive(job: Dict, start, finish) -> Dict:
+    import httpx
+    from main import app
+    from cluster import cluster
+
+    rng = random.Random(job["seed"])
+    prices: Dict[int, float] = {}
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    bids = [0]
+    counter = iter(range(job["requests"]))
+
+    async def client_loop(client, user_id: int, token: str):
+        headers = {"Authorization": f"Bearer {token}"}
+        bid_ids: Dict[int, int] = {}
+        for _ in counter:
+            plate_id = rng.choice(job["plate_ids"])
+            started = time.perf_counter()
+            if rng.random() < job["read_ratio"]:
+                response = await client.get(f"/plates/{plate_id}", params={"limit": 1})
+                if response.status_code == 200:
+                    prices[plate_id] = max(prices.get(plate_id, 100), response.json()["current_highest_amount"])
+            else:
+                bids[0] += 1
+                amount = prices.get(plate_id, 100) + rng.randint(1, 20)
+                body = {"plate_id": plate_id, "amount": amount}
+                if plate_id in bid_ids:
+                    response = await client.put(f"/bids/{bid_ids[plate_id]}", json=body, headers=headers)
+                else:
+                    response = await client.post("/bids/", json=body, headers=headers)
+                if response.status_code == 200:
+                    bid_ids[plate_id] = response.json()["id"]
+                    prices[plate_id] = max(prices.get(plate_id, 100), amount)
+                else:
+                    # Outbid meanwhile, most likely through another worker
+                    prices[plate_id] = prices.get(plate_id, 100) + rng.randint(1, 20)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            await asyncio.to_thread(start.wait)
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(client, user_id, token) for user_id, token in job["users"]))
+            elapsed = time.perf_counter() - started
+            stats = cluster.metrics()
+            # Stay up until every worker is done, the others may still forward bids here
+            await asyncio.to_thread(finish.wait)
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed,
+            "bids": bids[0], "forwarded": stats["calls"]}
+
+
+def run_worker(job: Dict, start, finish, results):
+    # cluster.py reads these at import
+    os.environ.update({
+        "CLUSTER": job["backend"], "CLUSTER_SOCKET": job["socket"],
+        "CLUSTER_WORKERS": str(job["workers"]), "CLUSTER_WORKER_ID": str(job["worker"]),
+    })
+    results.put(asyncio.run(drive(job, start, finish)))
+
+
+def run(workers: int, fx: Dict, args, socket: str) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    start, finish = context.Barrier(workers), context.Barrier(workers)
+    results = context.Queue()
+    processes = []
+    for worker in range(workers):
+        job = {
+            "backend": args.backend, "socket": socket, "workers": workers, "worker": worker,
+            # The same clients and plates however many workers share them
+            "users": fx["users"][worker::workers],
+            "plate_ids": fx["plate_ids"], "read_ratio": args.read_ratio, "seed": args.seed * 1000 + worker,
+            "requests": args.requests // workers + (worker < args.requests % workers),
+        }
+        process = context.Process(target=run_worker, args=(job, start, finish, results))
+        process.start()
+        processes.append(process)
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [sample for outcome in outcomes for sample in outcome["latencies"]]
+    statuses = sum((outcome["statuses"] for outcome in outcomes), Counter())
+    summary = summarize(latencies, max(outcome["elapsed"] for outcome in outcomes), statuses)
+    bids = sum(outcome["bids"] for outcome in outcomes)
+    summary["forwarded"] = sum(outcome["forwarded"] for outcome in outcomes)
+    summary["forwarded_share"] = round(summary["forwarded"] / bids, 2) if bids > 0 else 0.0
+    summary["consistent"] = inconsistent_plates() == 0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker throughput")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--backend", default="local", choices=("local", "off"))
+    parser.add_argument("--requests", type=int, default=4000, help="Per run, over all workers")
+    parser.add_argument("--concurrency", type=int, default=32, help="Clients per run, split over the workers")
+    parser.add_argument("--plates", type=int, default=200)
+    parser.add_argument("--read-ratio", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    # Clients are split over the workers, not multiplied: every run has the same ones
+    args.concurrency = max(args.concurrency, max(args.workers))
+    args.workers.sort()
+
+    if "DATABASE_URL" not in os.environ:
+        # The worker processes inherit it
+        use_temp_database("cluster")
+    socket = os.path.join(os.path.dirname(os.environ["DATABASE_URL"].split("///", 1)[-1]) or ".", "cluster.sock")
+    if args.backend == "local":
+        from serve import start_broker
+        start_broker(socket)
+
+    results = {"cpus": os.cpu_count(), "backend": args.backend, "requests": args.requests,
+               "clients": args.concurrency, "read_ratio": args.read_ratio, "runs": {}}
+    for workers in args.workers:
+        fx = seed(args)
+        results["runs"][workers] = run(workers, fx, args, socket)
+    base = results["runs"][args.workers[0]]["req_per_sec"]
+    for summary in results["runs"].values():
+        summary["speedup"] = round(summary["req_per_sec"] / base, 2) if base else None
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
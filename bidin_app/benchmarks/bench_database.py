@@ -0,0 +1,149 @@
+# Write-lock contention between bids and reads, per database configuration.
+#
+#   cd bidin_app && python -m benchmarks.bench_database --writers 4 --readers 8 --seconds 10
+#
+# Engines come from database.build_engine with different DatabaseSettings, one fresh file
+# each. Writer threads commit bid-shaped transactions (conditional plate UPDATE + bid
+# INSERT) while reader threads run the price-ordered listing query and a bid history
+# read, each thread on its own pooled connection:
+#   rollback_journal  the old defaults: no pragmas (DELETE journal, synchronous=FULL)
+#   wal               the new defaults: WAL, synchronous=NORMAL, mmap and a larger page cache
+# "lock_errors" are statements that gave up with "database is locked" after the busy timeout.
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import percentile, report, use_temp_database
+
+use_temp_database("database")
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from crud import plate_list_query
+from database import Base, DatabaseSettings, build_engine
+from models import AutoPlate, Bid, User
+
+CONFIGS = {
+    "rollback_journal": dict(journal_mode="DELETE", synchronous="FULL", mmap_size=0, cache_size=-2000),
+    "wal": {},
+}
+
+
+def seed(engine, plates: int):
+    Base.metadata.create_all(bind=engine)
+    deadline = datetime.now() + timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [{"id": 1, "username": "admin", "email": "a@example.com"}])
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": i, "plate_number": f"DB{i:06d}", "description": f"Plate {i}", "is_active": True,
+             "created_by_id": 1, "deadline": deadline + timedelta(seconds=i),
+             "current_highest_amount": 0, "bid_count": 0}
+            for i in range(1, plates + 1)
+        ])
+
+
+def run_config(name: str, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), f"{name}.db")
+    settings = DatabaseSettings(url=f"sqlite:///{path}", pool_size=args.writers + args.readers,
+                                busy_timeout_ms=args.busy_timeout_ms, **CONFIGS[name])
+    engine = build_engine(settings)
+    seed(engine, args.plates)
+    listing = plate_list_query([AutoPlate.id, AutoPlate.plate_number, AutoPlate.current_highest_amount],
+                               ordering="-price", limit=args.page_size)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    write_latencies, read_latencies = [], []
+    lock_errors = [0]
+    next_amount = [0]
+
+    def writer(seed: int):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            with lock:
+                next_amount[0] += 1
+                amount = next_amount[0]
+            plate_id = rng.randint(1, args.plates)
+            started = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        update(AutoPlate)
+                        .where(AutoPlate.id == plate_id, AutoPlate.current_highest_amount < amount)
+                        .values(current_highest_amount=amount, leading_user_id=amount,
+                                bid_count=AutoPlate.bid_count + 1, last_bid_at=datetime.utcnow())
+                    )
+                    connection.execute(insert(Bid.__table__).values(
+                        plate_id=plate_id, user_id=amount, amount=amount, created_at=datetime.utcnow()))
+            except OperationalError:
+                with lock:
+                    lock_errors[0] += 1
+                continue
+            write_latencies.append(time.perf_counter() - started)
+
+    def reader(seed: int):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.execute(listing).all()
+                    connection.execute(
+                        select(Bid.id, Bid.amount).where(Bid.plate_id == rng.randint(1, args.plates))
+                        .order_by(Bid.created_at.desc()).limit(100)
+                    ).all()
+            except OperationalError:
+                with lock:
+                    lock_errors[0] += 1
+                continue
+            read_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(100 + i,)) for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    def summary(samples):
+        return {
+            "per_sec": round(len(samples) / args.seconds, 1),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "max_ms": round(max(samples, default=0) * 1000, 2),
+        }
+
+    return {
+        "journal_mode": settings.journal_mode,
+        "synchronous": settings.synchronous,
+        "commits": summary(write_latencies),
+        "reads": summary(read_latencies),
+        "lock_errors": lock_errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite write-lock contention")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--plates", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--busy-timeout-ms", type=int, default=DatabaseSettings.busy_timeout_ms)
+    args = parser.parse_args()
+    results = {name: run_config(name, args) for name in CONFIGS}
+    before, after = results["rollback_journal"]["commits"], results["wal"]["commits"]
+    results["commit_speedup"] = round(after["per_sec"] / before["per_sec"], 1) if before["per_sec"] else None
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# What the request instrumentation costs.
+#
+#   cd bidin_app && python -m benchmarks.bench_metrics --requests 20000
+#
+# middleware   a bare ASGI app called directly vs wrapped in MetricsMiddleware, so the
+#              difference is the middleware alone (contextvar, timers, five observations)
+# sql_hooks    SELECT 1 on a sync SQLite connection with the cursor listeners removed vs
+#              attached, inside a request context
+# scrape       rendering /metrics once every route has a series
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import percentile, report, use_temp_database
+
+use_temp_database("metrics")
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import metrics
+from database import engine
+from metrics import MetricsMiddleware, RequestStats, current_request, registry
+
+
+class Route:
+    path = "/plates/{plate_id}"
+
+
+async def bare_app(scope, receive, send):
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def call_many(app, count: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await app({"type": "http", "method": "GET", "path": "/plates/1"}, receive, send)
+    return time.perf_counter() - started
+
+
+def per_call_us(seconds: float, count: int) -> float:
+    return round(seconds / count * 1e6, 2)
+
+
+def bench_middleware(count: int) -> dict:
+    bare = asyncio.run(call_many(bare_app, count))
+    wrapped = asyncio.run(call_many(MetricsMiddleware(bare_app, slow_request_ms=0), count))
+    return {"bare_us": per_call_us(bare, count), "instrumented_us": per_call_us(wrapped, count),
+            "overhead_us": per_call_us(wrapped - bare, count)}
+
+
+def select_many(count: int) -> float:
+    token = current_request.set(RequestStats())
+    try:
+        with engine.connect() as connection:
+            statement = text("SELECT 1")
+            started = time.perf_counter()
+            for _ in range(count):
+                connection.execute(statement).scalar()
+            return time.perf_counter() - started
+    finally:
+        current_request.reset(token)
+
+
+def bench_sql_hooks(count: int) -> dict:
+    select_many(100)
+    hooks = (("before_cursor_execute", metrics._before_cursor_execute),
+             ("after_cursor_execute", metrics._after_cursor_execute))
+    for name, fn in hooks:
+        event.remove(Engine, name, fn)
+    bare = select_many(count)
+    for name, fn in hooks:
+        event.listen(Engine, name, fn)
+    hooked = select_many(count)
+    return {"bare_us": per_call_us(bare, count), "instrumented_us": per_call_us(hooked, count),
+            "overhead_us": per_call_us(hooked - bare, count)}
+
+
+def bench_scrape(routes: int, repeat: int) -> dict:
+    registry.clear()
+    for i in range(routes):
+        for method in ("GET", "POST"):
+            labels = (method, f"/route/{i}")
+            metrics.http_requests.inc(*labels, "200")
+            metrics.http_latency.observe(0.004, *labels)
+            metrics.http_db_time.observe(0.002, *labels)
+            metrics.http_serialize_time.observe(0.0005, *labels)
+            metrics.http_queries.observe(3, *labels)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = registry.render()
+        samples.append(time.perf_counter() - started)
+    return {"series": routes * 2, "bytes": len(body), "p50_ms": round(percentile(samples, 50) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request instrumentation overhead")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--routes", type=int, default=30)
+    args = parser.parse_args()
+    report({
+        "middleware": bench_middleware(args.requests),
+        "sql_hooks": bench_sql_hooks(args.requests),
+        "scrape": bench_scrape(args.routes, 50),
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Plate number search: in-memory gram index vs the LIKE '%x%' scan.
+#
+#   cd bidin_app && python -m benchmarks.bench_plate_search --plates 1000000
+#
+# "index_ms" is the lookup alone; "like_ms" and "indexed_ms" are the first page of
+# GET /plates/ as SQL, without and with the index narrowing the candidates.
+import argparse
+import random
+import resource
+import string
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import percentile, report, use_temp_database
+
+use_temp_database("plate_search")
+
+from sqlalchemy import insert
+
+from crud import plate_list_query
+from database import Base, engine
+from models import AutoPlate
+from plate_search import plate_index
+
+QUERIES = {
+    "contains": [{"contains": "7A1"}, {"contains": "123"}, {"contains": "BC9"}, {"contains": "01A"}],
+    "startswith": [{"startswith": "01A"}, {"startswith": "77Z9"}, {"startswith": "40K12"}],
+    "pattern": [{"pattern": "7?7?7"}, {"pattern": "1?1"}, {"pattern": "A?9?C"}],
+}
+
+
+def random_plate(rng: random.Random) -> str:
+    # Regional code, letter, three digits, two letters: 01A123BC
+    return (f"{rng.randint(1, 95):02d}{rng.choice(string.ascii_uppercase)}"
+            f"{rng.randint(0, 999):03d}{''.join(rng.choices(string.ascii_uppercase, k=2))}")
+
+
+def seed(count: int, rng: random.Random):
+    Base.metadata.create_all(bind=engine)
+    deadline = datetime.now() + timedelta(days=1)
+    numbers = set()
+    while len(numbers) < count:
+        numbers.add(random_plate(rng))
+    rows = [
+        {"id": i, "plate_number": number, "description": "", "is_active": True, "created_by_id": 1,
+         "deadline": deadline + timedelta(seconds=i)}
+        for i, number in enumerate(numbers, start=1)
+    ]
+    with engine.begin() as connection:
+        for start in range(0, len(rows), 50000):
+            connection.execute(insert(AutoPlate), rows[start:start + 50000])
+    return [(row["id"], row["plate_number"]) for row in rows]
+
+
+def timed(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return round(percentile(samples, 50) * 1000, 3), result
+
+
+def run_page(connection, search):
+    query = plate_list_query((AutoPlate.id,), search.get("contains"), "deadline", None, 100,
+                             search.get("startswith"), search.get("pattern"))
+    return connection.execute(query).all()
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    rows = seed(args.plates, rng)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    plate_index.load(rows)
+    build_seconds = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results = {
+        "plates": args.plates,
+        "index_build_seconds": round(build_seconds, 2),
+        "index_rss_mb": round((rss_after - rss_before) / 1024, 1),
+        "grams": len(plate_index.postings),
+        "queries": [],
+    }
+    with engine.connect() as connection:
+        for kind, searches in QUERIES.items():
+            for search in searches:
+                index_ms, matches = timed(lambda: plate_index.search(**search), args.repeat)
+                indexed_ms, page = timed(lambda: run_page(connection, search), args.repeat)
+                plate_index.ready = False
+                like_ms, like_page = timed(lambda: run_page(connection, search), args.repeat)
+                plate_index.ready = True
+                results["queries"].append({
+                    "kind": kind,
+                    **search,
+                    # None means the index declined and the query ran as LIKE anyway
+                    "matches": None if matches is None else len(matches),
+                    "index_ms": index_ms,
+                    "indexed_ms": indexed_ms,
+                    "like_ms": like_ms,
+                    "same_page": [r.id for r in page] == [r.id for r in like_page],
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plate search index vs LIKE")
+    parser.add_argument("--plates", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    report(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# Thousands of competing proxy (max) bids on one plate.
+#
+#   cd bidin_app && python -m benchmarks.bench_proxy_bidding --proxies 5000 --http-proxies 1000
+#
+# "simulation" feeds proxies to proxy_bidding.resolve in memory and counts the bid
+# writes it needs, against users re-posting by hand: each time someone is outbid they
+# bid one increment more until their maximum is reached. "http" registers proxies
+# through POST /bids/proxy and checks the final price and leader in the database.
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from benchmarks.common import percentile, report, use_temp_database
+
+use_temp_database("proxy_bidding")
+
+import httpx
+from sqlalchemy import insert
+
+from database import Base, SessionLocal, engine
+from dependencies import create_user_token
+from main import app
+from models import AutoPlate, User
+from proxy_bidding import Proxy, increment_for, rank, resolve
+
+
+def random_maximums(count: int, rng: random.Random):
+    return [Decimal(rng.randint(100, 200000)) for _ in range(count)]
+
+
+def expected_outcome(maximums):
+    proxies = rank(Proxy(user_id, amount, datetime(2030, 1, 1), user_id)
+                   for user_id, amount in enumerate(maximums, start=1))
+    top, second = proxies[0], proxies[1]
+    if top.max_amount == second.max_amount:
+        return top.user_id, top.max_amount
+    return top.user_id, min(top.max_amount, second.max_amount + increment_for(second.max_amount))
+
+
+def simulate_engine(maximums):
+    # Keeps only the top two proxies, exactly what the database query returns
+    price, leader, top_two, writes = Decimal(0), None, [], 0
+    started = time.perf_counter()
+    base = datetime(2030, 1, 1)
+    for user_id, amount in enumerate(maximums, start=1):
+        if leader != user_id and amount <= price:
+            continue
+        arrival = Proxy(user_id, amount, base + timedelta(microseconds=user_id), user_id)
+        top_two = rank(top_two + [arrival])[:2]
+        resolution = resolve(price, leader, top_two)
+        if resolution is not None:
+            price, leader = resolution.price, resolution.leader_id
+            writes += 2 if resolution.runner_up_id is not None else 1
+    return price, leader, writes, time.perf_counter() - started
+
+
+def simulate_reposting(maximums):
+    # Every outbid user keeps bidding price + increment while it stays within their maximum
+    price, leader, writes = Decimal(0), None, 0
+    active = list(enumerate(maximums, start=1))
+    changed = True
+    while changed:
+        changed = False
+        for user_id, amount in active:
+            if user_id == leader:
+                continue
+            bid = price + increment_for(price)
+            if bid <= amount:
+                price, leader, writes, changed = bid, user_id, writes + 1, True
+    return price, leader, writes
+
+
+def seed(count: int):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": i, "username": f"proxy{i}", "email": f"proxy{i}@example.com", "hashed_password": "x"}
+            for i in range(1, count + 1)
+        ])
+        connection.execute(insert(AutoPlate.__table__), [{
+            "id": 1, "plate_number": "PRX001", "description": "", "is_active": True, "created_by_id": 1,
+            "deadline": datetime.now() + timedelta(days=1), "current_highest_amount": 0, "bid_count": 0,
+        }])
+    db = SessionLocal()
+    tokens = {user.id: {"Authorization": f"Bearer {create_user_token(user)}"} for user in db.query(User)}
+    db.close()
+    return tokens
+
+
+async def run_http(maximums, concurrency: int):
+    tokens = seed(len(maximums))
+    transport = httpx.ASGITransport(app=app)
+    latencies, statuses = [], {}
+    queue = list(enumerate(maximums, start=1))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while queue:
+                user_id, amount = queue.pop()
+                started = time.perf_counter()
+                response = await client.post("/bids/proxy", json={"plate_id": 1, "max_amount": float(amount)},
+                                             headers=tokens[user_id])
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    plate = db.get(AutoPlate, 1)
+    db.close()
+    # Rejected registrations (already below the price when they arrived) don't compete
+    return {
+        "proxies": len(maximums),
+        "statuses": statuses,
+        "registrations_per_sec": round(len(maximums) / elapsed, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "bid_rows": plate.bid_count,
+        "final_price": float(plate.current_highest_amount),
+        "leader": plate.leading_user_id,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proxy bidding simulation")
+    parser.add_argument("--proxies", type=int, default=5000)
+    parser.add_argument("--http-proxies", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    maximums = random_maximums(args.proxies, rng)
+    price, leader, writes, elapsed = simulate_engine(maximums)
+    manual_price, manual_leader, manual_writes = simulate_reposting(maximums)
+    expected_leader, expected_price = expected_outcome(maximums)
+    results = {
+        "simulation": {
+            "proxies": args.proxies,
+            "arrivals_per_sec": round(args.proxies / elapsed, 1),
+            "engine_bid_writes": writes,
+            "reposting_bid_writes": manual_writes,
+            "final_price": float(price),
+            "reposting_final_price": float(manual_price),
+            "matches_expected": (leader, price) == (expected_leader, expected_price),
+        },
+    }
+
+    http_maximums = random_maximums(args.http_proxies, rng)
+    outcome = asyncio.run(run_http(http_maximums, args.concurrency))
+    expected_leader, expected_price = expected_outcome(http_maximums)
+    outcome["matches_expected"] = (outcome["leader"], outcome["final_price"]) == (expected_leader, float(expected_price))
+    results["http"] = outcome
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
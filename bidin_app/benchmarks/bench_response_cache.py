@@ -0,0 +1,99 @@
+# Public plate reads with and without the response cache.
+#
+#   cd bidin_app && python -m benchmarks.bench_response_cache --plates 5000 --requests 5000
+#
+# Clients read the first listing page (two orderings) and the details of a few hot
+# plates. "--write-every" places a bid every N reads, which invalidates the plate's
+# pages and every listing page, so the hit rate reflects a live auction.
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, run_load, use_temp_database
+
+use_temp_database("response_cache")
+
+import httpx
+from sqlalchemy import insert
+
+from database import Base, SessionLocal, engine
+from dependencies import create_user_token
+from main import app
+from models import AutoPlate, Bid, User
+from response_cache import response_cache, MemoryBackend
+
+
+def seed(plates: int, bids_per_plate: int, writers: int):
+    Base.metadata.create_all(bind=engine)
+    deadline = datetime.now() + timedelta(days=1)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": i, "username": f"reader{i}", "email": f"reader{i}@example.com", "hashed_password": "x"}
+            for i in range(1, bids_per_plate + writers + 1)
+        ])
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": i, "plate_number": f"RC{i:06d}", "description": f"Plate {i}", "is_active": True,
+             "created_by_id": 1, "deadline": deadline + timedelta(seconds=i),
+             "current_highest_amount": 100 * bids_per_plate, "bid_count": bids_per_plate}
+            for i in range(1, plates + 1)
+        ])
+        connection.execute(insert(Bid.__table__), [
+            {"plate_id": plate_id, "user_id": user_id, "amount": 100 * user_id}
+            for plate_id in range(1, plates + 1) for user_id in range(1, bids_per_plate + 1)
+        ])
+    db = SessionLocal()
+    # Each write comes from a fresh bidder: a second bid on a plate would have to be an update
+    writers = db.query(User).filter(User.id > bids_per_plate).order_by(User.id).all()
+    headers = [{"Authorization": f"Bearer {create_user_token(user)}"} for user in writers]
+    db.close()
+    return headers
+
+
+async def measure(client, args, headers, price, rng: random.Random):
+    hot = list(range(1, 21))
+    paths = ["/plates/", "/plates/?ordering=-price"] + [f"/plates/{plate_id}" for plate_id in hot]
+
+    async def send(i: int) -> int:
+        if args.write_every and i % args.write_every == args.write_every - 1:
+            price[0] += 1
+            response = await client.post("/bids/", json={"plate_id": rng.choice(hot), "amount": price[0]},
+                                         headers=headers[i // args.write_every])
+            return response.status_code
+        response = await client.get(rng.choice(paths))
+        return response.status_code
+
+    return await run_load(send, args.requests, args.concurrency)
+
+
+async def run(args):
+    # Both runs write, so they each get their own bidders and keep raising one price
+    headers = seed(args.plates, args.bids, 2 * (args.requests // max(1, args.write_every) + 1))
+    price = [100 * args.bids]
+    transport = httpx.ASGITransport(app=app)
+    results = {"plates": args.plates, "write_every": args.write_every}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, backend in (("uncached", None), ("cached", MemoryBackend())):
+            response_cache.backend = backend
+            response_cache.clear()
+            results[name] = await measure(client, args, headers[name == "cached"::2], price,
+                                          random.Random(args.seed))
+            results[name]["cache"] = response_cache.metrics()
+    results["speedup"] = round(results["cached"]["req_per_sec"] / results["uncached"]["req_per_sec"], 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response cache on public plate endpoints")
+    parser.add_argument("--plates", type=int, default=5000)
+    parser.add_argument("--bids", type=int, default=20, help="Bids per plate")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--write-every", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+    report(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
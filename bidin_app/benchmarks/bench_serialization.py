@@ -0,0 +1,112 @@
+# Serialization cost per 10k rows: the old validate-through-pydantic paths vs column
+# tuples dumped in one pass.
+#
+#   cd bidin_app && python -m benchmarks.bench_serialization --rows 10000
+#
+# "pydantic" mirrors what FastAPI does with a response_model (validate, dump to JSON
+# types, json.dumps); "orm" is the old GET /bids/ path from ORM objects with
+# from_attributes. "orjson" and "stdlib" are serialization.dumps with and without orjson.
+# No database is involved: the rows are what the queries return.
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+from benchmarks.common import percentile, report
+
+from pydantic import TypeAdapter
+
+import serialization
+from models import Bid
+from schemas import AutoPlateResponse, BidResponse
+from serialization import dumps, rows_as_dicts
+
+BID_FIELDS = ("id", "amount", "plate_id", "user_id", "created_at")
+
+
+def plate_rows(count: int):
+    deadline = datetime(2030, 1, 1, 12, 0, 0)
+    return [
+        (i, f"AA{i:06d}", f"Plate number {i}", deadline + timedelta(seconds=i), True, 1,
+         Decimal(f"{i % 5000}.50"), i % 40, i % 97 or None, deadline - timedelta(minutes=i % 600), None,
+         deadline, i)
+        for i in range(1, count + 1)
+    ]
+
+
+def bid_rows(count: int):
+    created = datetime(2030, 1, 1, 12, 0, 0, 123456)
+    return [(i, Decimal(f"{100 + i}.00"), i % 500 + 1, i % 1000 + 1, created + timedelta(seconds=i))
+            for i in range(1, count + 1)]
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        samples.append(time.perf_counter() - started)
+    return round(percentile(samples, 50) * 1000, 2), body
+
+
+def pydantic_body(adapter: TypeAdapter, items) -> bytes:
+    return json.dumps(adapter.dump_python(adapter.validate_python(items), mode="json"),
+                      separators=(",", ":")).encode()
+
+
+def fast_paths(names, rows, repeat: int):
+    results = {}
+    module = serialization.orjson
+    for name, backend in (("orjson", module), ("stdlib", None)):
+        if name == "orjson" and module is None:
+            continue
+        serialization.orjson = backend
+        results[name] = timed(lambda: dumps(rows_as_dicts(names, rows)), repeat)
+    serialization.orjson = module
+    return results
+
+
+def scaled(ms: float, rows: int) -> float:
+    return round(ms * 10000 / rows, 2)
+
+
+def run(args):
+    results = {"rows": args.rows, "orjson_installed": serialization.orjson is not None}
+
+    plates = plate_rows(args.rows)
+    names: List[str] = list(AutoPlateResponse.model_fields)
+    adapter = TypeAdapter(List[AutoPlateResponse])
+    slow_ms, slow_body = timed(
+        lambda: pydantic_body(adapter, [{name: row[i] for i, name in enumerate(names)} for row in plates]),
+        args.repeat,
+    )
+    fast = fast_paths(names, plates, args.repeat)
+    results["plate_list"] = {"pydantic_ms_per_10k": scaled(slow_ms, args.rows)}
+    for name, (ms, body) in fast.items():
+        results["plate_list"][f"{name}_ms_per_10k"] = scaled(ms, args.rows)
+        results["plate_list"][f"{name}_matches"] = json.loads(body) == json.loads(slow_body)
+
+    bids = bid_rows(args.rows)
+    objects = [Bid(**dict(zip(BID_FIELDS, row))) for row in bids]
+    adapter = TypeAdapter(List[BidResponse])
+    slow_ms, slow_body = timed(lambda: pydantic_body(adapter, objects), args.repeat)
+    fast = fast_paths(BID_FIELDS, bids, args.repeat)
+    results["bid_list"] = {"orm_ms_per_10k": scaled(slow_ms, args.rows)}
+    for name, (ms, body) in fast.items():
+        results["bid_list"][f"{name}_ms_per_10k"] = scaled(ms, args.rows)
+        results["bid_list"][f"{name}_matches"] = json.loads(body) == json.loads(slow_body)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialization cost")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+    report(run(args))
+
+
+if __name__ == "__main__":
+    main()
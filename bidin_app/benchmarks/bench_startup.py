@@ -0,0 +1,125 @@
+# Cold start: how long a fresh worker process takes to import the app, finish its lifespan
+# startup, and answer its first requests, with the lifespan prewarm on and off.
+#
+#   cd bidin_app && python -m benchmarks.bench_startup --runs 5
+#
+# Every run is a new interpreter (as a scaled-out worker would be) against the same seeded
+# database. Medians over --runs:
+#
+# import_ms    `import main`, which builds the app with create_app()
+# startup_ms   the lifespan up to ready: order books, scheduler, search index, analytics,
+#              plus the prewarm when it is on
+# first_ms     each endpoint's first request once ready, the latency a client routed to
+#              the new worker sees: plate detail, own bids (token check), login page,
+#              OpenAPI schema, and a password login (bcrypt worker process)
+# ready_ms     import_ms + startup_ms, when /readyz starts answering 200
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import report, use_temp_database
+
+FIRST_REQUESTS = ("plate_detail", "own_bids", "login_page", "openapi", "password_login")
+
+
+def seed(args):
+    from sqlalchemy import insert
+    from database import Base, engine
+    from hashing import password_context
+    from models import AutoPlate, Bid, User
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    deadline = datetime.now() + timedelta(days=1)
+    hashed = password_context().hash("benchpassword")
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": hashed,
+             "is_staff": i == 1}
+            for i in range(1, args.users + 1)
+        ])
+        connection.execute(insert(AutoPlate.__table__), [
+            {"id": i, "plate_number": f"ST{i:06d}", "description": "", "deadline": deadline,
+             "is_active": True, "created_by_id": 1}
+            for i in range(1, args.plates + 1)
+        ])
+        connection.execute(insert(Bid.__table__), [
+            {"plate_id": i % args.plates + 1, "user_id": i % args.users + 1, "amount": 100 + i}
+            for i in range(args.plates)
+        ])
+
+
+async def cold_start() -> dict:
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    import httpx
+    from dependencies import create_access_token
+
+    timings = {"import_ms": (imported - started) * 1000}
+    app = main.app
+    async with app.router.lifespan_context(app):
+        timings["startup_ms"] = (time.perf_counter() - imported) * 1000
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            assert (await client.get("/readyz")).status_code == 200
+            token = create_access_token({"sub": "user2", "uid": 2, "staff": False})
+            requests = {
+                "plate_detail": lambda: client.get("/plates/1"),
+                "own_bids": lambda: client.get("/bids/", headers={"Authorization": f"Bearer {token}"}),
+                "login_page": lambda: client.get("/login"),
+                "openapi": lambda: client.get("/openapi.json"),
+                "password_login": lambda: client.post(
+                    "/auth/login", data={"username": "user3", "password": "benchpassword"}),
+            }
+            for name in FIRST_REQUESTS:
+                request_started = time.perf_counter()
+                response = await requests[name]()
+                assert response.status_code == 200, (name, response.status_code, response.text[:200])
+                timings[f"first_{name}_ms"] = (time.perf_counter() - request_started) * 1000
+    timings["ready_ms"] = timings["import_ms"] + timings["startup_ms"]
+    return timings
+
+
+def run_child(prewarm: bool) -> dict:
+    env = {**os.environ, "APP_PREWARM": "1" if prewarm else "0"}
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--plates", type=int, default=10000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(cold_start())))
+        return
+
+    if "DATABASE_URL" not in os.environ:
+        # The children inherit it
+        use_temp_database("startup")
+    seed(args)
+    results = {"runs": args.runs, "users": args.users, "plates": args.plates}
+    for prewarm in (False, True):
+        samples = [run_child(prewarm) for _ in range(args.runs)]
+        results["prewarm" if prewarm else "no_prewarm"] = {
+            name: round(statistics.median(sample[name] for sample in samples), 1) for name in samples[0]
+        }
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
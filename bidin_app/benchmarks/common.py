@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List
+
+# Benchmarks drive the app from a single client address, which the rate limiter would
+# mostly answer with 429s. Set RATE_LIMIT explicitly to measure it.
+os.environ.setdefault("RATE_LIMIT", "off")
+
+
+def use_temp_database(name: str = "bench") -> str:
+    # Must run before the app modules are imported, database.py reads DATABASE_URL at import time
+    path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), f"{name}.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    return path
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float, statuses: Counter = None) -> Dict:
+    summary = {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "req_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    if statuses is not None:
+        summary["statuses"] = {str(code): count for code, count in sorted(statuses.items())}
+    return summary
+
+
+async def run_load(send: Callable[[int], Awaitable[int]], total: int, concurrency: int) -> Dict:
+    # send(i) performs one request and returns its status code
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            status = await send(i)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, statuses)
+
+
+def report(results: Dict):
+    print(json.dumps(results, indent=2, default=str))
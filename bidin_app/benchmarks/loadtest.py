@@ -0,0 +1,332 @@
+# Auction traffic scenarios, in-process or from several load generator processes.
+#
+#   cd bidin_app && python -m benchmarks.loadtest --scenario all --requests 2000
+#   cd bidin_app && python -m benchmarks.loadtest --processes 4 --scenario bid_war
+#   cd bidin_app && python -m benchmarks.loadtest --output before.json
+#   cd bidin_app && python -m benchmarks.loadtest --compare before.json
+#
+# Scenarios:
+#   login_storm   bidders logging in with their passwords (bcrypt on every request)
+#   bid_war       every bidder on one plate in its closing minutes, raising over each other:
+#                 a POST for a bidder's first bid, PUTs after that, and a detail read now and
+#                 then to catch up with the price
+#   browse        listing pages in each ordering, following X-Next-Cursor, and plate
+#                 number searches
+#   poll_detail   detail pages of a few hot plates, revalidated with If-None-Match
+#   mixed         all of the above at once, weighted like a busy evening
+#
+# By default each run seeds a fresh temporary database and talks to the ASGI app through
+# httpx's ASGITransport. With --processes N each process drives its own copy of the app on
+# the shared database, like N server workers. With --url the processes talk HTTP to a
+# running server instead; seed its database first by running with its DATABASE_URL and
+# --seed-only (--reset-database drops the tables there, it is never done implicitly).
+#
+# "db_queries" is the change in bidin_db_queries_total scraped from /metrics around each
+# scenario. A multi-worker server answers the scrape from one worker only, so over --url
+# it undercounts.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.common import report, summarize, use_temp_database
+
+SCENARIOS = ("login_storm", "bid_war", "browse", "poll_detail")
+MIXED_WEIGHTS = {"poll_detail": 40, "browse": 30, "bid_war": 25, "login_storm": 5}
+PASSWORD = "loadtest-password"
+HOT_PLATE = 1
+ORDERINGS = ("deadline", "-deadline", "price", "-price")
+
+
+def seed(args) -> Dict:
+    # Imported here: the database module reads DATABASE_URL, which main() sets first
+    from sqlalchemy import insert
+    from database import Base, engine
+    from hashing import password_context
+    from models import AutoPlate, Bid, User
+
+    if args.reset_database:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(args.seed)
+    # One bcrypt hash for everyone: seeding stays fast and every login still pays full cost
+    hashed_password = password_context().hash(PASSWORD)
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+             "hashed_password": hashed_password, "is_staff": i == 1}
+            for i in range(1, args.users + 1)
+        ])
+        plates, bids = [], []
+        for plate_id in range(1, args.plates + 1):
+            # The hot plate closes during the run; the rest over the next weeks
+            deadline = now + (timedelta(seconds=args.closes_in) if plate_id == HOT_PLATE
+                              else timedelta(days=1, minutes=plate_id))
+            bidders = [] if plate_id == HOT_PLATE else rng.sample(range(2, args.users + 1),
+                                                                    min(args.bids_per_plate, args.users - 1))
+            amounts = sorted(rng.randint(100, 10000) for _ in bidders)
+            for user_id, amount in zip(bidders, amounts):
+                bids.append({"plate_id": plate_id, "user_id": user_id, "amount": amount,
+                             "created_at": now - timedelta(seconds=rng.randint(60, 86400))})
+            plates.append({
+                "id": plate_id, "plate_number": f"{rng.choice('ABCDEFGH')}{rng.choice('KLMNPRST')}{plate_id:06d}",
+                "description": f"Plate {plate_id}", "deadline": deadline, "is_active": True, "created_by_id": 1,
+                "current_highest_amount": amounts[-1] if amounts else 100, "bid_count": len(amounts),
+                "leading_user_id": bidders[-1] if bidders else None, "last_bid_at": now if bidders else None,
+            })
+        connection.execute(insert(AutoPlate.__table__), plates)
+        if bids:
+            connection.execute(insert(Bid.__table__), bids)
+    return fixture(args)
+
+
+def fixture(args) -> Dict:
+    # What the load generators need, picklable for the worker processes
+    from database import SessionLocal
+    from dependencies import create_user_token
+    from models import AutoPlate, User
+
+    db = SessionLocal()
+    try:
+        users = db.query(User).order_by(User.id).all()
+        return {
+            "users": [(user.id, user.username, create_user_token(user)) for user in users],
+            "plate_ids": [plate_id for plate_id, in db.query(AutoPlate.id).order_by(AutoPlate.id)],
+            "plate_numbers": [number for number, in db.query(AutoPlate.plate_number).limit(200)],
+            "hot_price": float(db.get(AutoPlate, HOT_PLATE).current_highest_amount),
+        }
+    finally:
+        db.close()
+
+
+def login_storm(client, fx, rng, state):
+    async def send(i: int) -> int:
+        _, username, _ = rng.choice(fx["users"])
+        response = await client.post("/auth/login", data={"username": username, "password": PASSWORD})
+        return response.status_code
+    return send
+
+
+def bid_war(client, fx, rng, state):
+    # Bidders are split between the generator processes, so a bidder's bid id stays local
+    bidders = fx["users"][1:][state["worker"]::state["workers"]]
+    bid_ids: Dict[int, int] = {}
+    price = [fx["hot_price"]]
+
+    async def send(i: int) -> int:
+        if i % 5 == 4:
+            response = await client.get(f"/plates/{HOT_PLATE}", params={"limit": 1})
+            if response.status_code == 200:
+                price[0] = max(price[0], response.json()["current_highest_amount"])
+            return response.status_code
+        user_id, _, token = bidders[i % len(bidders)]
+        amount = price[0] + rng.randint(1, 20)
+        headers = {"Authorization": f"Bearer {token}"}
+        body = {"plate_id": HOT_PLATE, "amount": amount}
+        if user_id in bid_ids:
+            response = await client.put(f"/bids/{bid_ids[user_id]}", json=body, headers=headers)
+        else:
+            response = await client.post("/bids/", json=body, headers=headers)
+        if response.status_code == 200:
+            bid_ids[user_id] = response.json()["id"]
+            price[0] = max(price[0], amount)
+        else:
+            # Someone got there first: bid higher next time
+            price[0] += rng.randint(1, 20)
+        return response.status_code
+    return send
+
+
+def browse(client, fx, rng, state):
+    cursors: Dict[str, str] = {}
+
+    async def send(i: int) -> int:
+        kind = i % 4
+        if kind < 2:
+            ordering = rng.choice(ORDERINGS)
+            params = {"ordering": ordering}
+            # Keep paging half the time, start over otherwise
+            if ordering in cursors and rng.random() < 0.5:
+                params["cursor"] = cursors[ordering]
+            response = await client.get("/plates/", params=params)
+            if "X-Next-Cursor" in response.headers:
+                cursors[ordering] = response.headers["X-Next-Cursor"]
+            else:
+                cursors.pop(ordering, None)
+        elif kind == 2:
+            number = rng.choice(fx["plate_numbers"])
+            start = rng.randint(0, len(number) - 3)
+            response = await client.get("/plates/", params={"plate_number__contains": number[start:start + 3]})
+        else:
+            response = await client.get("/plates/", params={"plate_number__startswith": rng.choice(fx["plate_numbers"])[:2]})
+        return response.status_code
+    return send
+
+
+def poll_detail(client, fx, rng, state):
+    hot = fx["plate_ids"][:10]
+    etags: Dict[int, str] = {}
+
+    async def send(i: int) -> int:
+        plate_id = rng.choice(hot)
+        headers = {"If-None-Match": etags[plate_id]} if plate_id in etags else {}
+        response = await client.get(f"/plates/{plate_id}", headers=headers)
+        if "ETag" in response.headers:
+            etags[plate_id] = response.headers["ETag"]
+        return response.status_code
+    return send
+
+
+def mixed(client, fx, rng, state):
+    senders = {name: globals()[name](client, fx, rng, state) for name in MIXED_WEIGHTS}
+    names, weights = list(MIXED_WEIGHTS), list(MIXED_WEIGHTS.values())
+
+    async def send(i: int) -> int:
+        return await senders[rng.choices(names, weights)[0]](i)
+    return send
+
+
+def scrape_counter(text: str, name: str) -> float:
+    match = re.search(rf"^{name} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+async def drive(job: Dict) -> Dict:
+    import httpx
+
+    if job["url"]:
+        client = httpx.AsyncClient(base_url=job["url"], timeout=60)
+    else:
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=60)
+
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    async with client:
+        before = scrape_counter((await client.get("/metrics")).text, "bidin_db_queries_total")
+        rng = random.Random(job["seed"])
+        send = globals()[job["scenario"]](client, job["fixture"], rng, job)
+        counter = iter(range(job["requests"]))
+
+        async def worker():
+            for i in counter:
+                started = time.perf_counter()
+                status = await send(i)
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(job["concurrency"])))
+        elapsed = time.perf_counter() - started
+        after = scrape_counter((await client.get("/metrics")).text, "bidin_db_queries_total")
+
+    if not job["url"]:
+        # Like the app's shutdown; the next scenario runs in a new event loop
+        from database import async_engine, read_engine
+        from hashing import hasher
+        hasher.shutdown()
+        await async_engine.dispose()
+        if read_engine is not async_engine:
+            await read_engine.dispose()
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed, "db_queries": after - before}
+
+
+def run_job(job: Dict) -> Dict:
+    return asyncio.run(drive(job))
+
+
+def run_scenario(name: str, fx: Dict, args) -> Dict:
+    workers = max(1, args.processes)
+    # Every login is a full bcrypt check, so the storm gets its own, smaller count
+    total = args.login_requests if name == "login_storm" else args.requests
+    jobs = [{
+        "scenario": name, "fixture": fx, "url": args.url, "worker": worker, "workers": workers,
+        "requests": total // workers + (worker < total % workers),
+        "concurrency": args.concurrency, "seed": args.seed * 1000 + worker,
+    } for worker in range(workers)]
+    if workers == 1:
+        results = [run_job(jobs[0])]
+    else:
+        # spawn: each process imports the app itself, like a server worker would
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            results = pool.map(run_job, jobs)
+
+    latencies = [sample for result in results for sample in result["latencies"]]
+    statuses = sum((result["statuses"] for result in results), Counter())
+    summary = summarize(latencies, max(result["elapsed"] for result in results), statuses)
+    db_queries = sum(result["db_queries"] for result in results)
+    summary["db_queries"] = int(db_queries)
+    summary["queries_per_request"] = round(db_queries / len(latencies), 2) if latencies else 0.0
+    return summary
+
+
+def compare(results: Dict, baseline: Dict) -> Dict:
+    changes = {}
+    for name, summary in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            "req_per_sec_ratio": round(summary["req_per_sec"] / before["req_per_sec"], 2) if before["req_per_sec"] else None,
+            "p99_ms_change": round(summary["p99_ms"] - before["p99_ms"], 2),
+            "queries_per_request_change": round(summary["queries_per_request"] - before["queries_per_request"], 2),
+        }
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auction traffic load test")
+    parser.add_argument("--scenario", default="all", choices=SCENARIOS + ("mixed", "all"))
+    parser.add_argument("--requests", type=int, default=2000, help="Per scenario, over all processes")
+    parser.add_argument("--login-requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="Clients per process")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--url", help="Load a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--plates", type=int, default=2000)
+    parser.add_argument("--bids-per-plate", type=int, default=10)
+    parser.add_argument("--closes-in", type=int, default=600, help="Seconds until the bid war plate closes")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data already at DATABASE_URL")
+    parser.add_argument("--reset-database", action="store_true", help="Drop the tables at DATABASE_URL first")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="Keep the in-process rate limiter on (every client shares one address)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--compare", help="Results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.rate_limit:
+        os.environ["RATE_LIMIT"] = "memory"
+    if "DATABASE_URL" not in os.environ:
+        # The worker processes inherit it
+        use_temp_database("loadtest")
+    fx = fixture(args) if args.no_seed else seed(args)
+    if args.seed_only:
+        return
+
+    names = SCENARIOS + ("mixed",) if args.scenario == "all" else (args.scenario,)
+    results = {
+        "config": {key: getattr(args, key) for key in
+                   ("requests", "login_requests", "concurrency", "processes", "url", "users", "plates", "bids_per_plate")},
+        "scenarios": {name: run_scenario(name, fx, args) for name in names},
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            results["compare"] = compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+from collections import defaultdict, deque
+from datetime import datetime
+from decimal import Decimal
+from typing import Deque, Dict, Optional, Set
+from cluster import cluster
+
+FEED_BUFFER_SIZE = int(os.getenv("FEED_BUFFER_SIZE", "32"))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class Subscription:
+    def __init__(self, plate_id: int, maxsize: int):
+        self.plate_id = plate_id
+        self.maxsize = maxsize
+        self.queue: Deque[str] = deque()
+        self.dropped = 0
+        self.closed = False
+        self.finishing = False
+        self._ready = asyncio.Event()
+
+    def push(self, message: str):
+        if len(self.queue) >= self.maxsize:
+            # Slow consumer: drop the oldest update, a newer price supersedes it anyway
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(message)
+        self._ready.set()
+
+    def finish(self):
+        # Close once the queued messages have been read
+        self.finishing = True
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        # Returns None on timeout or once the subscription is closed
+        while not self.queue and not self.closed:
+            if self.finishing:
+                self.closed = True
+                break
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.closed:
+            return None
+        return self.queue.popleft()
+
+
+class BidFeedHub:
+    def __init__(self, buffer_size: int = FEED_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+        self.published = 0
+
+    def subscribe(self, plate_id: int) -> Subscription:
+        subscription = Subscription(plate_id, self.buffer_size)
+        self._subscribers[plate_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        subscribers = self._subscribers.get(subscription.plate_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.plate_id]
+
+    def publish(self, plate_id: int, event: dict):
+        self._publish(plate_id, event, closing=False)
+
+    def close_plate(self, plate_id: int, event: dict):
+        # Last message for a finished auction, then every stream for it ends
+        self._publish(plate_id, event, closing=True)
+
+    def _publish(self, plate_id: int, event: dict, closing: bool):
+        if plate_id not in self._subscribers and not cluster.enabled:
+            return
+        # Serialized once, shared by every connection on every worker
+        message = json.dumps(event, default=_json_default)
+        cluster.publish("feed", {"plate_id": plate_id, "message": message, "closing": closing})
+        self.deliver(plate_id, message, closing)
+
+    def deliver(self, plate_id: int, message: str, closing: bool = False):
+        subscribers = self._subscribers.get(plate_id)
+        if subscribers:
+            for subscription in subscribers:
+                subscription.push(message)
+            self.published += 1
+        if closing:
+            for subscription in self._subscribers.pop(plate_id, set()):
+                subscription.finish()
+
+    def subscriber_count(self, plate_id: Optional[int] = None) -> int:
+        if plate_id is not None:
+            return len(self._subscribers.get(plate_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+hub = BidFeedHub()
+cluster.subscribe("feed", lambda payload: hub.deliver(payload["plate_id"], payload["message"], payload["closing"]))
+
+
+def bid_event(kind: str, bid, highest_amount) -> dict:
+    return {
+        "type": kind,
+        "plate_id": bid.plate_id,
+        "bid_id": bid.id,
+        "user_id": bid.user_id,
+        "amount": bid.amount,
+        "created_at": bid.created_at,
+        "highest_amount": highest_amount,
+    }
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import AutoPlate, Bid, BidEvent, BidLogSnapshot
+
+PLACED, RAISED, WITHDRAWN = 1, 2, 3
+KIND_NAMES = {PLACED: "placed", RAISED: "raised", WITHDRAWN: "withdrawn"}
+
+# A snapshot is written once this many events have piled up after the newest one, which
+# bounds what a restart has to replay
+BID_LOG_SNAPSHOT_EVERY = int(os.getenv("BID_LOG_SNAPSHOT_EVERY", "100000"))
+BID_LOG_CHECK_SECONDS = float(os.getenv("BID_LOG_CHECK_SECONDS", "60"))
+# Events younger than this stay out of snapshots: where ids are handed out before commit
+# (PostgreSQL sequences) a lower id can still be in flight
+BID_LOG_SETTLE_SECONDS = float(os.getenv("BID_LOG_SETTLE_SECONDS", "5"))
+KEEP_SNAPSHOTS = 2
+REPLAY_CHUNK = 50000
+
+
+def bid_event(kind: int, plate_id: int, user_id: int, bid_id: int, amount,
+              created_at: Optional[datetime] = None, by_proxy: bool = False) -> dict:
+    return {
+        "kind": kind, "plate_id": plate_id, "user_id": user_id, "bid_id": bid_id, "amount": amount,
+        "created_at": created_at or datetime.utcnow(), "by_proxy": by_proxy,
+    }
+
+
+async def append(db: AsyncSession, events: List[dict]):
+    # Called inside the bid write's transaction, so the log and the bids table commit together
+    if events:
+        await db.execute(insert(BidEvent), events)
+
+
+class LogState:
+    # The live bids the log implies: plate_id -> user_id -> (amount, bid_id)
+    def __init__(self, plates: Optional[Dict[int, Dict[int, Tuple]]] = None, last_event_id: int = 0):
+        self.plates = plates if plates is not None else {}
+        self.last_event_id = last_event_id
+
+    def apply(self, event_id: int, kind: int, plate_id: int, user_id: int, bid_id: int, amount):
+        if kind == WITHDRAWN:
+            bids = self.plates.get(plate_id)
+            if bids is not None:
+                bids.pop(user_id, None)
+                if not bids:
+                    del self.plates[plate_id]
+        else:
+            bids = self.plates.get(plate_id)
+            if bids is None:
+                bids = self.plates[plate_id] = {}
+            bids[user_id] = (amount, bid_id)
+        self.last_event_id = event_id
+
+    def top(self, plate_id: int) -> Optional[Tuple[int, Decimal, int]]:
+        # (user_id, amount, bid_id) of the leader: highest amount, earliest bid on a tie
+        bids = self.plates.get(plate_id)
+        if not bids:
+            return None
+        user_id, (amount, bid_id) = min(bids.items(), key=lambda item: (-item[1][0], item[1][1]))
+        return user_id, amount, bid_id
+
+    def rows(self) -> Iterator[Tuple[int, int, Decimal, int]]:
+        # (plate_id, user_id, amount, bid_id), the shape order_books.load takes
+        for plate_id, bids in self.plates.items():
+            for user_id, (amount, bid_id) in bids.items():
+                yield plate_id, user_id, amount, bid_id
+
+    def __len__(self) -> int:
+        return sum(len(bids) for bids in self.plates.values())
+
+    def dumps(self) -> bytes:
+        plates = {
+            plate_id: [[user_id, str(amount), bid_id] for user_id, (amount, bid_id) in bids.items()]
+            for plate_id, bids in self.plates.items()
+        }
+        data = json.dumps({"last_event_id": self.last_event_id, "plates": plates}, separators=(",", ":"))
+        return zlib.compress(data.encode(), 1)
+
+    @classmethod
+    def loads(cls, data: bytes) -> "LogState":
+        payload = json.loads(zlib.decompress(data))
+        plates = {
+            int(plate_id): {user_id: (Decimal(amount), bid_id) for user_id, amount, bid_id in bids}
+            for plate_id, bids in payload["plates"].items()
+        }
+        return cls(plates, payload["last_event_id"])
+
+
+async def load_state(db: AsyncSession, until: Optional[int] = None) -> Tuple[LogState, int]:
+    # Newest snapshot plus the events after it; returns the state and how many events were replayed
+    result = await db.execute(
+        select(BidLogSnapshot.state).order_by(BidLogSnapshot.last_event_id.desc()).limit(1)
+    )
+    data = result.scalar()
+    state = LogState.loads(data) if data is not None else LogState()
+    replayed = 0
+    columns = (BidEvent.id, BidEvent.kind, BidEvent.plate_id, BidEvent.user_id, BidEvent.bid_id, BidEvent.amount)
+    while True:
+        query = select(*columns).where(BidEvent.id > state.last_event_id)
+        if until is not None:
+            query = query.where(BidEvent.id <= until)
+        rows = (await db.execute(query.order_by(BidEvent.id).limit(REPLAY_CHUNK))).all()
+        apply = state.apply
+        for row in rows:
+            apply(*row)
+        replayed += len(rows)
+        if len(rows) < REPLAY_CHUNK:
+            break
+    if until is not None:
+        state.last_event_id = max(state.last_event_id, until)
+    # Plates deleted before their bids were withdrawn in the log
+    plate_ids = set((await db.execute(select(AutoPlate.id))).scalars())
+    for plate_id in [plate_id for plate_id in state.plates if plate_id not in plate_ids]:
+        del state.plates[plate_id]
+    return state, replayed
+
+
+async def write_snapshot(db: AsyncSession, state: LogState):
+    await db.execute(insert(BidLogSnapshot).values(
+        last_event_id=state.last_event_id, created_at=datetime.utcnow(), bids=len(state), state=state.dumps(),
+    ))
+    # Keep the previous one too, in case the newest turns out unreadable
+    kept = select(BidLogSnapshot.id).order_by(BidLogSnapshot.last_event_id.desc(), BidLogSnapshot.id.desc())
+    await db.execute(delete(BidLogSnapshot).where(BidLogSnapshot.id.not_in(kept.limit(KEEP_SNAPSHOTS))))
+    await db.commit()
+
+
+async def ensure_started(db: AsyncSession):
+    # A database from before the log: its bids become the first snapshot
+    if await db.scalar(select(BidEvent.id).limit(1)) is not None:
+        return
+    if await db.scalar(select(BidLogSnapshot.id).limit(1)) is not None:
+        return
+    result = await db.execute(select(Bid.plate_id, Bid.user_id, Bid.amount, Bid.id))
+    state = LogState()
+    for plate_id, user_id, amount, bid_id in result.all():
+        state.plates.setdefault(plate_id, {})[user_id] = (amount, bid_id)
+    if state.plates:
+        await write_snapshot(db, state)
+
+
+async def recover(db: AsyncSession) -> LogState:
+    await ensure_started(db)
+    state, _ = await load_state(db)
+    return state
+
+
+async def checkpoint(db: AsyncSession, min_events: int = BID_LOG_SNAPSHOT_EVERY) -> Optional[int]:
+    # Snapshots the settled part of the log once its tail is long enough; returns the
+    # snapshot's last event id, or None when nothing was written
+    latest = await db.scalar(select(func.max(BidLogSnapshot.last_event_id))) or 0
+    cutoff = datetime.utcnow() - timedelta(seconds=BID_LOG_SETTLE_SECONDS)
+    # Walks back from the newest event, so only the last few seconds of rows are read
+    until = await db.scalar(
+        select(BidEvent.id).where(BidEvent.created_at <= cutoff).order_by(BidEvent.id.desc()).limit(1)
+    )
+    if until is None or until - latest < max(1, min_events):
+        return None
+    state, _ = await load_state(db, until)
+    await write_snapshot(db, state)
+    return state.last_event_id
+
+
+async def plate_events(db: AsyncSession, plate_id: int, after_id: Optional[int] = None, limit: int = 100):
+    query = select(BidEvent.id, BidEvent.kind, BidEvent.user_id, BidEvent.bid_id, BidEvent.amount,
+                   BidEvent.by_proxy, BidEvent.created_at).where(BidEvent.plate_id == plate_id)
+    if after_id is not None:
+        query = query.where(BidEvent.id > after_id)
+    result = await db.execute(query.order_by(BidEvent.id).limit(limit))
+    return result.all()
+
+
+class BidLogCheckpointer:
+    # Every worker may run one; a duplicate snapshot of the same tail is harmless
+    def __init__(self, interval: float = BID_LOG_CHECK_SECONDS, min_events: int = BID_LOG_SNAPSHOT_EVERY):
+        self.interval = interval
+        self.min_events = min_events
+        self._task: Optional[asyncio.Task] = None
+        self.snapshots = 0
+        self.last_event_id: Optional[int] = None
+        self.last_seconds = 0.0
+
+    async def run_once(self) -> Optional[int]:
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            last_event_id = await checkpoint(db, self.min_events)
+        if last_event_id is not None:
+            self.snapshots += 1
+            self.last_event_id = last_event_id
+            self.last_seconds = time.perf_counter() - started
+        return last_event_id
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # The tail only grows; the next pass tries again
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "snapshots": self.snapshots,
+            "last_event_id": self.last_event_id,
+            "last_seconds": self.last_seconds,
+        }
+
+
+checkpointer = BidLogCheckpointer()
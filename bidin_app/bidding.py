@@ -0,0 +1,366 @@
+import asyncio
+import os
+import random
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+from sqlalchemy import and_, bindparam, case, insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AutoPlate, Bid
+from response_cache import response_cache
+from bid_log import append, bid_event, PLACED, RAISED
+from database import AsyncSessionLocal
+from cluster import cluster, ClusterError
+
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 0.005
+MAX_BACKOFF = 0.2
+MAX_BATCH_BIDS = int(os.getenv("MAX_BATCH_BIDS", "100"))
+EARLIER_MAXIMUM = "An earlier maximum bid already covers this amount"
+BUSY = "Bidding is busy on this plate, please retry"
+SUPERSEDED = "Superseded by a later bid on the same plate in this batch"
+# Bids on plates this worker owns queue here rather than on the database's write lock
+PLATE_LOCK_STRIPES = 256
+
+
+class BidRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def is_lock_conflict(exc: OperationalError) -> bool:
+    message = str(exc.orig).lower()
+    return "locked" in message or "busy" in message or "deadlock" in message or "serialize" in message
+
+
+async def _rejection(db: AsyncSession, plate_id: int, now: datetime) -> BidRejected:
+    result = await db.execute(
+        select(AutoPlate.is_active, AutoPlate.deadline).where(AutoPlate.id == plate_id)
+    )
+    plate = result.first()
+    await db.rollback()
+    if plate is None:
+        return BidRejected(404, "Plate not found")
+    if not plate.is_active or plate.deadline <= now:
+        return BidRejected(400, "Bidding is closed for this plate")
+    return BidRejected(400, "Bid amount must exceed current highest bid")
+
+
+async def _try_accept(db: AsyncSession, user_id: int, plate_id: int, amount,
+                      existing: Optional[Bid], existing_id: Optional[int]) -> Bid:
+    now = datetime.now()
+    bid_time = datetime.utcnow()
+    # The compare and the write are one statement: the row lock (or SQLite's write lock)
+    # taken by this UPDATE is what serializes competing bidders on the plate.
+    result = await db.execute(
+        update(AutoPlate)
+        .where(
+            AutoPlate.id == plate_id,
+            AutoPlate.is_active == True,
+            AutoPlate.deadline > now,
+            AutoPlate.current_highest_amount < amount,
+        )
+        .values(
+            current_highest_amount=amount,
+            leading_user_id=user_id,
+            bid_count=AutoPlate.bid_count + (0 if existing is not None else 1),
+            last_bid_at=bid_time,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise await _rejection(db, plate_id, now)
+
+    if existing is None:
+        db_bid = Bid(plate_id=plate_id, user_id=user_id, amount=amount, created_at=bid_time)
+        db.add(db_bid)
+        try:
+            await db.flush()
+        except IntegrityError:
+            await db.rollback()
+            raise BidRejected(400, "You already have a bid on this plate, update it instead")
+        await append(db, [bid_event(PLACED, plate_id, user_id, db_bid.id, amount, bid_time)])
+    else:
+        db_bid = existing
+        await db.execute(
+            update(Bid).where(Bid.id == existing_id).values(amount=amount)
+            .execution_options(synchronize_session=False)
+        )
+        await append(db, [bid_event(RAISED, plate_id, user_id, existing_id, amount, bid_time)])
+    await db.commit()
+    await db.refresh(db_bid)
+    await response_cache.invalidate_plates([plate_id])
+    return db_bid
+
+
+async def accept_bid(db: AsyncSession, user_id: int, plate_id: int, amount, existing: Optional[Bid] = None) -> Bid:
+    # Places a new bid, or raises `existing`, if it beats the plate's current price
+    # Read the id up front: a rollback expires `existing` and async sessions can't lazy load
+    existing_id = existing.id if existing is not None else None
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await _try_accept(db, user_id, plate_id, amount, existing, existing_id)
+        except OperationalError as exc:
+            await db.rollback()
+            if not is_lock_conflict(exc):
+                raise
+            if attempt == MAX_ATTEMPTS - 1:
+                raise BidRejected(503, BUSY)
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, backoff))
+
+
+_plate_locks = [asyncio.Lock() for _ in range(PLATE_LOCK_STRIPES)]
+
+
+async def accept_on_owner(db: AsyncSession, user_id: int, plate_id: int, amount,
+                          existing: Optional[Bid] = None) -> Bid:
+    # accept_bid, run by the plate's owner when several workers share the load (see cluster.py).
+    # A forwarded bid comes back as a detached Bid.
+    if not cluster.enabled:
+        return await accept_bid(db, user_id, plate_id, amount, existing)
+    owner = cluster.owner(plate_id)
+    if owner == cluster.worker_id or not cluster.connected:
+        # Unconnected workers accept locally; the conditional write keeps that correct
+        async with _plate_locks[plate_id % PLATE_LOCK_STRIPES]:
+            return await accept_bid(db, user_id, plate_id, amount, existing)
+    try:
+        result = await cluster.call(owner, "accept_bid", {
+            "user_id": user_id, "plate_id": plate_id, "amount": str(amount),
+            "existing_id": existing.id if existing is not None else None,
+        })
+    except ClusterError:
+        # The owner may still have written it, so don't retry here
+        raise BidRejected(503, BUSY)
+    if "error" in result:
+        raise BidRejected(*result["error"])
+    bid = result["bid"]
+    return Bid(id=bid["id"], plate_id=plate_id, user_id=user_id, amount=Decimal(bid["amount"]),
+               created_at=datetime.fromisoformat(bid["created_at"]))
+
+
+async def _accept_forwarded(payload: dict) -> dict:
+    plate_id = payload["plate_id"]
+    async with AsyncSessionLocal() as db:
+        try:
+            existing = None
+            if payload["existing_id"] is not None:
+                existing = await db.get(Bid, payload["existing_id"])
+                if existing is None:
+                    raise BidRejected(404, "Bid not found")
+            async with _plate_locks[plate_id % PLATE_LOCK_STRIPES]:
+                bid = await accept_bid(db, payload["user_id"], plate_id, float(payload["amount"]), existing)
+        except BidRejected as exc:
+            return {"error": [exc.status_code, exc.detail]}
+        return {"bid": {"id": bid.id, "amount": str(bid.amount), "created_at": bid.created_at.isoformat()}}
+
+
+cluster.serve("accept_bid", _accept_forwarded)
+
+
+class BatchResult:
+    def __init__(self, index: int, plate_id: int, amount):
+        self.index = index
+        self.plate_id = plate_id
+        self.amount = amount
+        self.status_code = 200
+        self.detail: Optional[str] = None
+        self.bid: Optional[Bid] = None
+
+    def reject(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        self.bid = None
+
+
+async def _try_accept_batch(db: AsyncSession, user_id: int, items: List[BatchResult], ceilings: Dict) -> List[Bid]:
+    now = datetime.now()
+    bid_time = datetime.utcnow()
+    plate_ids = sorted({item.plate_id for item in items})
+    # Every target plate, its price and the caller's own bid on it, in one query
+    result = await db.execute(
+        select(
+            AutoPlate.id, AutoPlate.is_active, AutoPlate.deadline, AutoPlate.current_highest_amount,
+            Bid.id.label("bid_id"), Bid.created_at.label("bid_created_at"),
+        )
+        .outerjoin(Bid, and_(Bid.plate_id == AutoPlate.id, Bid.user_id == user_id))
+        .where(AutoPlate.id.in_(plate_ids))
+    )
+    plates = {row.id: row for row in result.all()}
+    highest = {plate_id: row.current_highest_amount for plate_id, row in plates.items()}
+
+    # Validate in order against the loaded state; a later bid on the same plate raises an earlier
+    # one, which is then reported as superseded rather than accepted
+    winners: Dict[int, BatchResult] = {}
+    for item in items:
+        item.status_code, item.detail = 200, None
+        plate = plates.get(item.plate_id)
+        if plate is None:
+            item.reject(404, "Plate not found")
+        elif not plate.is_active or plate.deadline <= now:
+            item.reject(400, "Bidding is closed for this plate")
+        elif item.amount <= highest[item.plate_id]:
+            item.reject(400, "Bid amount must exceed current highest bid")
+        elif ceilings.get(item.plate_id) == Decimal(str(item.amount)):
+            item.reject(400, EARLIER_MAXIMUM)
+        else:
+            highest[item.plate_id] = item.amount
+            if item.plate_id in winners:
+                winners[item.plate_id].reject(409, SUPERSEDED)
+            winners[item.plate_id] = item
+    if not winners:
+        await db.rollback()
+        return []
+
+    # The single-bid conditional write for every plate at once; a plate whose price moved
+    # since the read is left out of RETURNING and its bids are rejected
+    amounts = case({plate_id: item.amount for plate_id, item in winners.items()}, value=AutoPlate.id)
+    new_bids = [plate_id for plate_id in winners if plates[plate_id].bid_id is None]
+    written = await db.execute(
+        update(AutoPlate)
+        .where(
+            AutoPlate.id.in_(list(winners)),
+            AutoPlate.is_active == True,
+            AutoPlate.deadline > now,
+            AutoPlate.current_highest_amount < amounts,
+        )
+        .values(
+            current_highest_amount=amounts,
+            leading_user_id=user_id,
+            bid_count=AutoPlate.bid_count + case((AutoPlate.id.in_(new_bids), 1), else_=0),
+            last_bid_at=bid_time,
+        )
+        .returning(AutoPlate.id)
+        .execution_options(synchronize_session=False)
+    )
+    won = set(written.scalars().all())
+    for plate_id in list(winners):
+        if plate_id not in won:
+            del winners[plate_id]
+            for other in items:
+                if other.plate_id == plate_id and other.status_code == 200:
+                    other.reject(400, "Bid amount must exceed current highest bid")
+
+    inserts = [plate_id for plate_id in winners if plates[plate_id].bid_id is None]
+    updates = [plate_id for plate_id in winners if plates[plate_id].bid_id is not None]
+    bids: Dict[int, Bid] = {}
+    if inserts:
+        inserted = await db.execute(
+            insert(Bid).returning(Bid.id, Bid.plate_id),
+            [{"plate_id": plate_id, "user_id": user_id, "amount": winners[plate_id].amount,
+              "created_at": bid_time} for plate_id in inserts],
+        )
+        for bid_id, plate_id in inserted.all():
+            bids[plate_id] = Bid(id=bid_id, plate_id=plate_id, user_id=user_id,
+                                 amount=winners[plate_id].amount, created_at=bid_time)
+    if updates:
+        await db.execute(
+            update(Bid.__table__).where(Bid.__table__.c.id == bindparam("bid_id"))
+            .values(amount=bindparam("new_amount")),
+            [{"bid_id": plates[plate_id].bid_id, "new_amount": winners[plate_id].amount} for plate_id in updates],
+        )
+        for plate_id in updates:
+            plate = plates[plate_id]
+            bids[plate_id] = Bid(id=plate.bid_id, plate_id=plate_id, user_id=user_id,
+                                 amount=winners[plate_id].amount, created_at=plate.bid_created_at)
+    await append(db, [
+        bid_event(PLACED if plate_id in inserts else RAISED, plate_id, user_id, bid.id, bid.amount, bid_time)
+        for plate_id, bid in bids.items()
+    ])
+    await db.commit()
+    if bids:
+        await response_cache.invalidate_plates(bids)
+
+    for item in items:
+        if item.status_code == 200:
+            item.bid = bids[item.plate_id]
+    return list(bids.values())
+
+
+async def _accept_batch(db: AsyncSession, user_id: int, items: List[BatchResult], ceilings: Dict):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            await _try_accept_batch(db, user_id, items, ceilings)
+            return
+        except IntegrityError:
+            # The user placed a bid on one of the plates concurrently: reload and raise it instead
+            await db.rollback()
+        except OperationalError as exc:
+            await db.rollback()
+            if not is_lock_conflict(exc):
+                raise
+        if attempt < MAX_ATTEMPTS - 1:
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, backoff))
+    for item in items:
+        item.reject(503, BUSY)
+
+
+async def _accept_batch_owned(db: AsyncSession, user_id: int, items: List[BatchResult], ceilings: Dict):
+    # Queues behind single bids on the same plates; stripes are taken in order so two batches
+    # can't wait on each other
+    async with AsyncExitStack() as stack:
+        for stripe in sorted({item.plate_id % PLATE_LOCK_STRIPES for item in items}):
+            await stack.enter_async_context(_plate_locks[stripe])
+        await _accept_batch(db, user_id, items, ceilings)
+
+
+async def _forward_batch(owner: int, user_id: int, items: List[BatchResult], ceilings: Dict):
+    plate_ids = {item.plate_id for item in items}
+    try:
+        result = await cluster.call(owner, "accept_bids", {
+            "user_id": user_id,
+            "bids": [[item.plate_id, str(item.amount)] for item in items],
+            "ceilings": {str(plate_id): str(ceiling) for plate_id, ceiling in ceilings.items() if plate_id in plate_ids},
+        })
+    except ClusterError:
+        # As with a single bid, the owner may still have written them
+        for item in items:
+            item.reject(503, BUSY)
+        return
+    for item, (status_code, detail, bid) in zip(items, result["results"]):
+        item.status_code, item.detail, item.bid = status_code, detail, None
+        if bid is not None:
+            item.bid = Bid(id=bid["id"], plate_id=item.plate_id, user_id=user_id, amount=Decimal(bid["amount"]),
+                           created_at=datetime.fromisoformat(bid["created_at"]))
+
+
+async def _accept_forwarded_batch(payload: dict) -> dict:
+    items = [BatchResult(index, plate_id, float(amount)) for index, (plate_id, amount) in enumerate(payload["bids"])]
+    ceilings = {int(plate_id): Decimal(ceiling) for plate_id, ceiling in payload["ceilings"].items()}
+    async with AsyncSessionLocal() as db:
+        await _accept_batch_owned(db, payload["user_id"], items, ceilings)
+    return {"results": [
+        [item.status_code, item.detail, None if item.bid is None else
+         {"id": item.bid.id, "amount": str(item.bid.amount), "created_at": item.bid.created_at.isoformat()}]
+        for item in items
+    ]}
+
+
+cluster.serve("accept_bids", _accept_forwarded_batch)
+
+
+async def accept_bids(db: AsyncSession, user_id: int, bids, ceilings: Optional[Dict] = None) -> List[BatchResult]:
+    # Validates many (plate_id, amount) bids against one read of the plates and commits the
+    # accepted ones in a single transaction. A bid on a plate the user already bid on raises it.
+    # `ceilings` are other users' proxy maximums per plate, which win ties (see proxy_bidding.py)
+    items = [BatchResult(index, bid.plate_id, bid.amount) for index, bid in enumerate(bids)]
+    ceilings = ceilings or {}
+    if not cluster.enabled or not cluster.connected:
+        await _accept_batch(db, user_id, items, ceilings)
+        return items
+    # Like accept_on_owner: each owner applies its share of the batch, one transaction per owner
+    shares: Dict[int, List[BatchResult]] = defaultdict(list)
+    for item in items:
+        shares[cluster.owner(item.plate_id)].append(item)
+    local = shares.pop(cluster.worker_id, None)
+    pending = [_forward_batch(owner, user_id, share, ceilings) for owner, share in shares.items()]
+    if local:
+        pending.append(_accept_batch_owned(db, user_id, local, ceilings))
+    await asyncio.gather(*pending)
+    return items
@@ -0,0 +1,269 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncReadSessionLocal
+from models import AutoPlate, Bid
+from schemas import AutoPlateCreate
+from plate_search import plate_index
+from scheduler import scheduler
+from response_cache import response_cache, PLATE_LIST_GROUP
+from crud import publish_plates
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# The report keeps the first errors only; the count covers all of them
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("csv", "ndjson")
+
+EXPORT_PLATE_COLUMNS = (
+    AutoPlate.id, AutoPlate.plate_number, AutoPlate.description, AutoPlate.deadline,
+    AutoPlate.is_active, AutoPlate.created_by_id, AutoPlate.current_highest_amount,
+    AutoPlate.bid_count, AutoPlate.leading_user_id, AutoPlate.winner_id,
+)
+EXPORT_BID_COLUMNS = (Bid.plate_id, Bid.id, Bid.user_id, Bid.amount, Bid.created_at)
+CSV_HEADER = [column.key for column in EXPORT_PLATE_COLUMNS] + ["bid_id", "bid_user_id", "bid_amount", "bid_created_at"]
+
+Record = Tuple[int, Optional[dict], Optional[str]]
+
+
+def detect_format(requested: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    if requested:
+        return requested if requested in FORMATS else None
+    content_type = content_type or ""
+    if "csv" in content_type:
+        return "csv"
+    if "ndjson" in content_type or "json" in content_type:
+        return "ndjson"
+    return None
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+async def file_chunks(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as handle:
+        while True:
+            chunk = handle.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def iter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Record]:
+    # Yields (row number, fields, error); row numbers count data rows from 1
+    if fmt == "ndjson":
+        row = 0
+        async for line in lines:
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield row, None, "Invalid JSON"
+                continue
+            if isinstance(data, dict):
+                yield row, data, None
+            else:
+                yield row, None, "Expected a JSON object"
+        return
+
+    header = None
+    row = 0
+    logical = ""
+    async for line in lines:
+        # A quoted field may span lines: keep reading until the quotes balance
+        logical = f"{logical}\n{line}" if logical else line
+        if logical.count('"') % 2:
+            continue
+        values, logical = next(csv.reader([logical])), ""
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if not any(value.strip() for value in values):
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield row, dict(zip(header, values)), None
+    if logical:
+        yield row + 1, None, "Unterminated quoted field"
+
+
+def validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+    )
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self) -> Dict:
+        errors = sorted(self.errors, key=lambda error: error["row"])
+        return {"rows": self.rows, "inserted": self.inserted, "failed": self.failed, "errors": errors}
+
+
+async def _insert_chunk(db: AsyncSession, rows: List[Tuple[int, dict]], report: ImportReport):
+    statement = insert(AutoPlate).returning(AutoPlate.id, AutoPlate.plate_number, AutoPlate.deadline)
+    try:
+        result = await db.execute(statement, [values for _, values in rows])
+        inserted = result.all()
+        await db.commit()
+    except IntegrityError:
+        # Someone else took a plate number meanwhile: find the offending rows one by one
+        await db.rollback()
+        inserted = []
+        for row, values in rows:
+            try:
+                result = await db.execute(statement, values)
+                inserted.append(result.one())
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+                report.error(row, "plate_number: already exists")
+    report.inserted += len(inserted)
+    if inserted:
+        publish_plates(added=inserted)
+        await response_cache.invalidate([PLATE_LIST_GROUP])
+    for plate_id, plate_number, deadline in inserted:
+        plate_index.add(plate_id, plate_number)
+        scheduler.schedule(plate_id, deadline)
+
+
+async def _import_chunk(db: AsyncSession, records: List[Record], user_id: int, seen: set, report: ImportReport):
+    valid: List[Tuple[int, dict]] = []
+    for row, data, error in records:
+        if error:
+            report.error(row, error)
+            continue
+        try:
+            plate = AutoPlateCreate.model_validate(data)
+        except ValidationError as exc:
+            report.error(row, validation_message(exc))
+            continue
+        if plate.plate_number in seen:
+            report.error(row, "plate_number: duplicated in this import")
+            continue
+        seen.add(plate.plate_number)
+        valid.append((row, {**plate.model_dump(), "created_by_id": user_id}))
+    if not valid:
+        return
+
+    result = await db.execute(
+        select(AutoPlate.plate_number)
+        .where(AutoPlate.plate_number.in_([values["plate_number"] for _, values in valid]))
+    )
+    existing = set(result.scalars().all())
+    rows = []
+    for row, values in valid:
+        if values["plate_number"] in existing:
+            report.error(row, "plate_number: already exists")
+        else:
+            rows.append((row, values))
+    if rows:
+        await _insert_chunk(db, rows, report)
+
+
+async def import_plates(db: AsyncSession, records: AsyncIterator[Record], user_id: int,
+                        chunk_size: int = BULK_CHUNK_SIZE) -> Dict:
+    # Each chunk is validated, then inserted with one executemany and committed on its own,
+    # so bad rows are reported without losing the rest of the batch
+    report = ImportReport()
+    seen: set = set()
+    chunk: List[Record] = []
+    async for record in records:
+        report.rows += 1
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            await _import_chunk(db, chunk, user_id, seen, report)
+            chunk = []
+    if chunk:
+        await _import_chunk(db, chunk, user_id, seen, report)
+    return report.as_dict()
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+async def export_rows(chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[Tuple[dict, List[dict]]]:
+    # Plates in id order, each with its bids; two queries per chunk of plates
+    async with AsyncReadSessionLocal() as db:
+        last_id = 0
+        while True:
+            result = await db.execute(
+                select(*EXPORT_PLATE_COLUMNS).where(AutoPlate.id > last_id)
+                .order_by(AutoPlate.id).limit(chunk_size)
+            )
+            plates = result.all()
+            if not plates:
+                return
+            last_id = plates[-1].id
+            result = await db.execute(
+                select(*EXPORT_BID_COLUMNS)
+                .where(Bid.plate_id >= plates[0].id, Bid.plate_id <= last_id)
+                .order_by(Bid.plate_id, Bid.id)
+            )
+            bids: Dict[int, List[dict]] = {}
+            for bid in result.all():
+                bids.setdefault(bid.plate_id, []).append({
+                    "id": bid.id, "user_id": bid.user_id,
+                    "amount": _export_value(bid.amount), "created_at": _export_value(bid.created_at),
+                })
+            for plate in plates:
+                yield {key: _export_value(value) for key, value in plate._mapping.items()}, bids.get(plate.id, [])
+
+
+async def export_plates(fmt: str, chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(CSV_HEADER)
+    count = 0
+    async for plate, bids in export_rows(chunk_size):
+        if fmt == "ndjson":
+            buffer.write(json.dumps({**plate, "bids": bids}))
+            buffer.write("\n")
+        else:
+            plate_values = list(plate.values())
+            # One line per bid, or a single line with empty bid columns
+            for bid in bids or [None]:
+                bid_values = [bid["id"], bid["user_id"], bid["amount"], bid["created_at"]] if bid else [""] * 4
+                writer.writerow(plate_values + bid_values)
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,400 @@
+# Coordination between server workers (see serve.py). A hash ring gives every plate one
+# owner worker, which accepts its bids one at a time; a message bus fans bid events and
+# cache invalidations out to every worker so their in-memory state stays current.
+#
+# The modules holding that state register their own handlers (cluster.subscribe) and
+# services (cluster.serve); this module imports nothing from the app.
+#
+#   python cluster.py --socket /tmp/bidin-cluster.sock    # a standalone broker for CLUSTER=local
+import argparse
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from bisect import bisect
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+# "off" (one process), "local" (workers on one machine, through a Unix socket broker) or
+# "redis" (pub/sub on any Redis protocol server, so workers may span machines)
+CLUSTER = os.getenv("CLUSTER", "off")
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET", "/tmp/bidin-cluster.sock")
+CLUSTER_URL = os.getenv("CLUSTER_URL", "redis://localhost:6379/0")
+# Fixed membership: worker ids 0..CLUSTER_WORKERS-1, handed out by serve.py. A restarted
+# worker keeps its id and so takes its plates back.
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "1"))
+CLUSTER_WORKER_ID = int(os.getenv("CLUSTER_WORKER_ID", "0"))
+CLUSTER_CALL_TIMEOUT = float(os.getenv("CLUSTER_CALL_TIMEOUT", "5"))
+# How long the broker waits for a worker to take its messages before disconnecting it
+CLUSTER_DRAIN_TIMEOUT = float(os.getenv("CLUSTER_DRAIN_TIMEOUT", "1"))
+CONNECT_TIMEOUT = 2.0
+RECONNECT_SECONDS = 1.0
+RING_REPLICAS = 100
+# One message is one line; bulk imports announce their plates in one
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+BROADCAST = "*"
+
+
+class ClusterError(Exception):
+    pass
+
+
+def _point(value: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Each node is placed at many points so ownership evens out, and adding a node only
+    # moves about 1/N of the keys
+    def __init__(self, nodes: Iterable[int], replicas: int = RING_REPLICAS):
+        points = sorted((_point(f"{node}:{replica}"), node) for node in nodes for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key) -> int:
+        index = bisect(self._points, _point(str(key)))
+        return self._nodes[index % len(self._nodes)]
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, path: str = CLUSTER_SOCKET):
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self, worker_id: int):
+        await self.close()
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_MESSAGE_BYTES)
+        self._writer.write(f"{worker_id}\n".encode())
+
+    async def send(self, destination: str, data: bytes):
+        if self._writer is None:
+            raise ConnectionError("not connected to the cluster broker")
+        self._writer.write(destination.encode() + b"\t" + data + b"\n")
+        await self._writer.drain()
+
+    async def receive(self) -> bytes:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("the cluster broker went away")
+        return line
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+
+class Broker:
+    # Relays each worker's lines to the others, or to the one worker a call is addressed to.
+    # Run by serve.py; it keeps no state, so a restart only drops messages in flight.
+    def __init__(self, path: str = CLUSTER_SOCKET, drain_timeout: float = CLUSTER_DRAIN_TIMEOUT):
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self._workers: Dict[str, asyncio.StreamWriter] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.relayed = 0
+        self.disconnected = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=MAX_MESSAGE_BYTES)
+
+    async def serve_forever(self):
+        await self.start()
+        await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._workers.values()):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker = (await reader.readline()).strip().decode()
+        self._workers[worker] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                destination, _, data = line.partition(b"\t")
+                if destination == b"*":
+                    targets = [target for name, target in self._workers.items() if name != worker]
+                else:
+                    target = self._workers.get(destination.decode())
+                    targets = [target] if target is not None else []
+                for target in targets:
+                    target.write(data)
+                # Drained together and bounded, so one slow worker delays the others by at most
+                # drain_timeout, and is then cut off instead of buffering without limit
+                await asyncio.gather(*(self._drain(target) for target in targets))
+                self.relayed += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if self._workers.get(worker) is writer:
+                del self._workers[worker]
+            writer.close()
+
+    async def _drain(self, writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(writer.drain(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            # The worker reconnects and carries on; what it missed is lost, as after a restart
+            for name, target in list(self._workers.items()):
+                if target is writer:
+                    del self._workers[name]
+                    self.disconnected += 1
+            writer.close()
+        except ConnectionError:
+            pass
+
+
+class RedisBackend:
+    # A channel for broadcasts plus one per worker for calls and their replies
+    name = "redis"
+
+    def __init__(self, url: str = CLUSTER_URL, prefix: str = "bidin:cluster:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CLUSTER=redis needs the 'redis' package installed")
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self._pubsub = None
+        self._error = redis.RedisError
+
+    async def connect(self, worker_id: int):
+        await self.close()
+        try:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(self.prefix + BROADCAST, self.prefix + str(worker_id))
+        except self._error as exc:
+            raise ConnectionError(str(exc))
+
+    async def send(self, destination: str, data: bytes):
+        try:
+            await self.client.publish(self.prefix + destination, data)
+        except self._error as exc:
+            raise ConnectionError(str(exc))
+
+    async def receive(self) -> bytes:
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=None)
+            except self._error as exc:
+                raise ConnectionError(str(exc))
+            if message is not None:
+                return message["data"]
+
+    async def close(self):
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+
+def create_backend(kind: str = CLUSTER):
+    if kind == "redis":
+        return RedisBackend()
+    if kind == "local":
+        return LocalBackend()
+    return None
+
+
+class Cluster:
+    def __init__(self, kind: str = CLUSTER, worker_id: int = CLUSTER_WORKER_ID,
+                 workers: int = CLUSTER_WORKERS, backend=None):
+        self.kind = kind
+        self.worker_id = worker_id
+        self.workers = workers
+        self.ring = HashRing(range(workers))
+        self.backend = backend
+        self._handlers: Dict[str, List[Callable[[Any], Any]]] = defaultdict(list)
+        self._services: Dict[str, Callable[[Any], Awaitable[Any]]] = {}
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._next_call = 0
+        self._outbox: Optional[asyncio.Queue] = None
+        self._connected: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        # Calls being served, kept so they aren't garbage collected mid-flight
+        self._serving: Set[asyncio.Task] = set()
+        self.sent = self.received = self.dropped = 0
+        self.calls = self.served = self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "off"
+
+    @property
+    def connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    def owner(self, plate_id: int) -> int:
+        return self.ring.owner(plate_id)
+
+    def owns(self, plate_id: int) -> bool:
+        return not self.enabled or self.ring.owner(plate_id) == self.worker_id
+
+    def subscribe(self, topic: str, handler: Callable[[Any], Any]):
+        # handler(payload), plain or async, runs for every other worker's publish on the topic
+        self._handlers[topic].append(handler)
+
+    def serve(self, name: str, handler: Callable[[Any], Awaitable[Any]]):
+        # await handler(payload) answers call(worker, name, payload) from other workers
+        self._services[name] = handler
+
+    def publish(self, topic: str, payload):
+        # Best effort and never blocking: a worker that misses a message catches up through
+        # the caches' TTLs, and the database's conditional writes stay authoritative
+        if self._outbox is not None and self.workers > 1:
+            self._outbox.put_nowait((BROADCAST, {"t": topic, "s": self.worker_id, "p": payload}))
+
+    async def call(self, worker: int, name: str, payload, timeout: float = CLUSTER_CALL_TIMEOUT):
+        if not self.connected:
+            raise ClusterError("not connected to the cluster")
+        self._next_call += 1
+        call_id = self._next_call
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        self._outbox.put_nowait((str(worker), {"t": name, "s": self.worker_id, "c": call_id, "p": payload}))
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ClusterError(f"worker {worker} did not answer {name} in {timeout}s")
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def dispatch(self, message: dict):
+        if message["s"] == self.worker_id:
+            # Our own broadcast, echoed back by Redis
+            return
+        self.received += 1
+        if "r" in message:
+            future = self._calls.get(message["r"])
+            if future is not None and not future.done():
+                if "e" in message:
+                    future.set_exception(ClusterError(message["e"]))
+                else:
+                    future.set_result(message["p"])
+        elif "c" in message:
+            # Served concurrently, the receive loop keeps going
+            task = asyncio.create_task(self._answer(message))
+            self._serving.add(task)
+            task.add_done_callback(self._serving.discard)
+        else:
+            for handler in self._handlers.get(message["t"], ()):
+                try:
+                    result = handler(message["p"])
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    self.errors += 1
+
+    async def _answer(self, message: dict):
+        reply = {"s": self.worker_id, "r": message["c"]}
+        handler = self._services.get(message["t"])
+        try:
+            if handler is None:
+                raise ClusterError(f"worker {self.worker_id} has no {message['t']} service")
+            reply["p"] = await handler(message["p"])
+            self.served += 1
+        except Exception as exc:
+            self.errors += 1
+            reply["e"] = f"{type(exc).__name__}: {exc}"
+        if self._outbox is not None:
+            self._outbox.put_nowait((str(message["s"]), reply))
+
+    async def _receive_loop(self):
+        while True:
+            try:
+                await self.backend.connect(self.worker_id)
+                self._connected.set()
+                while True:
+                    await self.dispatch(json.loads(await self.backend.receive()))
+            except (ConnectionError, OSError):
+                self._connected.clear()
+                self.errors += 1
+                await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _send_loop(self):
+        while True:
+            destination, message = await self._outbox.get()
+            if not self.connected:
+                self.dropped += 1
+                continue
+            try:
+                await self.backend.send(destination, json.dumps(message, separators=(",", ":")).encode())
+                self.sent += 1
+            except (ConnectionError, OSError):
+                self.dropped += 1
+
+    async def start(self):
+        if not self.enabled or self._outbox is not None:
+            return
+        if not 0 <= self.worker_id < self.workers:
+            raise RuntimeError(f"CLUSTER_WORKER_ID must be in 0..{self.workers - 1}, got {self.worker_id}")
+        if self.backend is None:
+            self.backend = create_backend(self.kind)
+        self._outbox = asyncio.Queue()
+        self._connected = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._receive_loop()), asyncio.create_task(self._send_loop())]
+        # Give the first connection a moment so routing works from the first request; until
+        # then bids are accepted locally
+        try:
+            await asyncio.wait_for(self._connected.wait(), CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self):
+        for task in self._tasks + list(self._serving):
+            task.cancel()
+        for task in self._tasks + list(self._serving):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for future in self._calls.values():
+            if not future.done():
+                future.set_exception(ClusterError("cluster stopped"))
+        self._tasks = []
+        self._calls.clear()
+        self._outbox = self._connected = None
+        if self.backend is not None:
+            await self.backend.close()
+
+    def metrics(self) -> dict:
+        return {
+            "backend": self.kind,
+            "worker": self.worker_id,
+            "workers": self.workers,
+            "connected": self.connected,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+            "calls": self.calls,
+            "served": self.served,
+            "errors": self.errors,
+        }
+
+
+cluster = Cluster()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message broker for CLUSTER=local workers")
+    parser.add_argument("--socket", default=CLUSTER_SOCKET)
+    args = parser.parse_args()
+    asyncio.run(Broker(args.socket).serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,29 @@
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import and_, false, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
 from models import User, AutoPlate, Bid
-from schemas import UserCreate, AutoPlateCreate, BidCreate
-from dependencies import get_password_hash
+from schemas import UserCreate, AutoPlateCreate
+from hashing import hasher
+from pagination import keyset_condition
+from plate_search import plate_index, WILDCARD
+from response_cache import response_cache, PLATE_LIST_GROUP
+from bid_log import append, bid_event, WITHDRAWN
+from order_book import order_books
+from scheduler import scheduler
+from cluster import cluster
+from analytics import analytics
 
-def create_user(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password)
+PLATE_ORDERINGS = {
+    "deadline": (AutoPlate.deadline, False),
+    "-deadline": (AutoPlate.deadline, True),
+    "price": (AutoPlate.current_highest_amount, False),
+    "-price": (AutoPlate.current_highest_amount, True),
+}
+
+async def create_user(db: AsyncSession, user: UserCreate):
+    hashed_password = await hasher.hash(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -12,68 +31,239 @@ def create_user(db: Session, user: UserCreate):
         is_staff=user.is_staff,
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def create_plate(db: Session, plate: AutoPlateCreate, user_id: int):
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
+    if not user:
+        return None
+    valid, new_hash = await hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
+        return None
+    if new_hash:
+        # Stored hash used an outdated bcrypt cost
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
+
+def publish_plates(added: Iterable[Tuple[int, str, Optional[datetime]]] = (),
+                   updated: Iterable[Tuple[int, str, Optional[datetime]]] = (), deleted: Iterable[int] = ()):
+    # (plate_id, plate_number, deadline, None once bidding is closed) for the other workers'
+    # search indexes, schedulers and order books
+    if not cluster.enabled:
+        return
+    def rows(plates):
+        return [[plate_id, number, deadline.isoformat() if deadline else None] for plate_id, number, deadline in plates]
+    cluster.publish("plates", {"added": rows(added), "updated": rows(updated), "deleted": list(deleted)})
+
+def _plates_changed(payload: dict):
+    for plate_id, plate_number, deadline in payload["added"] + payload["updated"]:
+        plate_index.add(plate_id, plate_number)
+        if deadline is None:
+            scheduler.cancel(plate_id)
+        else:
+            scheduler.schedule(plate_id, datetime.fromisoformat(deadline))
+    for plate_id, _, _ in payload["updated"]:
+        order_books.invalidate(plate_id)
+    for plate_id in payload["deleted"]:
+        plate_index.remove(plate_id)
+        analytics.set_price(plate_id, None)
+        order_books.invalidate(plate_id)
+        scheduler.cancel(plate_id)
+
+cluster.subscribe("plates", _plates_changed)
+
+async def reload_plates(db: AsyncSession, announce: bool = True):
+    # Rebuilds the search index and the close schedule from the database, for plates
+    # written by another process (manage.py import-plates); every worker reloads
+    await plate_index.warm_up(db)
+    await scheduler.load(db)
+    await response_cache.invalidate([PLATE_LIST_GROUP])
+    if announce:
+        cluster.publish("plates_reload", {})
+
+async def _plates_reloaded(payload: dict):
+    async with AsyncSessionLocal() as db:
+        await reload_plates(db, announce=False)
+
+cluster.subscribe("plates_reload", _plates_reloaded)
+
+async def create_plate(db: AsyncSession, plate: AutoPlateCreate, user_id: int):
     db_plate = AutoPlate(**plate.dict(), created_by_id=user_id)
     db.add(db_plate)
-    db.commit()
-    db.refresh(db_plate)
+    await db.commit()
+    await db.refresh(db_plate)
+    plate_index.add(db_plate.id, db_plate.plate_number)
+    publish_plates(added=[(db_plate.id, db_plate.plate_number, db_plate.deadline if db_plate.is_active else None)])
+    await response_cache.invalidate([PLATE_LIST_GROUP])
     return db_plate
 
-def get_plate(db: Session, plate_id: int):
-    return db.query(AutoPlate).filter(AutoPlate.id == plate_id).first()
-
-def update_plate(db: Session, plate_id: int, plate: AutoPlateCreate):
-    db_plate = db.query(AutoPlate).filter(AutoPlate.id == plate_id).first()
+async def update_plate(db: AsyncSession, plate_id: int, plate: AutoPlateCreate):
+    db_plate = await db.get(AutoPlate, plate_id)
     if not db_plate:
         return None
     for key, value in plate.dict().items():
         setattr(db_plate, key, value)
-    db.commit()
-    db.refresh(db_plate)
+    await db.commit()
+    await db.refresh(db_plate)
+    plate_index.add(db_plate.id, db_plate.plate_number)
+    publish_plates(updated=[(db_plate.id, db_plate.plate_number, db_plate.deadline if db_plate.is_active else None)])
+    analytics.set_price(plate_id, db_plate.current_highest_amount if db_plate.is_active and db_plate.bid_count else None)
+    await response_cache.invalidate_plates([plate_id])
     return db_plate
 
-def delete_plate(db: Session, plate_id: int):
-    db_plate = db.query(AutoPlate).filter(AutoPlate.id == plate_id).first()
+async def delete_plate(db: AsyncSession, plate_id: int):
+    db_plate = await db.get(AutoPlate, plate_id)
     if not db_plate:
         return None
-    db.delete(db_plate)
-    db.commit()
+    # Its bids are kept, detached, as deleting through the relationship used to leave them.
+    # The log withdraws them, or a restart would replay them onto a plate that reuses the id.
+    result = await db.execute(select(Bid.user_id, Bid.id, Bid.amount).where(Bid.plate_id == plate_id))
+    await append(db, [bid_event(WITHDRAWN, plate_id, user_id, bid_id, amount) for user_id, bid_id, amount in result.all()])
+    await db.execute(update(Bid).where(Bid.plate_id == plate_id).values(plate_id=None))
+    await db.delete(db_plate)
+    await db.commit()
+    plate_index.remove(plate_id)
+    analytics.set_price(plate_id, None)
+    publish_plates(deleted=[plate_id])
+    await response_cache.invalidate_plates([plate_id])
     return db_plate
 
-def list_plates(db: Session):
-    return db.query(AutoPlate).all()
+def like_pattern(pattern: str) -> str:
+    # Vanity pattern with '?' for any single character, matched anywhere in the plate number
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%" + escaped.replace(WILDCARD, "_") + "%"
 
-def create_bid(db: Session, bid: BidCreate, user_id: int):
-    db_bid = Bid(**bid.dict(), user_id=user_id)
-    db.add(db_bid)
-    db.commit()
-    db.refresh(db_bid)
-    return db_bid
+def plate_number_filter(contains=None, startswith=None, pattern=None):
+    # Returns (condition, whether it is a primary key lookup from the search index)
+    matches = plate_index.search(contains, startswith, pattern)
+    if matches is not None:
+        return (AutoPlate.id.in_(sorted(matches)) if matches else false()), True
+    conditions = []
+    if contains:
+        conditions.append(AutoPlate.plate_number.contains(contains, autoescape=True))
+    if startswith:
+        conditions.append(AutoPlate.plate_number.startswith(startswith, autoescape=True))
+    if pattern:
+        conditions.append(AutoPlate.plate_number.like(like_pattern(pattern), escape="\\"))
+    return and_(*conditions), False
 
-def get_bid(db: Session, bid_id: int):
-    return db.query(Bid).filter(Bid.id == bid_id).first()
+def plate_list_query(columns, contains=None, ordering="deadline", after=None, limit=None,
+                     startswith=None, pattern=None):
+    sort_column, descending = PLATE_ORDERINGS[ordering]
+    active = AutoPlate.is_active == True
+    if contains or startswith or pattern:
+        condition, indexed = plate_number_filter(contains, startswith, pattern)
+        if indexed:
+            # Keep the planner on primary key lookups for the few candidates instead of
+            # walking the (is_active, sort) index to avoid a sort
+            active = func.coalesce(AutoPlate.is_active, false()) == True
+        query = select(*columns).where(active, condition)
+    else:
+        query = select(*columns).where(active)
+    if after is not None:
+        query = query.where(keyset_condition(sort_column, AutoPlate.id, after[0], after[1], descending))
+    if descending:
+        query = query.order_by(sort_column.desc(), AutoPlate.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), AutoPlate.id.asc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query
 
-def update_bid(db: Session, bid_id: int, bid: BidCreate):
-    db_bid = db.query(Bid).filter(Bid.id == bid_id).first()
-    if not db_bid:
-        return None
-    for key, value in bid.dict().items():
-        setattr(db_bid, key, value)
-    db.commit()
-    db.refresh(db_bid)
-    return db_bid
+async def list_plates(db: AsyncSession, columns=None, contains=None, ordering="deadline", after=None, limit=None,
+                      startswith=None, pattern=None):
+    # Without columns this returns AutoPlate objects, otherwise plain rows
+    query = plate_list_query(columns or (AutoPlate,), contains, ordering, after, limit, startswith, pattern)
+    result = await db.execute(query)
+    return result.all() if columns else result.scalars().all()
+
+def plate_summary_values():
+    # Correlated subqueries that rebuild a plate's bid summary from the bids table
+    plate_bids = Bid.plate_id == AutoPlate.id
+    return {
+        "current_highest_amount": func.coalesce(
+            select(func.max(Bid.amount)).where(plate_bids).scalar_subquery(), 0
+        ),
+        "bid_count": select(func.count(Bid.id)).where(plate_bids).scalar_subquery(),
+        "leading_user_id": (
+            select(Bid.user_id).where(plate_bids)
+            .order_by(Bid.amount.desc(), Bid.id.asc()).limit(1).scalar_subquery()
+        ),
+        "last_bid_at": select(func.max(Bid.created_at)).where(plate_bids).scalar_subquery(),
+    }
+
+async def refresh_plate_summary(db: AsyncSession, plate_id: int):
+    await db.execute(
+        update(AutoPlate).where(AutoPlate.id == plate_id).values(**plate_summary_values())
+        .execution_options(synchronize_session="fetch")
+    )
+
+async def reconcile_plate_summaries(db: AsyncSession) -> int:
+    result = await db.execute(
+        update(AutoPlate).values(**plate_summary_values())
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
 
-def delete_bid(db: Session, bid_id: int):
-    db_bid = db.query(Bid).filter(Bid.id == bid_id).first()
+async def get_bid(db: AsyncSession, bid_id: int):
+    return await db.get(Bid, bid_id)
+
+async def delete_bid(db: AsyncSession, bid_id: int):
+    db_bid = await db.get(Bid, bid_id)
     if not db_bid:
         return None
-    db.delete(db_bid)
-    db.commit()
+    await db.delete(db_bid)
+    await db.flush()
+    await refresh_plate_summary(db, db_bid.plate_id)
+    await append(db, [bid_event(WITHDRAWN, db_bid.plate_id, db_bid.user_id, bid_id, db_bid.amount)])
+    await db.commit()
+    await response_cache.invalidate_plates([db_bid.plate_id])
     return db_bid
 
-def list_user_bids(db: Session, user_id: int):
-    return db.query(Bid).filter(Bid.user_id == user_id).all()
\ No newline at end of file
+PLATE_DETAIL_COLUMNS = (
+    AutoPlate.id, AutoPlate.plate_number, AutoPlate.description, AutoPlate.deadline,
+    AutoPlate.is_active, AutoPlate.winner_id, AutoPlate.current_highest_amount,
+    AutoPlate.bid_count, AutoPlate.leading_user_id, AutoPlate.last_bid_at,
+)
+
+async def get_plate_detail_row(db: AsyncSession, plate_id: int):
+    result = await db.execute(select(*PLATE_DETAIL_COLUMNS).where(AutoPlate.id == plate_id))
+    return result.first()
+
+async def plate_bid_history(db: AsyncSession, plate_id: int, since_bid_id=None, since=None, limit=100):
+    # Returns (bids oldest first, whether more bids exist beyond the page). Bidders' names
+    # come from the same query rather than one lookup per bid.
+    query = (
+        select(Bid.id, Bid.amount, Bid.user_id, User.username, Bid.created_at)
+        .outerjoin(User, User.id == Bid.user_id)
+        .where(Bid.plate_id == plate_id)
+    )
+    if since_bid_id is not None:
+        query = query.where(Bid.id > since_bid_id).order_by(Bid.id.asc())
+    elif since is not None:
+        query = query.where(Bid.created_at > since).order_by(Bid.created_at.asc(), Bid.id.asc())
+    else:
+        # No cursor: the most recent bids
+        query = query.order_by(Bid.created_at.desc(), Bid.id.desc())
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if since_bid_id is None and since is None:
+        rows.reverse()
+    return rows, has_more
+
+BID_COLUMNS = (Bid.id, Bid.amount, Bid.plate_id, Bid.user_id, Bid.created_at)
+
+async def list_user_bids(db: AsyncSession, user_id: int):
+    # Plain rows in BidResponse field order, no ORM objects to build and convert
+    result = await db.execute(select(*BID_COLUMNS).where(Bid.user_id == user_id))
+    return result.all()
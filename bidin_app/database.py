@@ -1,21 +1,163 @@
-from sqlalchemy import create_engine
+from dataclasses import dataclass
+from typing import List, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# Async drivers for the request path; the sync URL is kept for scripts and benchmarks
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def _env_bool(name: str) -> Optional[bool]:
+    value = os.getenv(name)
+    return None if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str = "sqlite:///./test.db"
+    # Read-only routes use this engine when set (a replica, or the same SQLite file opened
+    # read-only so readers get their own pool)
+    read_url: Optional[str] = None
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    # None: on for server databases, off for SQLite where a ping is just another round trip
+    pool_pre_ping: Optional[bool] = None
+    echo: bool = False
+    # SQLite pragmas, applied to every new connection. WAL lets readers run while a bid
+    # holds the write lock; NORMAL only syncs at checkpoints, which is safe in WAL mode.
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    mmap_size: int = 256 * 1024 * 1024
+    # Negative values are KiB
+    cache_size: int = -64000
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        defaults = cls()
+        return cls(
+            url=os.getenv("DATABASE_URL", defaults.url),
+            read_url=os.getenv("DATABASE_READ_URL") or None,
+            pool_size=int(os.getenv("DB_POOL_SIZE", defaults.pool_size)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", defaults.max_overflow)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", defaults.pool_timeout)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", defaults.pool_recycle)),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING"),
+            echo=bool(_env_bool("DB_ECHO")),
+            journal_mode=os.getenv("SQLITE_JOURNAL_MODE", defaults.journal_mode),
+            synchronous=os.getenv("SQLITE_SYNCHRONOUS", defaults.synchronous),
+            busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", defaults.busy_timeout_ms)),
+            mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", defaults.mmap_size)),
+            cache_size=int(os.getenv("SQLITE_CACHE_SIZE", defaults.cache_size)),
+        )
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def is_memory_sqlite(url: str) -> bool:
+    return is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith(":"))
+
+
+def sqlite_pragmas(settings: DatabaseSettings, read_only: bool = False) -> List[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout={settings.busy_timeout_ms}",
+        f"PRAGMA synchronous={settings.synchronous}",
+        f"PRAGMA mmap_size={settings.mmap_size}",
+        f"PRAGMA cache_size={settings.cache_size}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    # The journal mode is stored in the file, and a read-only connection can't change it
+    if not read_only:
+        pragmas.insert(0, f"PRAGMA journal_mode={settings.journal_mode}")
+    return pragmas
+
+
+def engine_options(settings: DatabaseSettings, url: str) -> dict:
+    options = {"echo": settings.echo}
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+        if is_memory_sqlite(url):
+            # One shared connection, pool sizing doesn't apply
+            return options
+    pre_ping = settings.pool_pre_ping if settings.pool_pre_ping is not None else not is_sqlite(url)
+    options.update(
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_pre_ping=pre_ping,
+    )
+    return options
+
+
+def _apply_pragmas(sync_engine, pragmas: List[str]):
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def build_engine(settings: DatabaseSettings, url: Optional[str] = None, read_only: bool = False):
+    url = url or settings.url
+    engine = create_engine(url, **engine_options(settings, url))
+    if is_sqlite(url):
+        _apply_pragmas(engine, sqlite_pragmas(settings, read_only))
+    return engine
+
+
+def build_async_engine(settings: DatabaseSettings, url: Optional[str] = None, read_only: bool = False):
+    url = url or settings.url
+    engine = create_async_engine(to_async_url(url), **engine_options(settings, url))
+    if is_sqlite(url):
+        _apply_pragmas(engine.sync_engine, sqlite_pragmas(settings, read_only))
+    return engine
+
+
+settings = DatabaseSettings.from_env()
+SQLALCHEMY_DATABASE_URL = settings.url
+ASYNC_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+
+engine = build_engine(settings)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = build_async_engine(settings)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# Replica reads may lag the primary: a cached response filled from a lagging replica
+# stays until RESPONSE_CACHE_TTL, so keep that short when DATABASE_READ_URL is set
+read_engine = build_async_engine(settings, settings.read_url, read_only=True) if settings.read_url else async_engine
+AsyncReadSessionLocal = async_sessionmaker(
+    read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    # For routes that never write
+    async with AsyncReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,36 +1,103 @@
+from dataclasses import dataclass
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from models import User
-from database import get_db
-from passlib.context import CryptContext
+from database import get_db, get_read_db
+from hashing import password_context
+from cache import TTLCache
+from cluster import cluster
 import os
+import time
 
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Trust the uid/staff claims without touching the database (deleted users stay valid until expiry)
+STATELESS_AUTH = os.getenv("STATELESS_AUTH", "0") == "1"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# Verified token payloads, so repeated tokens skip the HMAC check and JSON decoding
+token_cache = TTLCache(maxsize=10000, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60")),
+)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _jwt():
+    # python-jose (and the crypto backends it pulls in) loads on the first token rather than
+    # at import; the lifespan prewarm calls this before the app reports ready
+    from jose import jwt
+    return jwt
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    is_staff: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(id=user.id, username=user.username, is_staff=bool(user.is_staff))
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.pop(user_id)
+    cluster.publish("principal", user_id)
+
+
+cluster.subscribe("principal", principal_cache.pop)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_principal(target.id)
+
+
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = _jwt().encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(
+def create_user_token(user: User):
+    return create_access_token(data={"sub": user.username, "uid": user.id, "staff": bool(user.is_staff)})
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    from jose import JWTError
+    try:
+        payload = _jwt().decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as exc:
+        raise InvalidToken(str(exc)) from exc
+    # Never serve a cached payload past the token's own expiry
+    ttl = min(token_cache.ttl, payload.get("exp", 0) - time.time())
+    if ttl > 0:
+        token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     credentials_exception = HTTPException(
         status_code=401,
@@ -38,15 +105,31 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except InvalidToken:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
+    user_id = payload.get("uid")
+    if user_id is None:
+        # Tokens issued before the uid claim existed
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        return Principal.from_user(user)
+
+    if STATELESS_AUTH and "staff" in payload:
+        return Principal(id=user_id, username=username, is_staff=bool(payload["staff"]))
+
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = await db.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        principal_cache.set(user_id, principal)
 
-    return user
\ No newline at end of file
+    return principal
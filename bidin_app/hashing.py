@@ -0,0 +1,141 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from cluster import CLUSTER_WORKERS
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# serve.py runs CLUSTER_WORKERS processes on the machine, each with its own pool: they share the cores
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // CLUSTER_WORKERS))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+_contexts: Dict[int, "CryptContext"] = {}
+
+
+def password_context(rounds: int = BCRYPT_ROUNDS) -> "CryptContext":
+    # passlib is imported with the first context, not at startup
+    context = _contexts.get(rounds)
+    if context is None:
+        from passlib.context import CryptContext
+        context = _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds
+        )
+    return context
+
+
+class HasherBusy(Exception):
+    # Every worker and queue slot is taken; the app answers 429 with Retry-After
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Too many password checks in progress, try again shortly")
+        self.retry_after = retry_after
+
+
+# Module level so they can be pickled into the worker processes
+def _hash(password: str, rounds: int) -> str:
+    return password_context(rounds).hash(password)
+
+
+def _load_context(rounds: int):
+    password_context(rounds)
+
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    # passlib returns a fresh hash when the stored one uses a different cost
+    return password_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE,
+                 rounds: int = BCRYPT_ROUNDS):
+        # workers=0 hashes on a single background thread instead of a process pool
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self._executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+
+    @property
+    def capacity(self) -> int:
+        return max(self.workers, 1) + self.queue_limit
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - max(self.workers, 1))
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                # spawn: forking a process that already runs the event loop and driver threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def _observe(self, seconds: float):
+        self.completed += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[index] += 1
+                break
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HasherBusy()
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            self._observe(time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(_verify_and_update, password, hashed_password, self.rounds)
+
+    async def warm_up(self):
+        # Starts the workers and loads passlib in each, which the first login would wait for
+        password_context(self.rounds)
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, _load_context, self.rounds)
+                               for _ in range(max(self.workers, 1))))
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_sum_seconds": self.latency_sum,
+            "latency_max_seconds": self.latency_max,
+            "latency_buckets": dict(zip(LATENCY_BUCKETS, self.latency_buckets)),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hasher = PasswordHasher()
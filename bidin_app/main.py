@@ -1,64 +1,227 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+import os
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from models import User
-from dependencies import get_db, verify_password, create_access_token
-from crud import create_user
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from dependencies import get_db, create_user_token, create_access_token, decode_token
+from crud import create_user, authenticate_user, get_plate_detail_row, plate_bid_history
 from schemas import UserCreate
 from routes.auth import router as auth_router
 from routes.plates import router as plates_router
 from routes.bids import router as bids_router
+from routes.analytics import router as analytics_router
+from database import AsyncSessionLocal, AsyncReadSessionLocal, async_engine, read_engine, settings as database_settings
+from order_book import order_books
+from hashing import hasher, HasherBusy
+from scheduler import scheduler
+from plate_search import plate_index
+from bid_log import checkpointer, recover
+from rate_limit import limit_login
+from cluster import cluster
+from analytics import analytics
+from metrics import MetricsMiddleware, registry, CONTENT_TYPE
+from schema import upgrade_database
 
-app = FastAPI()
-
-# Mount static files and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-# Homepage
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
-
-# Register page
-@app.get("/register", response_class=HTMLResponse)
-async def register_page(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request})
-
-# Login page
-@app.get("/login", response_class=HTMLResponse)
-async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
-
-# Handle registration form submission
-@app.post("/auth/register")
-async def register_user(
-    username: str = Form(...), 
-    email: str = Form(...), 
-    password: str = Form(...), 
-    db: Session = Depends(get_db)
-):
-    user_create = UserCreate(username=username, email=email, password=password)
-    db_user = create_user(db, user_create)
-    access_token = create_access_token(data={"sub": db_user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
-
-# Handle login form submission
-@app.post("/auth/login")
-async def login_user(
-    username: str = Form(...), 
-    password: str = Form(...), 
-    db: Session = Depends(get_db)
-):
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
-    access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
-
-# Include Routers
-app.include_router(auth_router)
-app.include_router(plates_router)
-app.include_router(bids_router)
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    static_dir: str = "static"
+    templates_dir: str = "templates"
+    # Pay the first requests' one-off costs in the lifespan, before /readyz says ready
+    prewarm: bool = True
+    # Pooled connections opened by the prewarm; None fills the pool (DB_POOL_SIZE)
+    prewarm_connections: Optional[int] = None
+
+    @classmethod
+    def from_env(cls) -> "AppSettings":
+        defaults = cls()
+        connections = os.getenv("APP_PREWARM_CONNECTIONS")
+        return cls(
+            static_dir=os.getenv("APP_STATIC_DIR", defaults.static_dir),
+            templates_dir=os.getenv("APP_TEMPLATES_DIR", defaults.templates_dir),
+            prewarm=_env_bool("APP_PREWARM", defaults.prewarm),
+            prewarm_connections=int(connections) if connections else None,
+        )
+
+
+class Pages:
+    # Jinja2 is imported, and a template compiled, on first use rather than at startup
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._templates = None
+
+    @property
+    def templates(self):
+        if self._templates is None:
+            from fastapi.templating import Jinja2Templates
+            self._templates = Jinja2Templates(directory=self.directory)
+        return self._templates
+
+    def render(self, request: Request, name: str):
+        return self.templates.TemplateResponse(request, name)
+
+    def load(self) -> int:
+        # Compiles every template into Jinja's cache
+        names = [name for name in os.listdir(self.directory) if name.endswith(".html")]
+        for name in names:
+            self.templates.get_template(name)
+        return len(names)
+
+
+async def warm_pool(engine: AsyncEngine, connections: int):
+    # Opens the connections now (driver thread, SQLite pragmas) and leaves them in the pool
+    opened = []
+    try:
+        for _ in range(connections):
+            connection = await engine.connect()
+            opened.append(connection)
+            await connection.execute(text("SELECT 1"))
+    finally:
+        for connection in opened:
+            await connection.close()
+
+
+async def prewarm(app: FastAPI, settings: AppSettings):
+    connections = settings.prewarm_connections
+    if connections is None:
+        connections = database_settings.pool_size
+    await warm_pool(async_engine, connections)
+    if read_engine is not async_engine:
+        await warm_pool(read_engine, connections)
+    # Compiles the plate detail's statements into SQLAlchemy's cache
+    async with AsyncReadSessionLocal() as db:
+        await get_plate_detail_row(db, 0)
+        await plate_bid_history(db, 0)
+    app.state.pages.load()
+    # Loads python-jose and its backends
+    decode_token(create_access_token({"sub": ""}))
+    await hasher.warm_up()
+    app.openapi()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings: AppSettings = app.state.settings
+    if cluster.workers == 1:
+        # serve.py upgrades once before starting several workers
+        await upgrade_database(async_engine)
+    # Joined first, so other workers' writes during the warm-up aren't missed
+    await cluster.start()
+    # Load every plate's bids into memory before serving bids: the bid log's newest
+    # snapshot plus the events after it
+    async with AsyncSessionLocal() as db:
+        order_books.load((await recover(db)).rows())
+        await scheduler.load(db)
+        await plate_index.warm_up(db)
+        await analytics.warm_up(db)
+    if settings.prewarm:
+        await prewarm(app, settings)
+    scheduler.start()
+    analytics.start()
+    if cluster.worker_id == 0:
+        # One worker writing snapshots is enough
+        checkpointer.start()
+    app.state.ready = True
+    yield
+    # Out of the load balancer first
+    app.state.ready = False
+    await checkpointer.stop()
+    await analytics.stop()
+    await scheduler.stop()
+    await cluster.stop()
+    hasher.shutdown()
+    # Closing the connections lets SQLite checkpoint and remove the WAL file
+    await async_engine.dispose()
+    if read_engine is not async_engine:
+        await read_engine.dispose()
+
+
+async def hasher_busy(request: Request, exc: HasherBusy) -> JSONResponse:
+    return JSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
+
+def create_app(settings: Optional[AppSettings] = None) -> FastAPI:
+    settings = settings or AppSettings.from_env()
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.ready = False
+    app.state.pages = pages = Pages(settings.templates_dir)
+    app.add_middleware(MetricsMiddleware)
+    app.add_exception_handler(HasherBusy, hasher_busy)
+
+    # Mount static files
+    app.mount("/static", StaticFiles(directory=settings.static_dir), name="static")
+
+    # Homepage
+    @app.get("/", response_class=HTMLResponse)
+    async def read_root(request: Request):
+        return pages.render(request, "index.html")
+
+    # Register page
+    @app.get("/register", response_class=HTMLResponse)
+    async def register_page(request: Request):
+        return pages.render(request, "register.html")
+
+    # Login page
+    @app.get("/login", response_class=HTMLResponse)
+    async def login_page(request: Request):
+        return pages.render(request, "login.html")
+
+    # Handle registration form submission
+    @app.post("/auth/register")
+    async def register_user(
+        username: str = Form(...), 
+        email: str = Form(...), 
+        password: str = Form(...), 
+        db: AsyncSession = Depends(get_db)
+    ):
+        user_create = UserCreate(username=username, email=email, password=password)
+        db_user = await create_user(db, user_create)
+        access_token = create_user_token(db_user)
+        return {"access_token": access_token, "token_type": "bearer"}
+
+    # Handle login form submission
+    @app.post("/auth/login")
+    async def login_user(
+        request: Request,
+        username: str = Form(...), 
+        password: str = Form(...), 
+        db: AsyncSession = Depends(get_db)
+    ):
+        await limit_login(request, username)
+        user = await authenticate_user(db, username, password)
+        if not user:
+            raise HTTPException(status_code=400, detail="Incorrect username or password")
+        access_token = create_user_token(user)
+        return {"access_token": access_token, "token_type": "bearer"}
+
+    # Readiness probe: 503 until the lifespan warm-up is done, and again once shutdown starts
+    @app.get("/readyz", include_in_schema=False)
+    async def readyz():
+        if not app.state.ready:
+            return JSONResponse({"status": "starting"}, status_code=503)
+        return {"status": "ready"}
+
+    # Prometheus scrape endpoint
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(registry.render(), media_type=CONTENT_TYPE)
+
+    # Include Routers
+    app.include_router(auth_router)
+    app.include_router(plates_router)
+    app.include_router(bids_router)
+    app.include_router(analytics_router)
+    return app
+
+
+app = create_app()
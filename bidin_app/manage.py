@@ -0,0 +1,108 @@
+# Maintenance commands, run from the bidin_app directory:
+#
+#   python manage.py migrate
+#   python manage.py reconcile-summaries
+#   python manage.py import-plates plates.csv --user-id 1 [--server http://127.0.0.1:8000]
+#   python manage.py export-plates plates.ndjson
+import argparse
+import asyncio
+import json
+import os
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from database import AsyncSessionLocal, async_engine
+from schema import upgrade_database
+import crud
+import bulk
+from dependencies import create_user_token
+from models import User
+
+# The running server to tell about imported plates; its search index and close schedule
+# only learn of plates written by another process when asked to reload
+APP_URL = os.getenv("APP_URL", "http://127.0.0.1:8000")
+
+
+async def migrate(args):
+    added = await upgrade_database(async_engine)
+    print(f"Schema up to date, added {len(added)} columns" + (f": {', '.join(added)}" if added else ""))
+
+
+async def reconcile_summaries(args):
+    async with AsyncSessionLocal() as db:
+        count = await crud.reconcile_plate_summaries(db)
+    print(f"Rebuilt bid summaries for {count} plates")
+
+
+def file_format(path, requested):
+    fmt = requested or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in bulk.FORMATS:
+        raise SystemExit(f"Unknown format {fmt!r}, use --format csv or ndjson")
+    return fmt
+
+
+async def import_plates(args):
+    fmt = file_format(args.path, args.format)
+    records = bulk.iter_records(bulk.iter_lines(bulk.file_chunks(args.path)), fmt)
+    async with AsyncSessionLocal() as db:
+        report = await bulk.import_plates(db, records, args.user_id, args.chunk_size)
+        user = await db.get(User, args.user_id)
+    print(json.dumps(report, indent=2))
+    if report["inserted"] and args.server:
+        if user is None or not user.is_staff:
+            print("Not reloading the server: --user-id is not staff; POST /plates/reload as staff or restart it")
+        else:
+            reload_server(args.server, create_user_token(user))
+
+
+def reload_server(server, token):
+    request = Request(f"{server.rstrip('/')}/plates/reload", method="POST",
+                      headers={"Authorization": f"Bearer {token}"})
+    try:
+        with urlopen(request, timeout=30) as response:
+            print(f"Reloaded {server}: {response.read().decode()}")
+    except (URLError, OSError) as exc:
+        # Not fatal: the plates are in the database, a server restart picks them up too
+        print(f"Could not reload {server} ({exc}); POST /plates/reload as staff or restart it")
+
+
+async def export_plates(args):
+    fmt = file_format(args.path, args.format)
+    with open(args.path, "wb") as handle:
+        async for chunk in bulk.export_plates(fmt, args.chunk_size):
+            handle.write(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bidin_app maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrator = commands.add_parser("migrate", help="Create missing tables, columns and indexes")
+    migrator.set_defaults(handler=migrate)
+
+    reconcile = commands.add_parser(
+        "reconcile-summaries", help="Rebuild plate price/bid count/leader columns from the bids table"
+    )
+    reconcile.set_defaults(handler=reconcile_summaries)
+
+    importer = commands.add_parser("import-plates", help="Load plates from a CSV or NDJSON file")
+    importer.add_argument("path")
+    importer.add_argument("--user-id", type=int, required=True, help="Recorded as the plates' creator")
+    importer.add_argument("--format", choices=bulk.FORMATS)
+    importer.add_argument("--chunk-size", type=int, default=bulk.BULK_CHUNK_SIZE)
+    importer.add_argument("--server", default=APP_URL,
+                          help="Server to reload afterwards, empty to skip (default $APP_URL)")
+    importer.set_defaults(handler=import_plates)
+
+    exporter = commands.add_parser("export-plates", help="Write every plate and its bids to a CSV or NDJSON file")
+    exporter.add_argument("path")
+    exporter.add_argument("--format", choices=bulk.FORMATS)
+    exporter.add_argument("--chunk-size", type=int, default=bulk.BULK_CHUNK_SIZE)
+    exporter.set_defaults(handler=export_plates)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
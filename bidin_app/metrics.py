@@ -0,0 +1,353 @@
+import bisect
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from hashing import hasher
+from response_cache import response_cache
+from cluster import cluster
+from analytics import analytics
+from rate_limit import rate_limiter
+
+# 0 turns the slow request log off; when on, requests keep the SQL they issued
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "50"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+INF = float("inf")
+
+logger = logging.getLogger("bidin.slow_requests")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value) -> str:
+    if value == INF:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _header(name: str, kind: str, help: str) -> List[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = _header(self.name, self.kind, self.help)
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+    def clear(self):
+        self.values.clear()
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> per-bucket counts (the last one is +Inf), then the sum
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def count(self, *labels) -> int:
+        entry = self.values.get(labels)
+        return sum(entry[:-1]) if entry else 0
+
+    def render(self) -> List[str]:
+        lines = _header(self.name, "histogram", self.help)
+        bounds = self.buckets + (INF,)
+        for labels, entry in sorted(self.values.items()):
+            lines.extend(_histogram_lines(self.name, self.labelnames, labels, zip(bounds, entry), entry[-1]))
+        return lines
+
+    def clear(self):
+        self.values.clear()
+
+
+def _histogram_lines(name: str, labelnames: Sequence[str], labels: Sequence,
+                     buckets: Iterable[Tuple[float, int]], total: float) -> List[str]:
+    # Counts come in per bucket and go out cumulative
+    lines = []
+    cumulative = 0
+    for bound, count in buckets:
+        cumulative += count
+        bucket_labels = _labels(tuple(labelnames) + ("le",), tuple(labels) + (_number(float(bound)),))
+        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labelnames, labels)} {_number(total)}")
+    lines.append(f"{name}_count{_labels(labelnames, labels)} {cumulative}")
+    return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Callables returning already rendered lines, for objects that keep their own counts
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], List[str]]):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+HTTP_LABELS = ("method", "route")
+
+http_requests = registry.counter(
+    "bidin_http_requests_total", "HTTP requests by route and status code", HTTP_LABELS + ("status",))
+http_in_progress = registry.gauge("bidin_http_requests_in_progress", "HTTP requests being served")
+http_latency = registry.histogram(
+    "bidin_http_request_duration_seconds", "Time to serve a request", HTTP_LABELS)
+http_db_time = registry.histogram(
+    "bidin_http_request_db_seconds", "Time a request spent executing SQL", HTTP_LABELS)
+http_serialize_time = registry.histogram(
+    "bidin_http_request_serialize_seconds", "Time a request spent encoding JSON", HTTP_LABELS)
+http_queries = registry.histogram(
+    "bidin_http_request_queries", "SQL statements issued per request", HTTP_LABELS, QUERY_BUCKETS)
+db_queries = registry.counter("bidin_db_queries_total", "SQL statements executed, in requests or not")
+db_time = registry.counter("bidin_db_seconds_total", "Time spent executing SQL, in requests or not")
+bids = registry.counter(
+    "bidin_bids_total", "Bids by source (single, update, batch, proxy, auto) and outcome",
+    ("source", "outcome", "status"))
+
+
+def record_bid(source: str, status_code: int = 200, amount: int = 1):
+    outcome = "accepted" if status_code == 200 else "rejected"
+    bids.inc(source, outcome, str(status_code), amount=amount)
+
+
+@registry.collector
+def _password_hashing() -> List[str]:
+    stats = hasher.metrics()
+    lines = _header("bidin_password_hash_seconds", "histogram", "bcrypt hash and verify time, queueing included")
+    lines.extend(_histogram_lines("bidin_password_hash_seconds", (), (),
+                                  stats["latency_buckets"].items(), stats["latency_sum_seconds"]))
+    lines += _header("bidin_password_hash_in_flight", "gauge", "Password checks running or queued")
+    lines.append(f"bidin_password_hash_in_flight {stats['in_flight']}")
+    lines += _header("bidin_password_hash_queue_depth", "gauge", "Password checks waiting for a worker")
+    lines.append(f"bidin_password_hash_queue_depth {stats['queue_depth']}")
+    lines += _header("bidin_password_hash_rejected_total", "counter", "Password checks refused with 429")
+    lines.append(f"bidin_password_hash_rejected_total {stats['rejected']}")
+    return lines
+
+
+@registry.collector
+def _response_cache() -> List[str]:
+    stats = response_cache.metrics()
+    lines = []
+    for key in ("hits", "misses", "coalesced", "invalidations", "evictions"):
+        name = f"bidin_response_cache_{key}_total"
+        lines += _header(name, "counter", f"Response cache {key}")
+        lines.append(f"{name}{_labels(('backend',), (stats['backend'],))} {stats[key]}")
+    lines += _header("bidin_response_cache_entries", "gauge", "Responses held by the cache")
+    lines.append(f"bidin_response_cache_entries{_labels(('backend',), (stats['backend'],))} {stats['entries']}")
+    return lines
+
+
+@registry.collector
+def _rate_limiter() -> List[str]:
+    stats = rate_limiter.metrics()
+    lines = _header("bidin_rate_limited_total", "counter", "Requests refused with 429, by bucket scope")
+    for scope, count in sorted(stats["limited"].items()):
+        lines.append(f"bidin_rate_limited_total{_labels(('scope',), (scope,))} {count}")
+    lines += _header("bidin_rate_limit_errors_total", "counter", "Limiter backend failures (requests let through)")
+    lines.append(f"bidin_rate_limit_errors_total {stats['errors']}")
+    lines += _header("bidin_rate_limit_buckets", "gauge", "Token buckets held in memory")
+    lines.append(f"bidin_rate_limit_buckets {stats['buckets']}")
+    return lines
+
+
+@registry.collector
+def _cluster() -> List[str]:
+    stats = cluster.metrics()
+    labels = _labels(("worker",), (str(stats["worker"]),))
+    lines = _header("bidin_cluster_connected", "gauge", "Whether this worker is connected to the other workers")
+    lines.append(f"bidin_cluster_connected{labels} {int(stats['connected'])}")
+    for key, help_text in (("sent", "Messages sent to other workers"),
+                           ("received", "Messages received from other workers"),
+                           ("dropped", "Messages dropped while disconnected"),
+                           ("calls", "Bids forwarded to the plate's owner"),
+                           ("served", "Forwarded bids accepted for other workers")):
+        name = f"bidin_cluster_{key}_total"
+        lines += _header(name, "counter", help_text)
+        lines.append(f"{name}{labels} {stats[key]}")
+    return lines
+
+
+@registry.collector
+def _analytics() -> List[str]:
+    stats = analytics.metrics()
+    lines = _header("bidin_analytics_buckets", "gauge", "Price series buckets held for the analytics endpoints")
+    lines.append(f"bidin_analytics_buckets {stats['buckets']}")
+    lines += _header("bidin_analytics_folded_total", "counter", "Minute buckets folded into hour buckets")
+    lines.append(f"bidin_analytics_folded_total {stats['folded']}")
+    return lines
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "serialize_seconds", "statements")
+
+    def __init__(self, keep_statements: bool = False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.statements: Optional[List[Tuple[float, str]]] = [] if keep_statements else None
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def record_serialization(seconds: float):
+    stats = current_request.get()
+    if stats is not None:
+        stats.serialize_seconds += seconds
+
+
+# Every engine, sync or async (those run their sync engine's events inside the request's
+# context), so the query counts need no wiring in database.py
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    db_queries.inc()
+    db_time.inc(amount=elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+            stats.statements.append((elapsed, statement))
+
+
+def route_label(scope) -> str:
+    # The route template, so /plates/{plate_id} is one series rather than one per plate
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task per request, and streaming
+    # responses (the bid feed) pass straight through
+    def __init__(self, app, slow_request_ms: Optional[float] = None):
+        self.app = app
+        # None follows SLOW_REQUEST_MS
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        slow_request_ms = SLOW_REQUEST_MS if self.slow_request_ms is None else self.slow_request_ms
+        stats = RequestStats(keep_statements=slow_request_ms > 0)
+        token = current_request.set(stats)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_progress.dec()
+            current_request.reset(token)
+            labels = (scope["method"], route_label(scope))
+            http_requests.inc(*labels, str(status[0]))
+            http_latency.observe(elapsed, *labels)
+            http_db_time.observe(stats.db_seconds, *labels)
+            http_serialize_time.observe(stats.serialize_seconds, *labels)
+            http_queries.observe(stats.queries, *labels)
+            if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+                log_slow_request(scope, status[0], elapsed, stats)
+
+
+def log_slow_request(scope, status_code: int, elapsed: float, stats: RequestStats):
+    lines = [
+        f"slow request {scope['method']} {scope['path']} -> {status_code} in {elapsed * 1000:.1f} ms "
+        f"(db {stats.db_seconds * 1000:.1f} ms over {stats.queries} queries, "
+        f"serialization {stats.serialize_seconds * 1000:.1f} ms)"
+    ]
+    for seconds, statement in stats.statements or ():
+        lines.append(f"  {seconds * 1000:.2f} ms  {' '.join(statement.split())}")
+    if stats.queries > len(stats.statements or ()):
+        lines.append(f"  ... {stats.queries - len(stats.statements)} more")
+    logger.warning("\n".join(lines))
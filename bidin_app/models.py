@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Numeric, UniqueConstraint
+from sqlalchemy import Column, Integer, SmallInteger, String, Text, DateTime, Boolean, ForeignKey, Numeric, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
 
+# Relationships never load on access: a query that needs one says how, with selectinload
+# or joinedload, so touching one per row can't quietly issue a query per row. Deletes leave
+# the children to the caller (see crud.delete_plate) instead of loading them first.
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -10,8 +13,9 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_staff = Column(Boolean, default=False)
-    plates_created = relationship("AutoPlate", back_populates="created_by")
-    bids = relationship("Bid", back_populates="user")
+    plates_created = relationship("AutoPlate", back_populates="created_by", foreign_keys="AutoPlate.created_by_id",
+                                  lazy="raise", passive_deletes=True)
+    bids = relationship("Bid", back_populates="user", lazy="raise", passive_deletes=True)
 
 class AutoPlate(Base):
     __tablename__ = "auto_plates"
@@ -20,9 +24,22 @@ class AutoPlate(Base):
     description = Column(Text)
     deadline = Column(DateTime)
     created_by_id = Column(Integer, ForeignKey("users.id"))
-    created_by = relationship("User", back_populates="plates_created")
+    created_by = relationship("User", back_populates="plates_created", foreign_keys=[created_by_id], lazy="raise")
     is_active = Column(Boolean, default=True)
-    bids = relationship("Bid", back_populates="plate")
+    bids = relationship("Bid", back_populates="plate", lazy="raise", passive_deletes=True)
+    # Bid summary, maintained in the same transaction as every bid write (see crud.py)
+    current_highest_amount = Column(Numeric(10, 2), nullable=False, default=0, server_default="0")
+    bid_count = Column(Integer, nullable=False, default=0, server_default="0")
+    leading_user_id = Column(Integer, ForeignKey("users.id"))
+    last_bid_at = Column(DateTime)
+    # Set by the auction-close scheduler (see scheduler.py)
+    winner_id = Column(Integer, ForeignKey("users.id"))
+
+    __table_args__ = (
+        # Keyset pagination of the active listing
+        Index("ix_auto_plates_active_deadline_id", "is_active", "deadline", "id"),
+        Index("ix_auto_plates_active_price_id", "is_active", "current_highest_amount", "id"),
+    )
 
 class Bid(Base):
     __tablename__ = "bids"
@@ -31,9 +48,53 @@ class Bid(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     plate_id = Column(Integer, ForeignKey("auto_plates.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
-    user = relationship("User", back_populates="bids")
-    plate = relationship("AutoPlate", back_populates="bids")
+    user = relationship("User", back_populates="bids", lazy="raise")
+    plate = relationship("AutoPlate", back_populates="bids", lazy="raise")
 
     __table_args__ = (
         UniqueConstraint("user_id", "plate_id", name="unique_user_plate"),
+        Index("ix_bids_plate_amount", "plate_id", "amount"),
+        # Bid history of a plate, read incrementally by GET /plates/{id}
+        Index("ix_bids_plate_created", "plate_id", "created_at"),
     )
+
+class ProxyBid(Base):
+    # Hidden maximum a user is willing to pay; proxy_bidding.py bids on their behalf up to it
+    __tablename__ = "proxy_bids"
+    id = Column(Integer, primary_key=True, index=True)
+    plate_id = Column(Integer, ForeignKey("auto_plates.id"))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    max_amount = Column(Numeric(10, 2), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "plate_id", name="unique_user_plate_proxy"),
+        Index("ix_proxy_bids_plate_max", "plate_id", "max_amount"),
+    )
+
+class BidEvent(Base):
+    # Append-only history of every bid write (see bid_log.py); rows are never updated or deleted
+    __tablename__ = "bid_events"
+    id = Column(Integer, primary_key=True)
+    plate_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    bid_id = Column(Integer, nullable=False)
+    # bid_log.PLACED, RAISED or WITHDRAWN
+    kind = Column(SmallInteger, nullable=False)
+    amount = Column(Numeric(10, 2))
+    by_proxy = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # A plate's audit trail; the only secondary index, to keep appends cheap
+        Index("ix_bid_events_plate_id", "plate_id", "id"),
+    )
+
+class BidLogSnapshot(Base):
+    # Live bids as of last_event_id, so recovery only replays the events after it
+    __tablename__ = "bid_log_snapshots"
+    id = Column(Integer, primary_key=True)
+    last_event_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    bids = Column(Integer, nullable=False)
+    state = Column(LargeBinary, nullable=False)
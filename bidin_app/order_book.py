@@ -0,0 +1,160 @@
+import json
+import threading
+from bisect import bisect_left, insort
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Bid
+from cluster import cluster
+
+
+class PlateOrderBook:
+    def __init__(self, plate_id: int):
+        self.plate_id = plate_id
+        # user_id -> ranking entry; ranking is kept sorted so the top bid is ranking[0]
+        self.entries: Dict[int, Tuple] = {}
+        self.ranking: List[Tuple] = []
+
+    def add(self, user_id: int, amount, bid_id: int):
+        self.remove(user_id)
+        # Highest amount first, earliest bid id wins ties
+        entry = (-amount, bid_id, user_id)
+        self.entries[user_id] = entry
+        insort(self.ranking, entry)
+
+    def remove(self, user_id: int):
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+        index = bisect_left(self.ranking, entry)
+        del self.ranking[index]
+
+    def highest_amount(self):
+        return -self.ranking[0][0] if self.ranking else None
+
+    def leader(self) -> Optional[int]:
+        return self.ranking[0][2] if self.ranking else None
+
+    def ranked_bidders(self, limit: Optional[int] = None):
+        entries = self.ranking if limit is None else self.ranking[:limit]
+        return [(user_id, -neg_amount) for neg_amount, _, user_id in entries]
+
+
+class OrderBookRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._books: Dict[int, PlateOrderBook] = {}
+        # Once warm, a plate without a book is known to have no bids unless it is stale. Only
+        # plates with bids keep a book, so reads of unknown plate ids don't grow the registry.
+        self._warm = False
+        self._stale: Set[int] = set()
+        # Bumped on every write so a slow lazy load never overwrites newer state
+        self._generation = 0
+
+    async def warm_up(self, db: AsyncSession):
+        result = await db.execute(select(Bid.plate_id, Bid.user_id, Bid.amount, Bid.id))
+        self.load(result.all())
+
+    def load(self, rows: Iterable[Tuple]):
+        # (plate_id, user_id, amount, bid_id) rows, from the bids table or the bid log's state
+        books: Dict[int, PlateOrderBook] = {}
+        for plate_id, user_id, amount, bid_id in rows:
+            book = books.get(plate_id)
+            if book is None:
+                book = books[plate_id] = PlateOrderBook(plate_id)
+            book.add(user_id, amount, bid_id)
+        with self._lock:
+            self._books = books
+            self._stale = set()
+            self._warm = True
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._books = {}
+            self._stale = set()
+            self._warm = False
+            self._generation += 1
+
+    async def _load(self, db: AsyncSession, plate_id: int) -> PlateOrderBook:
+        result = await db.execute(
+            select(Bid.user_id, Bid.amount, Bid.id).where(Bid.plate_id == plate_id)
+        )
+        rows = result.all()
+        book = PlateOrderBook(plate_id)
+        for user_id, amount, bid_id in rows:
+            book.add(user_id, amount, bid_id)
+        return book
+
+    async def get(self, db: AsyncSession, plate_id: int) -> PlateOrderBook:
+        with self._lock:
+            book = self._books.get(plate_id)
+            if book is not None:
+                return book
+            if self._warm and plate_id not in self._stale:
+                return PlateOrderBook(plate_id)
+            generation = self._generation
+        book = await self._load(db, plate_id)
+        with self._lock:
+            current = self._books.get(plate_id)
+            if current is not None:
+                return current
+            if generation != self._generation:
+                # Something was written while we were loading; serve it but don't cache it
+                return book
+            if book.ranking:
+                self._books[plate_id] = book
+            self._stale.discard(plate_id)
+            return book
+
+    async def highest_amount(self, db: AsyncSession, plate_id: int):
+        book = await self.get(db, plate_id)
+        with self._lock:
+            return book.highest_amount()
+
+    def record(self, bid: Bid):
+        self.add(bid.plate_id, bid.user_id, bid.amount, bid.id)
+
+    def add(self, plate_id: int, user_id: int, amount, bid_id: int):
+        with self._lock:
+            self._generation += 1
+            book = self._books.get(plate_id)
+            if book is None:
+                if not self._warm or plate_id in self._stale:
+                    # Not loaded yet: the next read will pick the bid up from the database
+                    return
+                book = self._books[plate_id] = PlateOrderBook(plate_id)
+            book.add(user_id, amount, bid_id)
+
+    def remove(self, plate_id: int, user_id: int):
+        with self._lock:
+            self._generation += 1
+            book = self._books.get(plate_id)
+            if book is not None:
+                book.remove(user_id)
+                if not book.ranking:
+                    del self._books[plate_id]
+
+    def invalidate(self, plate_id: int):
+        with self._lock:
+            self._generation += 1
+            self._books.pop(plate_id, None)
+            self._stale.add(plate_id)
+
+
+order_books = OrderBookRegistry()
+
+
+def _apply_feed(payload: dict):
+    # Bids written by other workers, from the feed events they publish
+    event = json.loads(payload["message"])
+    if event["type"] == "bid":
+        order_books.add(event["plate_id"], event["user_id"], Decimal(str(event["amount"])), event["bid_id"])
+    elif event["type"] == "bid_deleted":
+        order_books.remove(event["plate_id"], event["user_id"])
+    elif event["type"] == "closed":
+        order_books.invalidate(event["plate_id"])
+
+
+cluster.subscribe("feed", _apply_feed)
@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+
+def encode_cursor(ordering: str, value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif value is not None:
+        value = str(value)
+    raw = json.dumps({"o": ordering, "v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, ordering: str, python_type: type):
+    invalid = HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data["o"] != ordering:
+            raise invalid
+        value, row_id = data["v"], int(data["id"])
+        if python_type is datetime:
+            value = datetime.fromisoformat(value)
+        elif python_type is Decimal:
+            value = Decimal(value)
+        else:
+            value = python_type(value)
+    except (ValueError, KeyError, TypeError, InvalidOperation):
+        raise invalid
+    return value, row_id
+
+
+def keyset_condition(sort_column, id_column, value, row_id: int, descending: bool):
+    # Row-value comparison, served directly by an index on (sort_column, id)
+    if descending:
+        return tuple_(sort_column, id_column) < tuple_(value, row_id)
+    return tuple_(sort_column, id_column) > tuple_(value, row_id)
@@ -0,0 +1,162 @@
+import os
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AutoPlate
+
+WILDCARD = "?"
+START = "^"
+# Above this many matches the LIKE scan (ordered by an index, stopping at the page limit) is cheaper
+MAX_CANDIDATES = int(os.getenv("PLATE_SEARCH_MAX_CANDIDATES", "2000"))
+# Give up before verifying when even the rarest gram is this many times too common
+MAX_SCAN_FACTOR = 5
+
+
+def normalize(plate_number: str) -> str:
+    # SQLite's LIKE is case-insensitive for ASCII; searches through the index behave the same
+    return plate_number.upper()
+
+
+def plate_grams(text: str) -> Set[str]:
+    # Trigrams of "^PLATE", plus every other character masked ("7?7", "7?7?7")
+    # so vanity patterns have something selective to look up
+    padded = START + text
+    grams = set()
+    for i in range(len(padded) - 2):
+        grams.add(padded[i:i + 3])
+        grams.add(padded[i] + WILDCARD + padded[i + 2])
+        if i + 4 < len(padded):
+            grams.add(padded[i] + WILDCARD + padded[i + 2] + WILDCARD + padded[i + 4])
+    return grams
+
+
+def query_grams(query: str) -> Set[str]:
+    grams = set()
+    for i in range(len(query) - 2):
+        gram = query[i:i + 3]
+        if WILDCARD not in gram:
+            grams.add(gram)
+        if gram[0] != WILDCARD and gram[2] != WILDCARD:
+            grams.add(gram[0] + WILDCARD + gram[2])
+            skip = query[i:i + 5:2]
+            if len(skip) == 3 and WILDCARD not in skip:
+                grams.add(WILDCARD.join(skip))
+    return grams
+
+
+def pattern_regex(pattern: str):
+    return re.compile(".".join(re.escape(part) for part in pattern.split(WILDCARD)))
+
+
+class PlateSearchIndex:
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+        self.plates: Dict[int, str] = {}
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+        # Plates whose number holds the START marker itself, so "^AB" is not only a prefix gram
+        self.marked: Set[int] = set()
+        # Until loaded the index knows nothing and every search falls back to SQL
+        self.ready = False
+
+    def __len__(self):
+        return len(self.plates)
+
+    def load(self, rows: Iterable):
+        self.clear()
+        for plate_id, plate_number in rows:
+            self.add(plate_id, plate_number)
+        self.ready = True
+
+    async def warm_up(self, db: AsyncSession):
+        result = await db.execute(select(AutoPlate.id, AutoPlate.plate_number))
+        self.load(result.all())
+
+    def clear(self):
+        self.plates = {}
+        self.postings = defaultdict(set)
+        self.marked = set()
+        self.ready = False
+
+    def add(self, plate_id: int, plate_number: Optional[str]):
+        self.remove(plate_id)
+        if not plate_number:
+            return
+        text = normalize(plate_number)
+        self.plates[plate_id] = text
+        if START in text:
+            self.marked.add(plate_id)
+        for gram in plate_grams(text):
+            self.postings[gram].add(plate_id)
+
+    def remove(self, plate_id: int):
+        text = self.plates.pop(plate_id, None)
+        if text is None:
+            return
+        self.marked.discard(plate_id)
+        for gram in plate_grams(text):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(plate_id)
+                if not posting:
+                    del self.postings[gram]
+
+    def search(self, contains: Optional[str] = None, startswith: Optional[str] = None,
+               pattern: Optional[str] = None) -> Optional[Set[int]]:
+        # Matching plate ids, or None when the caller should filter in SQL instead
+        if not self.ready:
+            return None
+        grams: Set[str] = set()
+        checks: List = []
+        keys: List[str] = []
+        if contains:
+            text = normalize(contains)
+            # A literal '?' in a substring search has no wildcard meaning
+            if WILDCARD not in text:
+                grams |= query_grams(text)
+            checks.append(lambda plate, text=text: text in plate)
+            keys.append(text)
+        if startswith:
+            text = normalize(startswith)
+            if WILDCARD not in text:
+                grams |= query_grams(START + text)
+            checks.append(lambda plate, text=text: plate.startswith(text))
+            keys.append(START + text)
+        if pattern:
+            text = normalize(pattern)
+            grams |= query_grams(text)
+            checks.append(pattern_regex(text).search)
+            keys.append(text)
+        if not grams:
+            # Too short to be selective
+            return None
+
+        # A literal START in the query or in a plate shares grams with the start-of-plate
+        # marker; the postings then only narrow the candidates and each one gets checked
+        literal_start = self.marked or any(START in query for query in (contains, startswith, pattern) if query)
+        if len(keys) == 1 and keys[0] in grams and not literal_start:
+            # The query is itself an indexed gram: its posting is the exact answer
+            matches = self.postings.get(keys[0], ())
+            return None if len(matches) > self.max_candidates else set(matches)
+
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = postings[0]
+        if len(candidates) > self.max_candidates * MAX_SCAN_FACTOR:
+            return None
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates = candidates & posting
+        plates = self.plates
+        if len(checks) == 1:
+            check = checks[0]
+        else:
+            check = lambda plate: all(each(plate) for each in checks)
+        matches = {plate_id for plate_id in candidates if check(plates[plate_id])}
+        if len(matches) > self.max_candidates:
+            return None
+        return matches
+
+
+plate_index = PlateSearchIndex()
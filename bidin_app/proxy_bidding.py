@@ -0,0 +1,237 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AutoPlate, Bid, ProxyBid
+from response_cache import response_cache
+from bid_log import append, bid_event, PLACED, RAISED
+from bidding import BidRejected, is_lock_conflict, MAX_ATTEMPTS, BASE_BACKOFF, MAX_BACKOFF
+
+# (price from, increment): a proxy outbids a competitor by the increment for the competitor's amount
+INCREMENTS = (
+    (Decimal("0"), Decimal("1")),
+    (Decimal("100"), Decimal("5")),
+    (Decimal("1000"), Decimal("25")),
+    (Decimal("5000"), Decimal("100")),
+    (Decimal("25000"), Decimal("250")),
+    (Decimal("100000"), Decimal("1000")),
+)
+
+
+def increment_for(amount: Decimal) -> Decimal:
+    step = INCREMENTS[0][1]
+    for threshold, increment in INCREMENTS:
+        if amount < threshold:
+            break
+        step = increment
+    return step
+
+
+@dataclass(frozen=True)
+class Proxy:
+    user_id: int
+    max_amount: Decimal
+    created_at: datetime
+    id: int
+
+
+@dataclass(frozen=True)
+class Resolution:
+    price: Decimal
+    leader_id: int
+    # The outbid proxy whose maximum set the price; its visible bid moves up to it
+    runner_up_id: Optional[int] = None
+    runner_up_amount: Optional[Decimal] = None
+
+
+def rank(proxies: Iterable[Proxy]) -> List[Proxy]:
+    # Highest maximum first; equal maximums go to whoever registered first
+    return sorted(proxies, key=lambda proxy: (-proxy.max_amount, proxy.created_at, proxy.id))
+
+
+def resolve(price: Decimal, leader_id: Optional[int], proxies: Iterable[Proxy]) -> Optional[Resolution]:
+    # Visible price and leader once every proxy has bid as far as it needs to, or None if
+    # nothing changes. One pass over the top two maximums replaces the bid-by-bid back and forth.
+    ranked = rank(proxies)
+    if not ranked:
+        return None
+    top = ranked[0]
+    if top.user_id != leader_id and top.max_amount <= price:
+        return None
+    second = next((proxy for proxy in ranked[1:] if proxy.user_id != top.user_id), None)
+
+    competitor, runner_up = None, None
+    if leader_id is not None and leader_id != top.user_id:
+        competitor = price
+    if second is not None and second.max_amount > price:
+        competitor, runner_up = second.max_amount, second
+
+    if competitor is None:
+        if top.user_id == leader_id:
+            return None
+        new_price = min(top.max_amount, price + increment_for(price))
+    elif top.max_amount > competitor:
+        new_price = min(top.max_amount, competitor + increment_for(competitor))
+    else:
+        # Tied maximums: the earlier proxy holds the price and the later one is not shown at it
+        new_price, runner_up = competitor, None
+    if top.user_id == leader_id and new_price <= price:
+        return None
+    if runner_up is not None:
+        return Resolution(new_price, top.user_id, runner_up.user_id, runner_up.max_amount)
+    return Resolution(new_price, top.user_id)
+
+
+async def proxy_ceilings(db: AsyncSession, plate_ids: Iterable[int], user_id: int) -> Dict[int, Decimal]:
+    # Highest maximum other users hold on each plate
+    result = await db.execute(
+        select(ProxyBid.plate_id, func.max(ProxyBid.max_amount))
+        .where(ProxyBid.plate_id.in_(list(plate_ids)), ProxyBid.user_id != user_id)
+        .group_by(ProxyBid.plate_id)
+    )
+    return {plate_id: amount for plate_id, amount in result.all()}
+
+
+class _Moved(Exception):
+    pass
+
+
+async def _try_resolve(db: AsyncSession, plate_id: int) -> List[Bid]:
+    now = datetime.now()
+    bid_time = datetime.utcnow()
+    result = await db.execute(
+        select(AutoPlate.current_highest_amount, AutoPlate.leading_user_id, AutoPlate.is_active,
+               AutoPlate.deadline)
+        .where(AutoPlate.id == plate_id)
+    )
+    plate = result.first()
+    if plate is None or not plate.is_active or plate.deadline <= now:
+        await db.rollback()
+        return []
+    # Users are unique per plate, so the top two rows are the only proxies that matter
+    result = await db.execute(
+        select(ProxyBid.user_id, ProxyBid.max_amount, ProxyBid.created_at, ProxyBid.id)
+        .where(ProxyBid.plate_id == plate_id)
+        .order_by(ProxyBid.max_amount.desc(), ProxyBid.created_at.asc(), ProxyBid.id.asc())
+        .limit(2)
+    )
+    proxies = [Proxy(*row) for row in result.all()]
+    price = Decimal(plate.current_highest_amount)
+    resolution = resolve(price, plate.leading_user_id, proxies)
+    if resolution is None:
+        await db.rollback()
+        return []
+
+    amounts = {resolution.leader_id: resolution.price}
+    if resolution.runner_up_id is not None:
+        amounts[resolution.runner_up_id] = resolution.runner_up_amount
+    result = await db.execute(
+        select(Bid.user_id, Bid.id, Bid.amount, Bid.created_at)
+        .where(Bid.plate_id == plate_id, Bid.user_id.in_(list(amounts)))
+    )
+    existing = {row.user_id: row for row in result.all()}
+    # Visible bids only ever move up
+    changed = {user_id: amount for user_id, amount in amounts.items()
+               if user_id not in existing or existing[user_id].amount < amount}
+
+    written = await db.execute(
+        update(AutoPlate)
+        .where(
+            AutoPlate.id == plate_id,
+            AutoPlate.is_active == True,
+            AutoPlate.deadline > now,
+            AutoPlate.current_highest_amount == plate.current_highest_amount,
+        )
+        .values(
+            current_highest_amount=resolution.price,
+            leading_user_id=resolution.leader_id,
+            bid_count=AutoPlate.bid_count + sum(1 for user_id in changed if user_id not in existing),
+            last_bid_at=bid_time,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if written.rowcount != 1:
+        raise _Moved()
+
+    bids = []
+    # Runner-up first so the leader's bid is the later, higher one
+    for user_id in sorted(changed, key=lambda user_id: changed[user_id]):
+        amount = changed[user_id]
+        if user_id in existing:
+            row = existing[user_id]
+            await db.execute(
+                update(Bid).where(Bid.id == row.id).values(amount=amount)
+                .execution_options(synchronize_session=False)
+            )
+            bids.append(Bid(id=row.id, plate_id=plate_id, user_id=user_id, amount=amount,
+                            created_at=row.created_at))
+        else:
+            inserted = await db.execute(
+                insert(Bid).values(plate_id=plate_id, user_id=user_id, amount=amount, created_at=bid_time)
+                .returning(Bid.id)
+            )
+            bids.append(Bid(id=inserted.scalar_one(), plate_id=plate_id, user_id=user_id, amount=amount,
+                            created_at=bid_time))
+    await append(db, [
+        bid_event(RAISED if bid.user_id in existing else PLACED, plate_id, bid.user_id, bid.id, bid.amount,
+                  bid_time, by_proxy=True)
+        for bid in bids
+    ])
+    await db.commit()
+    await response_cache.invalidate_plates([plate_id])
+    return bids
+
+
+async def resolve_plate(db: AsyncSession, plate_id: int) -> List[Bid]:
+    # Lets the plate's proxies answer the latest bid; returns the bids written on their behalf
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return await _try_resolve(db, plate_id)
+        except (_Moved, IntegrityError):
+            # Another bid landed between the read and the write: resolve against the new state
+            await db.rollback()
+        except OperationalError as exc:
+            await db.rollback()
+            if not is_lock_conflict(exc):
+                raise
+        backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, backoff))
+    return []
+
+
+async def set_proxy_bid(db: AsyncSession, user_id: int, plate_id: int, max_amount) -> ProxyBid:
+    max_amount = Decimal(str(max_amount))
+    now = datetime.now()
+    plate = await db.get(AutoPlate, plate_id)
+    if plate is None:
+        raise BidRejected(404, "Plate not found")
+    if not plate.is_active or plate.deadline <= now:
+        raise BidRejected(400, "Bidding is closed for this plate")
+    if plate.leading_user_id != user_id and max_amount <= plate.current_highest_amount:
+        raise BidRejected(400, "Maximum bid must exceed current highest bid")
+
+    result = await db.execute(
+        select(ProxyBid).where(ProxyBid.plate_id == plate_id, ProxyBid.user_id == user_id)
+    )
+    proxy = result.scalar_one_or_none()
+    if proxy is None:
+        proxy = ProxyBid(plate_id=plate_id, user_id=user_id, max_amount=max_amount)
+        db.add(proxy)
+    else:
+        if max_amount <= proxy.max_amount:
+            raise BidRejected(400, "A maximum bid can only be raised")
+        # Raising counts as a new bid for tie-breaking
+        proxy.max_amount = max_amount
+        proxy.created_at = datetime.utcnow()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise BidRejected(409, "A maximum bid for this plate was just registered, please retry")
+    await db.refresh(proxy)
+    return proxy
@@ -0,0 +1,265 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from fastapi import Depends, HTTPException, Request
+from dependencies import InvalidToken, decode_token, oauth2_scheme
+
+# "memory" (per process), "redis" (shared by every worker) or "off"
+RATE_LIMIT = os.getenv("RATE_LIMIT", "memory")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "redis://localhost:6379/0")
+# Buckets kept in memory; the least recently used (most idle) go first
+RATE_LIMIT_BUCKETS = int(os.getenv("RATE_LIMIT_BUCKETS", "100000"))
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+
+# "<requests>/<seconds>": bursts up to <requests>, refilled evenly over <seconds>. "off" disables.
+LOGIN_RATE_PER_IP = os.getenv("LOGIN_RATE_PER_IP", "20/60")
+# Per username and client address
+LOGIN_RATE_PER_USERNAME = os.getenv("LOGIN_RATE_PER_USERNAME", "10/60")
+BID_RATE_PER_IP = os.getenv("BID_RATE_PER_IP", "120/10")
+BID_RATE_PER_USER = os.getenv("BID_RATE_PER_USER", "30/10")
+BID_RATE_PER_PLATE = os.getenv("BID_RATE_PER_PLATE", "100/1")
+
+
+@dataclass(frozen=True)
+class Rate:
+    capacity: float
+    per_second: float
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> Optional["Rate"]:
+        if not value or value.lower() in ("0", "off", "none"):
+            return None
+        requests, _, seconds = value.partition("/")
+        return cls(capacity=float(requests), per_second=float(requests) / float(seconds or 1))
+
+
+class MemoryBackend:
+    # Shards keep each LRU short and let threads (the sync engine, scripts) take buckets
+    # without one global lock. Evicting an idle bucket only forgets that it had refilled.
+    name = "memory"
+
+    def __init__(self, maxsize: int = RATE_LIMIT_BUCKETS, shards: int = RATE_LIMIT_SHARDS,
+                 timer: Callable[[], float] = time.monotonic):
+        self.shard_size = max(1, maxsize // shards)
+        self.timer = timer
+        self._shards: List["OrderedDict[str, tuple]"] = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self.evictions = 0
+
+    async def take(self, key: str, rate: Rate, cost: float = 1) -> float:
+        return self.take_now(key, rate, cost)
+
+    def take_now(self, key: str, rate: Rate, cost: float = 1) -> float:
+        # Seconds until `cost` tokens are available, 0 when they were taken
+        index = hash(key) % len(self._shards)
+        buckets = self._shards[index]
+        with self._locks[index]:
+            now = self.timer()
+            state = buckets.get(key)
+            if state is None:
+                tokens = rate.capacity
+            else:
+                tokens = min(rate.capacity, state[0] + (now - state[1]) * rate.per_second)
+            retry_after = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                retry_after = (cost - tokens) / rate.per_second
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+            if len(buckets) > self.shard_size:
+                buckets.popitem(last=False)
+                self.evictions += 1
+        return retry_after
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets in self._shards)
+
+    def clear(self):
+        for buckets in self._shards:
+            buckets.clear()
+        self.evictions = 0
+
+
+# Refill and take in one round trip, on the server's clock so workers agree. Buckets
+# expire once they would be full again, which bounds memory the way the LRU does.
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * per_second)
+end
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / per_second * 1000))
+return tostring(retry_after)
+"""
+
+
+class RedisBackend:
+    name = "redis"
+
+    def __init__(self, url: str = RATE_LIMIT_URL, prefix: str = "bidin:rate:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT=redis needs the 'redis' package installed")
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.prefix = prefix
+        self.evictions = 0
+        self._error = redis.RedisError
+
+    async def take(self, key: str, rate: Rate, cost: float = 1) -> float:
+        try:
+            result = await self.script(keys=[self.prefix + key], args=[rate.capacity, rate.per_second, cost])
+        except self._error as exc:
+            raise ConnectionError(str(exc))
+        return float(result)
+
+    def __len__(self) -> int:
+        return 0
+
+    def clear(self):
+        pass
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self.allowed = 0
+        self.limited: Dict[str, int] = {}
+        # Backend failures let the request through: a limiter outage shouldn't stop bidding
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def hit(self, scope: str, key, rate: Optional[Rate], cost: float = 1):
+        if self.backend is None or rate is None:
+            return
+        try:
+            retry_after = await self.backend.take(f"{scope}:{key}", rate, cost)
+        except (ConnectionError, OSError, TimeoutError):
+            self.errors += 1
+            return
+        if retry_after > 0:
+            self.limited[scope] = self.limited.get(scope, 0) + 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        self.allowed += 1
+
+    def metrics(self) -> dict:
+        return {
+            "backend": self.backend.name if self.enabled else "off",
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+            "errors": self.errors,
+            "buckets": len(self.backend) if self.enabled else 0,
+            "evictions": self.backend.evictions if self.enabled else 0,
+        }
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+        self.allowed = self.errors = 0
+        self.limited.clear()
+
+
+def create_backend(kind: str = RATE_LIMIT):
+    if kind == "off":
+        return None
+    if kind == "redis":
+        return RedisBackend()
+    return MemoryBackend()
+
+
+rate_limiter = RateLimiter(create_backend())
+
+login_ip_rate = Rate.parse(LOGIN_RATE_PER_IP)
+login_username_rate = Rate.parse(LOGIN_RATE_PER_USERNAME)
+bid_ip_rate = Rate.parse(BID_RATE_PER_IP)
+bid_user_rate = Rate.parse(BID_RATE_PER_USER)
+bid_plate_rate = Rate.parse(BID_RATE_PER_PLATE)
+
+
+def client_ip(request: Request) -> str:
+    # The peer address; behind a proxy run the server with forwarded-header support
+    return request.client.host if request.client else "unknown"
+
+
+async def limit_login(request: Request, username: str):
+    # Before the user lookup and bcrypt: per address, and per account from that address.
+    # Not per account alone, or anyone could lock a user out by failing logins as them.
+    ip = client_ip(request)
+    await rate_limiter.hit("login_ip", ip, login_ip_rate)
+    await rate_limiter.hit("login_user", f"{ip}:{username.lower()}", login_username_rate)
+
+
+async def limit_bidder(request: Request, token: str = Depends(oauth2_scheme)):
+    # Runs ahead of get_current_user. The user id comes from the (cached) token payload,
+    # so throttled requests never reach the database; bad tokens are left to get_current_user.
+    await rate_limiter.hit("bid_ip", client_ip(request), bid_ip_rate)
+    try:
+        user_id = decode_token(token).get("uid")
+    except InvalidToken:
+        return
+    if user_id is not None:
+        await rate_limiter.hit("bid_user", user_id, bid_user_rate)
+
+
+async def limit_plate(plate_id: int):
+    # Sheds a bid war's excess with 429s before it queues on the plate's row lock
+    await rate_limiter.hit("bid_plate", plate_id, bid_plate_rate)
+
+
+async def _json_body(request: Request):
+    # FastAPI has already read and cached the body; a malformed one is left to validation
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def limit_bid_plate(request: Request):
+    # Route dependency: runs ahead of get_current_user, so a throttled plate costs no token
+    # check or database work. Takes the plate from the raw body.
+    body = await _json_body(request)
+    plate_id = body.get("plate_id") if isinstance(body, dict) else None
+    if isinstance(plate_id, int):
+        await limit_plate(plate_id)
+
+
+async def limit_batch_plates(request: Request):
+    # As limit_bid_plate, one token per distinct plate in a batch: a batch writes each plate
+    # once however many bids it repeats on it, and costing the repeats would let one bidder
+    # (charged one token per batch) empty a plate's bucket for everyone else. A throttled
+    # plate turns the whole batch away, the agent retries it after Retry-After.
+    body = await _json_body(request)
+    bids = body.get("bids") if isinstance(body, dict) else None
+    if not isinstance(bids, list):
+        return
+    plate_ids = {bid.get("plate_id") for bid in bids if isinstance(bid, dict)}
+    for plate_id in sorted(plate_id for plate_id in plate_ids if isinstance(plate_id, int)):
+        await limit_plate(plate_id)
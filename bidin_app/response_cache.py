@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from cache import TTLCache
+from cluster import cluster
+
+# "memory" (per process), "redis" (shared, any Redis protocol server) or "off"
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+# Writes invalidate entries as they happen; the TTL only bounds what another process might miss
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+PLATE_LIST_GROUP = "plates"
+
+
+def plate_group(plate_id: int) -> str:
+    return f"plate:{plate_id}"
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def dumps(self) -> bytes:
+        return json.dumps({"headers": self.headers, "body": self.body.decode()}).encode()
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        payload = json.loads(data)
+        return cls(payload["body"].encode(), payload["headers"])
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Bumping a group's generation orphans its entries; the LRU drops them later
+        self._generations: Dict[str, int] = {}
+
+    async def get(self, group: str, key: str) -> Optional[CachedResponse]:
+        return self.entries.get((group, self._generations.get(group, 0), key))
+
+    async def set(self, group: str, key: str, value: CachedResponse):
+        self.entries.set((group, self._generations.get(group, 0), key), value)
+
+    async def invalidate(self, groups: List[str]):
+        for group in groups:
+            self._generations[group] = self._generations.get(group, 0) + 1
+
+    def evictions(self) -> int:
+        return self.entries.evictions
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self._generations.clear()
+
+
+class RedisBackend:
+    # One hash per group, so invalidating a plate or every listing page is a single DEL
+    # that all workers sharing the server see
+    name = "redis"
+
+    def __init__(self, url: str = RESPONSE_CACHE_URL, ttl: float = RESPONSE_CACHE_TTL, prefix: str = "bidin:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE=redis needs the 'redis' package installed")
+        self.client = redis.from_url(url)
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+
+    async def get(self, group: str, key: str) -> Optional[CachedResponse]:
+        data = await self.client.hget(self.prefix + group, key)
+        return CachedResponse.loads(data) if data is not None else None
+
+    async def set(self, group: str, key: str, value: CachedResponse):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(self.prefix + group, key, value.dumps())
+            pipe.expire(self.prefix + group, self.ttl)
+            await pipe.execute()
+
+    async def invalidate(self, groups: List[str]):
+        await self.client.delete(*(self.prefix + group for group in groups))
+
+    def evictions(self) -> int:
+        # Evictions happen on the server (see INFO stats)
+        return 0
+
+    def __len__(self) -> int:
+        return 0
+
+    def clear(self):
+        pass
+
+
+class _Flight:
+    def __init__(self, group: str):
+        self.group = group
+        self.future = asyncio.get_running_loop().create_future()
+        # Set when the group is invalidated mid-fill: the result may predate the write
+        self.stale = False
+
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get_or_fill(self, group: str, key: str,
+                          fill: Callable[[], Awaitable[CachedResponse]]) -> Tuple[CachedResponse, str]:
+        # Returns the response and "HIT" or "MISS". Concurrent misses on one key share a
+        # single fill (single flight) instead of all hitting the database at once.
+        value = await self.backend.get(group, key)
+        if value is not None:
+            self.hits += 1
+            return value, "HIT"
+
+        flight = self._flights.get((group, key))
+        if flight is not None:
+            try:
+                value = await asyncio.shield(flight.future)
+                self.coalesced += 1
+                return value, "HIT"
+            except asyncio.CancelledError:
+                if not flight.future.cancelled():
+                    raise
+                # The filling request went away; fill for ourselves
+
+        self.misses += 1
+        flight = self._flights[(group, key)] = _Flight(group)
+        try:
+            value = await fill()
+        except BaseException as exc:
+            if isinstance(exc, asyncio.CancelledError):
+                flight.future.cancel()
+            else:
+                flight.future.set_exception(exc)
+                # Nobody may be waiting; don't let asyncio log it as never retrieved
+                flight.future.exception()
+            raise
+        finally:
+            if self._flights.get((group, key)) is flight:
+                del self._flights[(group, key)]
+        if not flight.stale:
+            await self.backend.set(group, key, value)
+        flight.future.set_result(value)
+        return value, "MISS"
+
+    async def invalidate(self, groups: Iterable[str]):
+        if not self.enabled:
+            return
+        groups = set(groups)
+        if self.backend.name == "memory":
+            # Every other worker holds its own copies
+            cluster.publish("invalidate", sorted(groups))
+        await self.invalidate_local(groups)
+
+    async def invalidate_local(self, groups: Iterable[str]):
+        if not self.enabled:
+            return
+        groups = set(groups)
+        for flight in self._flights.values():
+            if flight.group in groups:
+                flight.stale = True
+        self.invalidations += len(groups)
+        await self.backend.invalidate(list(groups))
+
+    async def invalidate_plates(self, plate_ids: Iterable[int]):
+        # A plate's own detail pages plus every listing page, which may show it
+        await self.invalidate([PLATE_LIST_GROUP, *(plate_group(plate_id) for plate_id in plate_ids)])
+
+    def metrics(self) -> dict:
+        return {
+            "backend": self.backend.name if self.enabled else "off",
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "evictions": self.backend.evictions() if self.enabled else 0,
+            "entries": len(self.backend) if self.enabled else 0,
+        }
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+        self._flights.clear()
+        self.hits = self.misses = self.coalesced = self.invalidations = 0
+
+
+def create_backend(kind: str = RESPONSE_CACHE):
+    if kind == "off":
+        return None
+    if kind == "redis":
+        return RedisBackend()
+    return MemoryBackend()
+
+
+response_cache = ResponseCache(create_backend())
+cluster.subscribe("invalidate", response_cache.invalidate_local)
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+from dependencies import get_read_db
+from models import AutoPlate
+from analytics import analytics, FINE_BUCKET, LEADERBOARD_SIZE, ANALYTICS_FINE_SECONDS
+from serialization import json_response
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+SERIES_FIELDS = ("open", "high", "low", "close", "bids")
+
+async def plate_numbers(db: AsyncSession, plate_ids: Iterable[int]) -> Dict[int, str]:
+    # A primary key lookup for the handful of plates on the page
+    plate_ids = list(plate_ids)
+    if not plate_ids:
+        return {}
+    result = await db.execute(select(AutoPlate.id, AutoPlate.plate_number).where(AutoPlate.id.in_(plate_ids)))
+    return dict(result.all())
+
+def utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+@router.get("/hot")
+async def hot_plates(
+    window: int = Query(300, ge=FINE_BUCKET, le=ANALYTICS_FINE_SECONDS, description="Seconds to count bids over"),
+    limit: int = Query(10, ge=1, le=LEADERBOARD_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Most contested plates: accepted bids per minute over the window
+    hot = analytics.hot_plates(window, limit)
+    numbers = await plate_numbers(db, [plate_id for plate_id, _ in hot])
+    return json_response([
+        {"plate_id": plate_id, "plate_number": numbers.get(plate_id), "bids": count,
+         "bids_per_minute": round(count * 60 / window, 2)}
+        for plate_id, count in hot
+    ])
+
+@router.get("/top-prices")
+async def top_prices(
+    limit: int = Query(10, ge=1, le=LEADERBOARD_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+):
+    top = analytics.top_prices(limit)
+    numbers = await plate_numbers(db, [plate_id for plate_id, _ in top])
+    return json_response([
+        {"plate_id": plate_id, "plate_number": numbers.get(plate_id), "current_highest_amount": price}
+        for plate_id, price in top
+    ])
+
+@router.get("/plates/{plate_id}/prices")
+async def price_series(
+    plate_id: int,
+    resolution: Optional[int] = Query(None, ge=FINE_BUCKET, description="Seconds per point, a multiple of 60"),
+    since: Optional[datetime] = Query(None, description="Only points from this time on"),
+):
+    # Price over time, one open/high/low/close point per interval. Older history is kept
+    # per hour only, so it can't be resolved finer than that.
+    if resolution is not None and resolution % FINE_BUCKET:
+        raise HTTPException(status_code=400, detail=f"resolution must be a multiple of {FINE_BUCKET} seconds")
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    resolution, points = analytics.price_series(plate_id, resolution, since.timestamp() if since else None)
+    return json_response({
+        "plate_id": plate_id,
+        "resolution": resolution,
+        "points": [{"t": utc(point[0]), **dict(zip(SERIES_FIELDS, point[1:]))} for point in points],
+    })
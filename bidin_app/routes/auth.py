@@ -1,22 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import UserCreate, UserLogin, Token
-from dependencies import get_db, create_access_token, verify_password
-from crud import create_user
-from models import User
+from dependencies import get_db, create_user_token
+from crud import create_user, authenticate_user
+from rate_limit import limit_login
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 @router.post("/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = create_user(db, user)
-    access_token = create_access_token(data={"sub": db_user.username})
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await create_user(db, user)
+    access_token = create_user_token(db_user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/login", response_model=Token)
-def login(form_data: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(request: Request, form_data: UserLogin, db: AsyncSession = Depends(get_db)):
+    await limit_login(request, form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -1,102 +1,195 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from decimal import Decimal
 from typing import List
-from schemas import BidCreate, BidResponse
-from dependencies import get_db, get_current_user
-from crud import create_bid, get_bid, update_bid, delete_bid, list_user_bids
-from models import Bid, AutoPlate, User
+from schemas import BidCreate, BidResponse, BidBatchCreate, BidBatchResponse, ProxyBidCreate, ProxyBidResponse
+from dependencies import get_db, get_current_user, Principal
+from crud import get_bid, delete_bid, list_user_bids, BID_COLUMNS
+from models import Bid, AutoPlate
+from order_book import order_books
+from bidding import accept_on_owner, accept_bids, BidRejected, MAX_BATCH_BIDS, EARLIER_MAXIMUM
+from bid_feed import hub, bid_event
+from proxy_bidding import proxy_ceilings, resolve_plate, set_proxy_bid
+from serialization import json_response, rows_as_dicts
+from metrics import record_bid
+from rate_limit import limit_bidder, limit_bid_plate, limit_batch_plates
+from analytics import analytics
 
 router = APIRouter(prefix="/bids", tags=["bids"])
 
+BID_FIELDS = tuple(column.key for column in BID_COLUMNS)
+
+async def answer_proxies(db: AsyncSession, plate_id: int):
+    # Proxies outbid by the last write respond in one step
+    proxy_bids = await resolve_plate(db, plate_id)
+    if proxy_bids:
+        record_bid("auto", amount=len(proxy_bids))
+    for proxy_bid in proxy_bids:
+        order_books.record(proxy_bid)
+        analytics.record(proxy_bid.plate_id, proxy_bid.amount)
+        hub.publish(plate_id, bid_event("bid", proxy_bid, proxy_bid.amount))
+
+async def check_proxy_ceiling(db: AsyncSession, plate_id: int, user_id: int, amount) -> bool:
+    # Rejects a tie with an earlier proxy; True when some proxy will answer the bid
+    ceiling = (await proxy_ceilings(db, [plate_id], user_id)).get(plate_id)
+    if ceiling is not None and ceiling == Decimal(str(amount)):
+        raise BidRejected(400, EARLIER_MAXIMUM)
+    return ceiling is not None and ceiling > Decimal(str(amount))
+
 @router.get("/", response_model=List[BidResponse])
-def list_user_bids_endpoint(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+async def list_user_bids_endpoint(
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    bids = list_user_bids(db, current_user.id)
-    return bids
+    bids = await list_user_bids(db, current_user.id)
+    return json_response(rows_as_dicts(BID_FIELDS, bids))
 
-@router.post("/", response_model=BidResponse)
-def place_bid(
+@router.post("/", response_model=BidResponse, dependencies=[Depends(limit_bidder), Depends(limit_bid_plate)])
+async def place_bid(
     bid: BidCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    # Check if the plate exists and is active
-    plate = db.query(AutoPlate).filter(AutoPlate.id == bid.plate_id).first()
-    if not plate:
-        raise HTTPException(status_code=404, detail="Plate not found")
-    if not plate.is_active or plate.deadline <= datetime.now():
-        raise HTTPException(status_code=400, detail="Bidding is closed for this plate")
+    try:
+        # Cheap in-memory reject; the conditional write in accept_bid is authoritative
+        highest_amount = await order_books.highest_amount(db, bid.plate_id)
+        if highest_amount is not None and bid.amount <= highest_amount:
+            raise BidRejected(400, "Bid amount must exceed current highest bid")
+        outbid = await check_proxy_ceiling(db, bid.plate_id, current_user.id, bid.amount)
+        db_bid = await accept_on_owner(db, current_user.id, bid.plate_id, bid.amount)
+    except BidRejected as exc:
+        record_bid("single", exc.status_code)
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    record_bid("single")
+    order_books.record(db_bid)
+    analytics.record(db_bid.plate_id, db_bid.amount)
+    hub.publish(db_bid.plate_id, bid_event("bid", db_bid, db_bid.amount))
+    if outbid:
+        await answer_proxies(db, db_bid.plate_id)
+    return db_bid
 
-    highest_bid = (
-        db.query(Bid.amount)
-        .filter(Bid.plate_id == bid.plate_id)
-        .order_by(Bid.amount.desc())
-        .first()
-    )
-    if highest_bid and bid.amount <= highest_bid[0]:
-        raise HTTPException(status_code=400, detail="Bid amount must exceed current highest bid")
+@router.post("/batch", response_model=BidBatchResponse, dependencies=[Depends(limit_bidder), Depends(limit_batch_plates)])
+async def place_bids(
+    batch: BidBatchCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    if len(batch.bids) > MAX_BATCH_BIDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_BIDS} bids per batch")
+    ceilings = await proxy_ceilings(db, {bid.plate_id for bid in batch.bids}, current_user.id)
+    results = await accept_bids(db, current_user.id, batch.bids, ceilings)
+    placed = {item.plate_id: item.bid for item in results if item.bid is not None}
+    for plate_id, db_bid in placed.items():
+        order_books.record(db_bid)
+        analytics.record(db_bid.plate_id, db_bid.amount)
+        hub.publish(plate_id, bid_event("bid", db_bid, db_bid.amount))
+    for plate_id, db_bid in placed.items():
+        if ceilings.get(plate_id, 0) > Decimal(str(db_bid.amount)):
+            await answer_proxies(db, plate_id)
+    for item in results:
+        record_bid("batch", item.status_code)
+    accepted = sum(1 for item in results if item.status_code == 200)
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
 
-    return create_bid(db, bid, current_user.id)
+@router.post("/proxy", response_model=ProxyBidResponse, dependencies=[Depends(limit_bidder), Depends(limit_bid_plate)])
+async def place_proxy_bid(
+    proxy: ProxyBidCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    try:
+        db_proxy = await set_proxy_bid(db, current_user.id, proxy.plate_id, proxy.max_amount)
+    except BidRejected as exc:
+        record_bid("proxy", exc.status_code)
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    record_bid("proxy")
+    # Read before resolving: a retry's rollback expires the instance
+    result = {
+        "id": db_proxy.id,
+        "plate_id": db_proxy.plate_id,
+        "user_id": db_proxy.user_id,
+        "max_amount": db_proxy.max_amount,
+        "created_at": db_proxy.created_at,
+    }
+    await answer_proxies(db, proxy.plate_id)
+    plate = await db.get(AutoPlate, proxy.plate_id, populate_existing=True)
+    result["current_highest_amount"] = plate.current_highest_amount
+    result["leading"] = plate.leading_user_id == current_user.id
+    return result
 
 @router.get("/{bid_id}", response_model=BidResponse)
-def get_bid_details(
+async def get_bid_details(
     bid_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    bid = get_bid(db, bid_id)
+    bid = await get_bid(db, bid_id)
     if not bid:
         raise HTTPException(status_code=404, detail="Bid not found")
     if bid.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to view this bid")
     return bid
 
-@router.put("/{bid_id}", response_model=BidResponse)
-def update_bid_details(
+# The body's plate is limited: a bid moved to another plate is turned away below anyway
+@router.put("/{bid_id}", response_model=BidResponse, dependencies=[Depends(limit_bidder), Depends(limit_bid_plate)])
+async def update_bid_details(
     bid_id: int,
     bid: BidCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    db_bid = get_bid(db, bid_id)
+    db_bid = await get_bid(db, bid_id)
     if not db_bid:
         raise HTTPException(status_code=404, detail="Bid not found")
     if db_bid.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to update this bid")
 
-    plate = db.query(AutoPlate).filter(AutoPlate.id == db_bid.plate_id).first()
-    if not plate.is_active or plate.deadline <= datetime.now():
-        raise HTTPException(status_code=400, detail="Bidding is closed for this plate")
-
-    highest_bid = (
-        db.query(Bid.amount)
-        .filter(Bid.plate_id == db_bid.plate_id)
-        .order_by(Bid.amount.desc())
-        .first()
-    )
-    if highest_bid and bid.amount <= highest_bid[0]:
-        raise HTTPException(status_code=400, detail="Bid amount must exceed current highest bid")
+    if bid.plate_id != db_bid.plate_id:
+        raise HTTPException(status_code=400, detail="A bid cannot be moved to another plate")
 
-    return update_bid(db, bid_id, bid)
+    try:
+        highest_amount = await order_books.highest_amount(db, db_bid.plate_id)
+        if highest_amount is not None and bid.amount <= highest_amount:
+            raise BidRejected(400, "Bid amount must exceed current highest bid")
+        outbid = await check_proxy_ceiling(db, db_bid.plate_id, current_user.id, bid.amount)
+        db_bid = await accept_on_owner(db, current_user.id, db_bid.plate_id, bid.amount, existing=db_bid)
+    except BidRejected as exc:
+        record_bid("update", exc.status_code)
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    record_bid("update")
+    order_books.record(db_bid)
+    analytics.record(db_bid.plate_id, db_bid.amount)
+    hub.publish(db_bid.plate_id, bid_event("bid", db_bid, db_bid.amount))
+    if outbid:
+        await answer_proxies(db, db_bid.plate_id)
+    return db_bid
 
 @router.delete("/{bid_id}")
-def delete_bid_details(
+async def delete_bid_details(
     bid_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    db_bid = get_bid(db, bid_id)
+    db_bid = await get_bid(db, bid_id)
     if not db_bid:
         raise HTTPException(status_code=404, detail="Bid not found")
     if db_bid.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You are not authorized to delete this bid")
 
-    plate = db.query(AutoPlate).filter(AutoPlate.id == db_bid.plate_id).first()
+    # A deleted plate leaves its bids behind with no plate
+    plate = await db.get(AutoPlate, db_bid.plate_id) if db_bid.plate_id is not None else None
+    if plate is None:
+        raise HTTPException(status_code=404, detail="Plate not found")
     if not plate.is_active or plate.deadline <= datetime.now():
         raise HTTPException(status_code=400, detail="Bidding is closed for this plate")
 
-    delete_bid(db, bid_id)
+    plate_id, user_id = db_bid.plate_id, db_bid.user_id
+    event = bid_event("bid_deleted", db_bid, None)
+    await delete_bid(db, bid_id)
+    order_books.remove(plate_id, user_id)
+    event["highest_amount"] = await order_books.highest_amount(db, plate_id)
+    analytics.set_price(plate_id, event["highest_amount"])
+    hub.publish(plate_id, event)
+    await answer_proxies(db, plate_id)
     return {"message": "Bid deleted successfully"}
\ No newline at end of file
@@ -1,106 +1,347 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime
+import asyncio
+import hashlib
+import json
 from schemas import AutoPlateCreate, AutoPlateResponse, AutoPlateDetailResponse
-from dependencies import get_db, get_current_user
-from crud import create_plate, get_plate, update_plate, delete_plate, list_plates
-from models import AutoPlate, Bid, User
+from dependencies import get_db, get_read_db, get_current_user, Principal
+from database import AsyncReadSessionLocal
+from crud import (
+    create_plate, update_plate, delete_plate, list_plates, plate_list_query, PLATE_ORDERINGS,
+    get_plate_detail_row, plate_bid_history, reload_plates,
+)
+from models import AutoPlate
+from order_book import order_books
+from pagination import encode_cursor, decode_cursor
+from bid_feed import hub
+from scheduler import scheduler
+from plate_search import plate_index
+from bulk import FORMATS, detect_format, export_plates, import_plates, iter_lines, iter_records
+from response_cache import response_cache, CachedResponse, PLATE_LIST_GROUP, plate_group
+from serialization import JSON, dumps, json_response, rows_as_dicts
+from bid_log import plate_events, KIND_NAMES
 
 router = APIRouter(prefix="/plates", tags=["plates"])
 
-def get_highest_bid(db: Session, plate_id: int) -> Optional[float]:
-    highest_bid = (
-        db.query(Bid.amount)
-        .filter(Bid.plate_id == plate_id)
-        .order_by(Bid.amount.desc())
-        .first()
-    )
-    return highest_bid[0] if highest_bid else None
+PLATE_FIELDS = tuple(AutoPlateResponse.model_fields)
+PLATES_PAGE_SIZE = 100
+PLATES_MAX_PAGE_SIZE = 1000
+NDJSON = "application/x-ndjson"
+SSE_HEARTBEAT_SECONDS = 15
+PLATE_BIDS_PAGE_SIZE = 100
+PLATE_BIDS_MAX_PAGE_SIZE = 1000
+# Names for plate_bid_history's columns in the detail response
+BID_DETAIL_FIELDS = ("id", "amount", "user", "username", "created_at")
+BID_EVENT_FIELDS = ("id", "kind", "user_id", "bid_id", "amount", "by_proxy", "created_at")
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(PLATE_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PLATE_FIELDS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+async def stream_plates(query, names: List[str]):
+    # Own session: the request-scoped one is closed before the body is sent
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=500))
+        async for row in result:
+            yield dumps(dict(zip(names, row))) + b"\n"
+
+async def cached_json(group: str, key: str, render) -> Response:
+    # `render` builds the response body; with the cache on, identical requests reuse it
+    # until a write to the plate (or any plate, for listings) invalidates the group
+    if response_cache.enabled:
+        cached, status = await response_cache.get_or_fill(group, key, render)
+    else:
+        cached, status = await render(), "MISS"
+    return Response(cached.body, media_type=JSON, headers={**cached.headers, "X-Cache": status})
 
 @router.get("/", response_model=List[AutoPlateResponse])
-def list_plates_endpoint(
-    ordering: Optional[str] = Query(None, description="Sort by 'deadline' (asc/desc)"),
+async def list_plates_endpoint(
+    request: Request,
+    ordering: Optional[str] = Query(None, description="Sort by 'deadline' or 'price' (prefix '-' for desc)"),
     plate_number__contains: Optional[str] = Query(None, description="Filter by plate number containing"),
-    db: Session = Depends(get_db),
+    plate_number__startswith: Optional[str] = Query(None, description="Filter by plate number prefix"),
+    plate_number__pattern: Optional[str] = Query(None, description="Vanity pattern, '?' matches any character"),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=PLATES_MAX_PAGE_SIZE, description="Page size"),
+    fields: Optional[str] = Query(None, description="Comma separated subset of fields to return"),
+    output: Optional[str] = Query(None, alias="format", description="'ndjson' streams every matching plate"),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    query = db.query(AutoPlate).filter(AutoPlate.is_active == True)
-
-    if plate_number__contains:
-        query = query.filter(AutoPlate.plate_number.contains(plate_number__contains))
-
-    if ordering == "deadline":
-        query = query.order_by(AutoPlate.deadline.asc())
-    elif ordering == "-deadline":
-        query = query.order_by(AutoPlate.deadline.desc())
-
-    plates = query.all()
-    response = []
-    for plate in plates:
-        response.append({
-            "id": plate.id,
-            "plate_number": plate.plate_number,
-            "description": plate.description,
-            "deadline": plate.deadline,
-            "is_active": plate.is_active,  
-            "created_by_id": plate.created_by_id,  
-        })
-    return response
+    if ordering not in PLATE_ORDERINGS:
+        ordering = "deadline"
+    sort_column, _ = PLATE_ORDERINGS[ordering]
+    names = parse_fields(fields)
+    columns = [getattr(AutoPlate, name) for name in names]
+    # Keyset columns ride along at the end of every row
+    columns += [sort_column.label("_sort"), AutoPlate.id.label("_id")]
+    after = decode_cursor(cursor, ordering, sort_column.type.python_type) if cursor else None
+
+    if output == "ndjson" or NDJSON in request.headers.get("accept", ""):
+        query = plate_list_query(
+            columns, plate_number__contains, ordering, after, limit,
+            plate_number__startswith, plate_number__pattern,
+        )
+        return StreamingResponse(stream_plates(query, names), media_type=NDJSON)
+
+    page_size = limit or PLATES_PAGE_SIZE
+
+    async def render() -> CachedResponse:
+        rows = await list_plates(
+            db, columns=columns, contains=plate_number__contains, ordering=ordering, after=after,
+            limit=page_size + 1, startswith=plate_number__startswith, pattern=plate_number__pattern,
+        )
+        headers = {}
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor(ordering, rows[-1]._sort, rows[-1]._id)
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+        return CachedResponse(dumps(rows_as_dicts(names, rows)), headers)
+
+    key = json.dumps([
+        str(request.base_url), ordering, plate_number__contains, plate_number__startswith,
+        plate_number__pattern, cursor, page_size, fields,
+    ])
+    return await cached_json(PLATE_LIST_GROUP, key, render)
 
 
 @router.post("/", response_model=AutoPlateResponse)
-def create_plate_endpoint(
+async def create_plate_endpoint(
     plate: AutoPlateCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not current_user.is_staff:
         raise HTTPException(status_code=403, detail="Only admins can create plates")
-    return create_plate(db, plate, current_user.id)
+    db_plate = await create_plate(db, plate, current_user.id)
+    scheduler.schedule(db_plate.id, db_plate.deadline)
+    return db_plate
+
+@router.post("/import")
+async def import_plates_endpoint(
+    request: Request,
+    output: Optional[str] = Query(None, alias="format", description="'csv' or 'ndjson', defaults to the Content-Type"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    if not current_user.is_staff:
+        raise HTTPException(status_code=403, detail="Only admins can import plates")
+    fmt = detect_format(output, request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="Send CSV or NDJSON")
+    records = iter_records(iter_lines(request.stream()), fmt)
+    return await import_plates(db, records, current_user.id)
+
+@router.get("/export")
+async def export_plates_endpoint(
+    output: str = Query("ndjson", alias="format", description="'csv' or 'ndjson'"),
+    current_user: Principal = Depends(get_current_user),
+):
+    if not current_user.is_staff:
+        raise HTTPException(status_code=403, detail="Only admins can export plates")
+    if output not in FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown format")
+    media_type = "text/csv" if output == "csv" else NDJSON
+    return StreamingResponse(
+        export_plates(output), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="plates.{output}"'},
+    )
+
+@router.post("/reload")
+async def reload_plates_endpoint(
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    # Picks up plates another process wrote, e.g. manage.py import-plates
+    if not current_user.is_staff:
+        raise HTTPException(status_code=403, detail="Only admins can reload plates")
+    await reload_plates(db)
+    return {"plates": len(plate_index)}
+
+def plate_etag(plate) -> str:
+    # Every bid write and plate edit changes one of the plate's own columns
+    digest = hashlib.sha1(repr(tuple(plate)).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 @router.get("/{plate_id}", response_model=AutoPlateDetailResponse)
-def get_plate_details(plate_id: int, db: Session = Depends(get_db)):
-    plate = get_plate(db, plate_id)
-    if not plate:
+async def get_plate_details(
+    plate_id: int,
+    request: Request,
+    since_bid_id: Optional[int] = Query(None, description="Only bids with a larger id"),
+    since: Optional[datetime] = Query(None, description="Only bids placed after this time"),
+    limit: int = Query(PLATE_BIDS_PAGE_SIZE, ge=1, le=PLATE_BIDS_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+):
+    plate = None
+    if not response_cache.enabled:
+        # Without the cache, answer a matching If-None-Match from the plate row alone
+        plate = await get_plate_detail_row(db, plate_id)
+        if not plate:
+            raise HTTPException(status_code=404, detail="Plate not found")
+        etag = plate_etag(plate)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    async def render() -> CachedResponse:
+        row = plate or await get_plate_detail_row(db, plate_id)
+        if not row:
+            raise HTTPException(status_code=404, detail="Plate not found")
+        bids, has_more = await plate_bid_history(db, plate_id, since_bid_id, since, limit)
+        bid_details = rows_as_dicts(BID_DETAIL_FIELDS, bids)
+        detail = {
+            "id": row.id,
+            "plate_number": row.plate_number,
+            "description": row.description,
+            "deadline": row.deadline,
+            "is_active": row.is_active,
+            "winner_id": row.winner_id,
+            "current_highest_amount": row.current_highest_amount,
+            "bid_count": row.bid_count,
+            "bids": bid_details,
+            "last_bid_id": bids[-1].id if bids else since_bid_id,
+            "has_more": has_more,
+        }
+        headers = {"ETag": plate_etag(row), "Cache-Control": "no-cache"}
+        return CachedResponse(dumps(detail), headers)
+
+    key = json.dumps([since_bid_id, since.isoformat() if since else None, limit])
+    result = await cached_json(plate_group(plate_id), key, render)
+    etag = result.headers["ETag"]
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={
+            "ETag": etag, "Cache-Control": "no-cache", "X-Cache": result.headers["X-Cache"],
+        })
+    return result
+
+async def plate_exists(plate_id: int) -> bool:
+    # Short-lived session: streams stay open far longer than a pooled connection should
+    async with AsyncReadSessionLocal() as db:
+        result = await db.execute(select(AutoPlate.id).where(AutoPlate.id == plate_id))
+        return result.first() is not None
+
+def dropped_notice(subscription, reported: int) -> Optional[str]:
+    if subscription.dropped == reported:
+        return None
+    return json.dumps({"type": "dropped", "count": subscription.dropped - reported})
+
+@router.get("/{plate_id}/events")
+async def plate_events_endpoint(
+    plate_id: int,
+    after_id: Optional[int] = Query(None, description="Last event id already seen"),
+    limit: int = Query(PLATE_BIDS_PAGE_SIZE, ge=1, le=PLATE_BIDS_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    # Audit trail of every placed, raised and withdrawn bid, oldest first
+    if not current_user.is_staff:
+        raise HTTPException(status_code=403, detail="Only admins can audit bids")
+    rows = await plate_events(db, plate_id, after_id, limit)
+    events = rows_as_dicts(BID_EVENT_FIELDS, rows)
+    for event in events:
+        event["kind"] = KIND_NAMES[event["kind"]]
+    return json_response(events)
+
+@router.websocket("/{plate_id}/stream")
+async def plate_stream_websocket(websocket: WebSocket, plate_id: int):
+    if not await plate_exists(plate_id):
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(plate_id)
+
+    async def watch_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            hub.unsubscribe(subscription)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    reported = 0
+    try:
+        while True:
+            message = await subscription.get()
+            if message is None:
+                break
+            notice = dropped_notice(subscription, reported)
+            if notice:
+                reported = subscription.dropped
+                await websocket.send_text(notice)
+            await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        watcher.cancel()
+
+@router.get("/{plate_id}/stream")
+async def plate_stream_events(plate_id: int, request: Request):
+    if not await plate_exists(plate_id):
         raise HTTPException(status_code=404, detail="Plate not found")
-    
-    bids = (
-        db.query(Bid)
-        .filter(Bid.plate_id == plate_id)
-        .order_by(Bid.created_at.asc())
-        .all()
+    subscription = hub.subscribe(plate_id)
+
+    async def events():
+        reported = 0
+        try:
+            while not subscription.closed:
+                message = await subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if await request.is_disconnected():
+                    break
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                notice = dropped_notice(subscription, reported)
+                if notice:
+                    reported = subscription.dropped
+                    yield f"event: dropped\ndata: {notice}\n\n"
+                yield f"data: {message}\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
     )
-    bid_details = [
-        {"amount": bid.amount, "user": bid.user_id, "created_at": bid.created_at}
-        for bid in bids
-    ]
-    return {
-        "id": plate.id,
-        "plate_number": plate.plate_number,
-        "description": plate.description,
-        "deadline": plate.deadline,
-        "is_active": plate.is_active,
-        "bids": bid_details,
-    }
 
 @router.put("/{plate_id}", response_model=AutoPlateResponse)
-def update_plate_endpoint(
+async def update_plate_endpoint(
     plate_id: int,
     plate: AutoPlateCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not current_user.is_staff:
         raise HTTPException(status_code=403, detail="Only admins can update plates")
-    return update_plate(db, plate_id, plate)
+    db_plate = await update_plate(db, plate_id, plate)
+    order_books.invalidate(plate_id)
+    if db_plate is not None and db_plate.is_active:
+        scheduler.schedule(plate_id, db_plate.deadline)
+    return db_plate
 
 @router.delete("/{plate_id}")
-def delete_plate_endpoint(
+async def delete_plate_endpoint(
     plate_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     if not current_user.is_staff:
         raise HTTPException(status_code=403, detail="Only admins can delete plates")
-    delete_plate(db, plate_id)
+    await delete_plate(db, plate_id)
+    order_books.invalidate(plate_id)
+    scheduler.cancel(plate_id)
     return {"message": "Plate deleted successfully"}
\ No newline at end of file
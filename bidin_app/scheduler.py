@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import AutoPlate
+from order_book import order_books
+from bid_feed import hub
+from response_cache import response_cache
+from cluster import cluster
+from analytics import analytics
+
+# Plates closed per UPDATE, and the pause between batches when many deadlines coincide
+CLOSE_BATCH_SIZE = int(os.getenv("CLOSE_BATCH_SIZE", "500"))
+CLOSE_BATCH_PAUSE = float(os.getenv("CLOSE_BATCH_PAUSE", "0.05"))
+# Upper bound on a single sleep so clock adjustments are noticed
+MAX_SLEEP_SECONDS = 60.0
+
+
+def local_naive(value: datetime) -> datetime:
+    # Deadlines are stored and compared as naive local time, like datetime.now()
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class AuctionScheduler:
+    def __init__(self, batch_size: int = CLOSE_BATCH_SIZE, batch_pause: float = CLOSE_BATCH_PAUSE,
+                 owns: Callable[[int], bool] = lambda plate_id: True):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        # With several workers only a plate's owner closes it
+        self.owns = owns
+        # Min-heap of (deadline, plate_id); superseded entries are skipped when popped
+        self._heap: List[Tuple[datetime, int]] = []
+        self._deadlines: Dict[int, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.closed = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    async def load(self, db: AsyncSession):
+        result = await db.execute(
+            select(AutoPlate.id, AutoPlate.deadline).where(AutoPlate.is_active == True)
+        )
+        self._deadlines = {
+            plate_id: local_naive(deadline) for plate_id, deadline in result.all()
+            if deadline and self.owns(plate_id)
+        }
+        self._heap = [(deadline, plate_id) for plate_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+        self._wake()
+
+    def schedule(self, plate_id: int, deadline: datetime):
+        if not self.owns(plate_id):
+            return
+        deadline = local_naive(deadline)
+        if self._deadlines.get(plate_id) == deadline:
+            return
+        earliest = self._heap[0][0] if self._heap else None
+        self._deadlines[plate_id] = deadline
+        heapq.heappush(self._heap, (deadline, plate_id))
+        if earliest is None or deadline < earliest:
+            self._wake()
+
+    def cancel(self, plate_id: int):
+        self._deadlines.pop(plate_id, None)
+
+    def next_deadline(self) -> Optional[datetime]:
+        while self._heap:
+            deadline, plate_id = self._heap[0]
+            if self._deadlines.get(plate_id) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime, limit: int) -> List[int]:
+        due = []
+        while len(due) < limit and self.next_deadline() is not None and self._heap[0][0] <= now:
+            _, plate_id = heapq.heappop(self._heap)
+            del self._deadlines[plate_id]
+            due.append(plate_id)
+        return due
+
+    async def close_plates(self, plate_ids: List[int]) -> List[Tuple[int, Optional[int]]]:
+        async with AsyncSessionLocal() as db:
+            # The deadline check keeps a plate whose deadline was just extended open
+            result = await db.execute(
+                update(AutoPlate)
+                .where(
+                    AutoPlate.id.in_(plate_ids),
+                    AutoPlate.is_active == True,
+                    AutoPlate.deadline <= datetime.now(),
+                )
+                .values(is_active=False, winner_id=AutoPlate.leading_user_id)
+                .returning(AutoPlate.id, AutoPlate.winner_id)
+                .execution_options(synchronize_session=False)
+            )
+            closed = result.all()
+            await db.commit()
+        if closed:
+            await response_cache.invalidate_plates([plate_id for plate_id, _ in closed])
+        for plate_id, winner_id in closed:
+            order_books.invalidate(plate_id)
+            analytics.set_price(plate_id, None)
+            hub.close_plate(plate_id, {"type": "closed", "plate_id": plate_id, "winner_id": winner_id})
+        self.closed += len(closed)
+        return closed
+
+    async def close_due(self, now: Optional[datetime] = None) -> int:
+        closed = 0
+        while True:
+            due = self.pop_due(now or datetime.now(), self.batch_size)
+            if not due:
+                return closed
+            try:
+                closed += len(await self.close_plates(due))
+            except Exception:
+                # Put them back so the next pass retries
+                for plate_id in due:
+                    self.schedule(plate_id, now or datetime.now())
+                raise
+            if len(due) == self.batch_size:
+                # Spread a burst of simultaneous deadlines instead of hammering the database
+                await asyncio.sleep(self.batch_pause)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            if deadline is None:
+                await self._wakeup.wait()
+                continue
+            delay = (deadline - datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(delay, MAX_SLEEP_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.close_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Keep the loop alive; close_due has re-queued the batch
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+
+
+scheduler = AuctionScheduler(owns=cluster.owns)
@@ -0,0 +1,55 @@
+# Brings an existing database up to models.py: creates missing tables and indexes and adds
+# missing columns. Only additive changes; it never drops or rewrites anything. Runs at
+# startup (serve.py runs it once before starting its workers) and as `manage.py migrate`.
+from typing import List
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from models import Base, AutoPlate
+
+# Plate columns rebuilt from the bids table when they were just added
+SUMMARY_COLUMNS = {"current_highest_amount", "bid_count", "leading_user_id", "last_bid_at"}
+
+
+def add_column_sql(connection: Connection, table, column) -> str:
+    dialect = connection.dialect
+    sql = f"ALTER TABLE {dialect.identifier_preparer.format_table(table)} ADD COLUMN " \
+          f"{dialect.identifier_preparer.format_column(column)} {column.type.compile(dialect)}"
+    if column.server_default is not None:
+        sql += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable:
+            sql += " NOT NULL"
+    return sql
+
+
+def upgrade(connection: Connection) -> List[str]:
+    # Returns "table.column" for every column added
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                connection.exec_driver_sql(add_column_sql(connection, table, column))
+                added.append(f"{table.name}.{column.name}")
+    # New tables, then the indexes on tables that already existed
+    Base.metadata.create_all(connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return added
+
+
+async def upgrade_database(engine: AsyncEngine) -> List[str]:
+    async with engine.begin() as connection:
+        added = await connection.run_sync(upgrade)
+    if any(name.split(".", 1)[1] in SUMMARY_COLUMNS for name in added
+           if name.startswith(AutoPlate.__tablename__ + ".")):
+        # Summary columns start at their defaults; fill them from the bids they summarise
+        from crud import reconcile_plate_summaries
+        async with AsyncSession(engine) as db:
+            await reconcile_plate_summaries(db)
+    return added
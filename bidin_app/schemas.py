@@ -38,6 +38,11 @@ class AutoPlateResponse(BaseModel):
     deadline: datetime
     is_active: bool
     created_by_id: int
+    current_highest_amount: float = 0
+    bid_count: int = 0
+    leading_user_id: Optional[int] = None
+    last_bid_at: Optional[datetime] = None
+    winner_id: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic v2
 
@@ -47,7 +52,13 @@ class AutoPlateDetailResponse(BaseModel):
     description: str
     deadline: datetime
     is_active: bool
+    winner_id: Optional[int] = None
+    current_highest_amount: float = 0
+    bid_count: int = 0
     bids: List[dict]
+    # Pass as since_bid_id on the next poll
+    last_bid_id: Optional[int] = None
+    has_more: bool = False
 
     model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic v2
 
@@ -62,4 +73,35 @@ class BidResponse(BaseModel):
     user_id: int
     created_at: datetime
 
-    model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic v2
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic v2
+
+class BidBatchCreate(BaseModel):
+    bids: List[BidCreate] = Field(..., min_length=1)
+
+class BidBatchItem(BaseModel):
+    index: int
+    plate_id: int
+    amount: float
+    status_code: int
+    detail: Optional[str] = None
+    bid: Optional[BidResponse] = None
+
+    model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic v2
+
+class BidBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[BidBatchItem]
+
+class ProxyBidCreate(BaseModel):
+    plate_id: int
+    max_amount: float = Field(..., gt=0)
+
+class ProxyBidResponse(BaseModel):
+    id: int
+    plate_id: int
+    user_id: int
+    max_amount: float
+    created_at: datetime
+    current_highest_amount: float
+    leading: bool
@@ -0,0 +1,48 @@
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Sequence
+from fastapi import Response
+from metrics import record_serialization
+
+try:
+    import orjson
+except ImportError:
+    # Optional: the standard library encoder produces the same bytes, just slower
+    orjson = None
+
+JSON = "application/json"
+
+
+def _default(value):
+    # Money columns are Numeric; every response schema declares them as float
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(value, default=_default)
+    else:
+        body = json.dumps(value, default=_default, separators=(",", ":")).encode()
+    record_serialization(time.perf_counter() - started)
+    return body
+
+
+def rows_as_dicts(names: Sequence[str], rows: Iterable[Sequence]) -> List[Dict]:
+    # Column tuples straight into JSON objects, without a model per row. zip stops at the
+    # last name, so trailing helper columns (keyset values) are left out.
+    started = time.perf_counter()
+    items = [dict(zip(names, row)) for row in rows]
+    record_serialization(time.perf_counter() - started)
+    return items
+
+
+def json_response(value: Any, headers: Dict[str, str] = None) -> Response:
+    # The data is already shaped like the response schema, so it skips FastAPI's revalidation
+    return Response(dumps(value), media_type=JSON, headers=headers)
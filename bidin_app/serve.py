@@ -0,0 +1,95 @@
+# Runs the app in several worker processes on one port, coordinated through cluster.py:
+#
+#   python serve.py --workers 4 --port 8000
+#
+# Each worker gets CLUSTER_WORKER_ID/CLUSTER_WORKERS, so every plate has one owner that
+# accepts its bids, and the workers see each other's bids and cache invalidations. With
+# CLUSTER=local (the default here) this process also runs the Unix socket broker; with
+# CLUSTER=redis they talk through Redis instead. A worker that dies is restarted with its id.
+#
+# Still per worker: the in-memory rate limiter (RATE_LIMIT=redis shares it) and the /metrics
+# counters (scrape each worker, or sum over the worker label).
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+os.environ.setdefault("CLUSTER", "local")
+
+from cluster import Broker, CLUSTER_SOCKET
+
+
+def run_worker(worker_id: int, workers: int, sock, log_level: str):
+    # cluster.py reads these at import, before the app is loaded
+    os.environ["CLUSTER_WORKER_ID"] = str(worker_id)
+    os.environ["CLUSTER_WORKERS"] = str(workers)
+    import uvicorn
+    uvicorn.Server(uvicorn.Config("main:app", log_level=log_level)).run(sockets=[sock])
+
+
+def start_broker(path: str):
+    ready = threading.Event()
+
+    async def serve():
+        broker = Broker(path)
+        await broker.start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    ready.wait(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve bidin_app with several coordinated workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Once, before any worker reads the database
+    from database import async_engine
+    from schema import upgrade_database
+
+    async def upgrade():
+        await upgrade_database(async_engine)
+        await async_engine.dispose()
+
+    asyncio.run(upgrade())
+
+    import uvicorn
+    # Bound once here and shared, so the kernel spreads connections over the workers
+    sock = uvicorn.Config("main:app", host=args.host, port=args.port).bind_socket()
+    if os.environ["CLUSTER"] == "local":
+        start_broker(CLUSTER_SOCKET)
+
+    context = multiprocessing.get_context("spawn")
+
+    def spawn(worker_id: int):
+        process = context.Process(target=run_worker, args=(worker_id, args.workers, sock, args.log_level))
+        process.start()
+        return process
+
+    processes = {worker_id: spawn(worker_id) for worker_id in range(args.workers)}
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    while not stopping.wait(1):
+        for worker_id, process in processes.items():
+            if not process.is_alive():
+                processes[worker_id] = spawn(worker_id)
+    for process in processes.values():
+        process.terminate()
+    deadline = time.monotonic() + 10
+    for process in processes.values():
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
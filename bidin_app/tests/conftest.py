@@ -0,0 +1,101 @@
+import sys
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A throwaway database for the whole run, never a file in the tree. Set before the app's
+# modules are imported, since database.py reads it at import.
+TEST_DATABASE_DIR = tempfile.mkdtemp(prefix="bidin-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DATABASE_DIR, 'test.db')}"
+os.environ.pop("DATABASE_READ_URL", None)
+
+from database import SQLALCHEMY_DATABASE_URL
+from models import Base, User, AutoPlate
+from dependencies import create_user_token, principal_cache, token_cache
+from order_book import order_books
+from plate_search import plate_index
+from response_cache import response_cache
+from rate_limit import rate_limiter
+from analytics import analytics
+from metrics import registry
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    engine.dispose()
+    shutil.rmtree(TEST_DATABASE_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    # Every in-process singleton starts empty, so no test sees what an earlier one left behind
+    for singleton in (order_books, principal_cache, token_cache, plate_index, response_cache,
+                      rate_limiter, analytics, registry):
+        singleton.clear()
+    yield
+
+
+def make_user(id: int, username: str, is_staff: bool = False) -> User:
+    return User(id=id, username=username, email=f"{username}@example.com", hashed_password="x",
+                is_staff=is_staff)
+
+
+def make_plate(id: int, plate_number: str, description: str = "", created_by_id: int = 1, **fields) -> AutoPlate:
+    fields.setdefault("deadline", datetime.now() + timedelta(days=1))
+    return AutoPlate(id=id, plate_number=plate_number, description=description,
+                     created_by_id=created_by_id, **fields)
+
+
+def seed(*rows: Iterable) -> Dict[int, dict]:
+    # Fresh tables holding the given rows (users first); returns auth headers per user id
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    for group in rows:
+        db.add_all(list(group))
+        db.flush()
+    db.commit()
+    users = [row for group in rows for row in group if isinstance(row, User)]
+    headers = {user.id: {"Authorization": f"Bearer {create_user_token(user)}"} for user in users}
+    db.close()
+    return headers
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@pytest.fixture
+def query_budget():
+    # with query_budget(3): ... fails the test when the block runs more than 3 SQL
+    # statements, on any engine (the app's async ones included), and lists them
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    @contextmanager
+    def budget(limit: int):
+        start = len(statements)
+        yield
+        used = statements[start:]
+        if len(used) > limit:
+            listing = "\n".join(f"  {statement}" for statement in used)
+            raise QueryBudgetExceeded(f"{len(used)} statements, budget {limit}:\n{listing}")
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield budget
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
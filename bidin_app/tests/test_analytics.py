@@ -0,0 +1,79 @@
+import sys
+import os
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from analytics import BidAnalytics, LEADERBOARD_SIZE
+from conftest import seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+HOUR = 3600
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "alice"), make_user(3, "bob")],
+        [make_plate(plate_id, f"STAT0{plate_id}", "Watched") for plate_id in (1, 2)],
+    ))
+
+
+def test_accepted_bids_feed_the_endpoints():
+    alice = client.post("/bids/", json={"plate_id": 1, "amount": 100}, headers=tokens[2]).json()
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 120}, headers=tokens[3]).status_code == 200
+    assert client.put(f"/bids/{alice['id']}", json={"plate_id": 1, "amount": 130}, headers=tokens[2]).status_code == 200
+    assert client.post("/bids/", json={"plate_id": 2, "amount": 500}, headers=tokens[2]).status_code == 200
+    # Rejected bids don't count
+    assert client.post("/bids/", json={"plate_id": 2, "amount": 400}, headers=tokens[3]).status_code == 400
+
+    hot = client.get("/analytics/hot", params={"window": 600}).json()
+    assert [(plate["plate_id"], plate["plate_number"], plate["bids"]) for plate in hot] == [(1, "STAT01", 3), (2, "STAT02", 1)]
+    top = client.get("/analytics/top-prices").json()
+    assert [(plate["plate_id"], plate["current_highest_amount"]) for plate in top] == [(2, 500), (1, 130)]
+
+    series = client.get("/analytics/plates/1/prices").json()
+    assert series["resolution"] == 60
+    point = series["points"][-1]
+    assert (point["high"], point["low"], point["close"]) == (130, 100, 130) and sum(p["bids"] for p in series["points"]) == 3
+    assert client.get("/analytics/plates/1/prices", params={"resolution": 90}).status_code == 400
+
+    # Withdrawing the top bid lowers the price, closing a plate drops it from the board
+    bid_id = client.get("/bids/", headers=tokens[2]).json()
+    bid_id = next(bid["id"] for bid in bid_id if bid["plate_id"] == 2)
+    assert client.delete(f"/bids/{bid_id}", headers=tokens[2]).status_code == 200
+    assert [plate["plate_id"] for plate in client.get("/analytics/top-prices").json()] == [1]
+
+
+def test_compaction_folds_old_minutes_and_bounds_memory():
+    stats = BidAnalytics(fine_seconds=2 * HOUR, retention_hours=24)
+    now = 100 * 24 * HOUR
+    for minute in range(48 * 60):
+        stats.record(7, 100 + minute, at=now - 48 * HOUR + minute * 60)
+    assert len(stats._series[7].fine) == 48 * 60
+    stats.compact(now)
+    series = stats._series[7]
+    # Two hours of minutes, the rest of the last day in hours, nothing older
+    assert len(series.fine) == 120 and len(series.coarse) == 22
+    assert stats.folded == 46 * 60
+
+    resolution, points = stats.price_series(7, 4 * HOUR)
+    assert resolution == 4 * HOUR and len(points) == 6
+    first = points[0]
+    assert first[1] == 100 + 24 * 60 and first[2] == first[4] == 100 + 28 * 60 - 1 and first[5] == 4 * 60
+    # Only the last five minutes are hot
+    assert stats.hot_plates(300, 10, now) == [(7, 5)]
+
+
+def test_leaderboard_refills_when_a_member_drops_out():
+    stats = BidAnalytics()
+    for plate_id in range(1, LEADERBOARD_SIZE + 11):
+        stats.set_price(plate_id, plate_id)
+    leader = LEADERBOARD_SIZE + 10
+    assert stats.top_prices(3) == [(leader, leader), (leader - 1, leader - 1), (leader - 2, leader - 2)]
+    stats.set_price(leader, None)
+    stats.set_price(leader - 1, 1)
+    board = stats.top_prices(LEADERBOARD_SIZE)
+    assert board[0] == (leader - 2, leader - 2) and len(board) == LEADERBOARD_SIZE
+    assert board[-1] == (9, 9)
@@ -0,0 +1,43 @@
+import sys
+import os
+import json
+import asyncio
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from bid_feed import BidFeedHub
+from conftest import seed, make_user, make_plate
+
+
+def test_slow_subscriber_keeps_only_latest_updates():
+    async def scenario():
+        hub = BidFeedHub(buffer_size=2)
+        fast, slow = hub.subscribe(1), hub.subscribe(1)
+        other = hub.subscribe(2)
+        for amount in (100, 110, 120):
+            hub.publish(1, {"amount": amount})
+            assert json.loads(await fast.get())["amount"] == amount
+        assert [json.loads(await slow.get())["amount"] for _ in range(2)] == [110, 120]
+        assert slow.dropped == 1
+        assert await other.get(timeout=0.01) is None
+
+        hub.unsubscribe(slow)
+        assert hub.subscriber_count(1) == 1
+        assert await slow.get() is None
+
+    asyncio.run(scenario())
+
+
+def test_websocket_receives_accepted_bids():
+    headers = seed([make_user(1, "bidder")], [make_plate(1, "LIVE01", "Live")])[1]
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/plates/1/stream") as websocket:
+            response = client.post("/bids/", json={"plate_id": 1, "amount": 250}, headers=headers)
+            assert response.status_code == 200
+            event = websocket.receive_json()
+            assert event["type"] == "bid"
+            assert event["bid_id"] == response.json()["id"]
+            assert event["highest_amount"] == 250
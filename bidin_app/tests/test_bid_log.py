@@ -0,0 +1,116 @@
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bid_log
+from database import ASYNC_DATABASE_URL
+from models import Bid
+from main import app
+from order_book import order_books
+from bid_log import LogState, checkpoint, load_state, recover
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "alice"), make_user(3, "bob")],
+        [make_plate(1, "LOG001", "Logged")],
+    ))
+
+
+def run(scenario):
+    # A separate engine: the app's pool belongs to the test client's event loop
+    async def wrapper():
+        async_engine = create_async_engine(ASYNC_DATABASE_URL)
+        try:
+            async with async_sessionmaker(async_engine, expire_on_commit=False)() as db:
+                return await scenario(db)
+        finally:
+            await async_engine.dispose()
+    return asyncio.run(wrapper())
+
+
+def bids_table():
+    db = TestingSessionLocal()
+    rows = db.execute(select(Bid.plate_id, Bid.user_id, Bid.amount, Bid.id)).all()
+    db.close()
+    return sorted(rows)
+
+
+def test_every_bid_write_is_logged():
+    alice = client.post("/bids/", json={"plate_id": 1, "amount": 100}, headers=tokens[2]).json()
+    assert client.put(f"/bids/{alice['id']}", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).status_code == 200
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 200}, headers=tokens[3]).status_code == 200
+    assert client.delete(f"/bids/{alice['id']}", headers=tokens[2]).status_code == 200
+
+    assert client.get("/plates/1/events", headers=tokens[2]).status_code == 403
+    events = client.get("/plates/1/events", headers=tokens[1]).json()
+    assert [(event["kind"], event["user_id"], event["amount"]) for event in events] == [
+        ("placed", 2, 100), ("raised", 2, 150), ("placed", 3, 200), ("withdrawn", 2, 150),
+    ]
+    assert [event["id"] for event in client.get("/plates/1/events", params={"after_id": events[1]["id"]},
+                                                headers=tokens[1]).json()] == [events[2]["id"], events[3]["id"]]
+
+    state = run(recover)
+    assert sorted(state.rows()) == bids_table()
+    assert state.top(1) == (3, Decimal("200"), events[2]["bid_id"])
+
+
+def test_recovery_replays_only_the_tail(monkeypatch):
+    monkeypatch.setattr(bid_log, "BID_LOG_SETTLE_SECONDS", -60)
+    for user_id, amount in ((2, 100), (3, 110)):
+        assert client.post("/bids/", json={"plate_id": 1, "amount": amount}, headers=tokens[user_id]).status_code == 200
+    assert run(lambda db: checkpoint(db, min_events=5)) is None
+    last_event_id = run(lambda db: checkpoint(db, min_events=1))
+    assert last_event_id == 2
+
+    bid_id = client.get("/bids/", headers=tokens[2]).json()[0]["id"]
+    assert client.put(f"/bids/{bid_id}", json={"plate_id": 1, "amount": 120}, headers=tokens[2]).status_code == 200
+    state, replayed = run(load_state)
+    assert replayed == 1 and state.last_event_id == 3
+    assert sorted(state.rows()) == bids_table()
+    assert LogState.loads(state.dumps()).plates == state.plates
+
+
+def test_bids_from_before_the_log_become_the_first_snapshot():
+    db = TestingSessionLocal()
+    db.add(Bid(plate_id=1, user_id=2, amount=90))
+    db.commit()
+    db.close()
+    state = run(recover)
+    assert sorted(state.rows()) == bids_table() and state.last_event_id == 0
+
+
+def test_deleted_plate_leaves_no_bids_for_a_new_plate_after_restart():
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 500}, headers=tokens[2]).status_code == 200
+    assert client.delete("/plates/1", headers=tokens[1]).status_code == 200
+    plate = client.post("/plates/", json={"plate_number": "LOG002", "description": "Reused id",
+                                          "deadline": (datetime.now() + timedelta(days=1)).isoformat()},
+                        headers=tokens[1]).json()
+    assert plate["id"] == 1
+    events = client.get("/plates/1/events", headers=tokens[1]).json()
+    assert [event["kind"] for event in events] == ["placed", "withdrawn"]
+
+    # What the lifespan does on restart
+    order_books.clear()
+    order_books.load(run(recover).rows())
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 20}, headers=tokens[3]).status_code == 200
+
+
+def test_recovery_drops_bids_of_missing_plates():
+    async def scenario(db):
+        await bid_log.append(db, [bid_log.bid_event(bid_log.PLACED, 99, 2, 1, 100)])
+        await db.commit()
+        return await recover(db)
+
+    assert list(run(scenario).rows()) == []
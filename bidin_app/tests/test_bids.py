@@ -0,0 +1,157 @@
+import sys
+import os
+import asyncio
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate, Bid
+from main import app
+from database import AsyncSessionLocal
+import crud
+from bidding import accept_bid, BidRejected
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(user_id, f"bidder{user_id}") for user_id in (1, 2, 3)],
+        [make_plate(1, "AAA111", "One"), make_plate(2, "BBB222", "Two")],
+    ))
+
+
+def plate_summary(plate_id):
+    db = TestingSessionLocal()
+    plate = db.get(AutoPlate, plate_id)
+    db.close()
+    return float(plate.current_highest_amount), plate.bid_count, plate.leading_user_id
+
+
+def test_summary_follows_place_update_and_delete():
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 100}, headers=tokens[1]).status_code == 200
+    second = client.post("/bids/", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).json()
+    assert plate_summary(1) == (150, 2, 2)
+
+    assert client.put("/bids/1", json={"plate_id": 1, "amount": 200}, headers=tokens[1]).status_code == 200
+    assert plate_summary(1) == (200, 2, 1)
+
+    assert client.delete("/bids/1", headers=tokens[1]).status_code == 200
+    assert plate_summary(1) == (150, 1, second["user_id"])
+
+    plates = client.get("/plates/", params={"ordering": "-price"}).json()
+    assert [(p["id"], p["current_highest_amount"], p["bid_count"]) for p in plates] == [(1, 150, 1), (2, 0, 0)]
+
+    bids = client.get("/bids/", headers=tokens[2]).json()
+    assert [(bid["plate_id"], bid["amount"], bid["user_id"]) for bid in bids] == [(1, 150.0, 2)]
+    assert set(bids[0]) == {"id", "amount", "plate_id", "user_id", "created_at"}
+
+
+def test_bid_on_a_deleted_plate_cannot_be_deleted():
+    bid = client.post("/bids/", json={"plate_id": 2, "amount": 100}, headers=tokens[1]).json()
+    db = TestingSessionLocal()
+    db.query(Bid).filter(Bid.id == bid["id"]).update({"plate_id": None})
+    db.commit()
+    db.close()
+    response = client.delete(f"/bids/{bid['id']}", headers=tokens[1])
+    assert response.status_code == 404 and response.json()["detail"] == "Plate not found"
+
+def test_reconcile_rebuilds_summaries_from_bids():
+    db = TestingSessionLocal()
+    db.add_all([
+        Bid(plate_id=2, user_id=1, amount=300),
+        Bid(plate_id=2, user_id=2, amount=250),
+    ])
+    db.commit()
+    db.close()
+    assert plate_summary(2) == (0, 0, None)
+
+    async def reconcile():
+        async with AsyncSessionLocal() as db:
+            return await crud.reconcile_plate_summaries(db)
+
+    assert asyncio.run(reconcile()) == 2
+    assert plate_summary(2) == (300, 2, 1)
+    assert plate_summary(1) == (0, 0, None)
+
+
+def test_concurrent_bids_are_accepted_in_increasing_order():
+    db = TestingSessionLocal()
+    db.add_all([make_user(i, f"racer{i}") for i in range(10, 50)])
+    db.commit()
+    db.close()
+    amounts = {user_id: 100 + (user_id * 37) % 41 for user_id in range(10, 50)}
+
+    async def place(user_id):
+        async with AsyncSessionLocal() as session:
+            try:
+                return await accept_bid(session, user_id, 1, amounts[user_id])
+            except BidRejected as exc:
+                return exc
+
+    async def race():
+        return await asyncio.gather(*(place(user_id) for user_id in amounts))
+
+    results = asyncio.run(race())
+    accepted = [r for r in results if isinstance(r, Bid)]
+    assert all(r.status_code == 400 for r in results if isinstance(r, BidRejected))
+
+    db = TestingSessionLocal()
+    rows = db.query(Bid).filter(Bid.plate_id == 1).order_by(Bid.id).all()
+    db.close()
+    # Nothing lost, and every accepted bid beat the one committed before it
+    assert sorted(b.id for b in rows) == sorted(b.id for b in accepted)
+    assert all(a.amount < b.amount for a, b in zip(rows, rows[1:]))
+    assert plate_summary(1) == (max(amounts.values()), len(rows), rows[-1].user_id)
+
+
+def test_plate_detail_since_cursor_and_etag():
+    for user_id, amount in ((1, 100), (2, 150), (3, 200)):
+        assert client.post("/bids/", json={"plate_id": 1, "amount": amount}, headers=tokens[user_id]).status_code == 200
+
+    response = client.get("/plates/1", params={"limit": 2})
+    body = response.json()
+    assert [float(b["amount"]) for b in body["bids"]] == [150, 200]
+    assert body["has_more"] and body["bid_count"] == 3
+    etag = response.headers["etag"]
+
+    unchanged = client.get("/plates/1", params={"since_bid_id": body["last_bid_id"]},
+                           headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304 and unchanged.content == b""
+
+    client.put("/bids/1", json={"plate_id": 1, "amount": 300}, headers=tokens[1])
+    changed = client.get("/plates/1", params={"since_bid_id": body["last_bid_id"]},
+                         headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["bids"] == [] and changed.json()["current_highest_amount"] == 300
+    assert client.get("/plates/1", params={"since_bid_id": 1}).json()["last_bid_id"] == 3
+
+
+def test_batch_bids_report_per_item_results():
+    assert client.post("/bids/", json={"plate_id": 2, "amount": 500}, headers=tokens[2]).status_code == 200
+    batch = [
+        {"plate_id": 1, "amount": 100},
+        {"plate_id": 2, "amount": 400},
+        {"plate_id": 1, "amount": 150},
+        {"plate_id": 999, "amount": 10},
+        {"plate_id": 1, "amount": 120},
+    ]
+    response = client.post("/bids/batch", json={"bids": batch}, headers=tokens[1])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["accepted"], body["rejected"]) == (1, 4)
+    assert [item["status_code"] for item in body["results"]] == [409, 400, 200, 404, 400]
+    assert body["results"][0]["bid"] is None
+    assert body["results"][2]["bid"]["amount"] == 150
+    assert plate_summary(1) == (150, 1, 1)
+
+    # A second batch raises the existing bid rather than adding one
+    again = client.post("/bids/batch", json={"bids": [{"plate_id": 1, "amount": 175},
+                                                      {"plate_id": 2, "amount": 600}]}, headers=tokens[1]).json()
+    assert again["accepted"] == 2
+    assert again["results"][0]["bid"]["id"] == body["results"][2]["bid"]["id"]
+    assert plate_summary(1) == (175, 1, 1)
+    assert plate_summary(2) == (600, 2, 1)
+    assert client.get("/plates/2").json()["bid_count"] == 2
@@ -0,0 +1,107 @@
+import sys
+import os
+import argparse
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate, Bid
+from main import app
+import manage
+from database import AsyncSessionLocal
+from plate_search import plate_index
+from scheduler import scheduler
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "bidder")],
+        [make_plate(1, "TAKEN1", "Existing")],
+        [Bid(id=1, plate_id=1, user_id=2, amount=120)],
+    ))
+
+
+def test_csv_import_reports_bad_rows_and_keeps_the_rest():
+    future = (datetime.now() + timedelta(days=3)).isoformat()
+    past = (datetime.now() - timedelta(days=3)).isoformat()
+    body = "\n".join([
+        "plate_number,description,deadline",
+        f'NEW001,"Two line\ndescription",{future}',
+        f"NEW002,Plain,{past}",
+        f"NEW001,Duplicate,{future}",
+        f"TAKEN1,Existing number,{future}",
+        f"NEW003,Too,many,{future}",
+        f"NEW004,Fine,{future}",
+    ])
+    response = client.post("/plates/import", content=body.encode(),
+                           headers={**tokens[1], "Content-Type": "text/csv"})
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["rows"], report["inserted"], report["failed"]) == (6, 2, 4)
+    assert [error["row"] for error in report["errors"]] == [2, 3, 4, 5]
+
+    db = TestingSessionLocal()
+    imported = {plate.plate_number: plate for plate in db.query(AutoPlate).filter(AutoPlate.id > 1)}
+    db.close()
+    assert set(imported) == {"NEW001", "NEW004"}
+    assert imported["NEW001"].description == "Two line\ndescription"
+    assert imported["NEW001"].created_by_id == 1 and imported["NEW001"].is_active
+
+
+def test_import_requires_staff():
+    response = client.post("/plates/import", content=b"{}",
+                           headers={**tokens[2], "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 403
+
+
+def test_export_includes_bids():
+    ndjson = client.get("/plates/export", headers=tokens[1])
+    assert ndjson.status_code == 200
+    plates = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert plates[0]["plate_number"] == "TAKEN1"
+    assert [(bid["user_id"], bid["amount"]) for bid in plates[0]["bids"]] == [(2, 120)]
+
+    rows = list(csv.DictReader(io.StringIO(client.get("/plates/export", params={"format": "csv"},
+                                                      headers=tokens[1]).text)))
+    assert [(row["plate_number"], row["bid_user_id"]) for row in rows] == [("TAKEN1", "2")]
+
+
+def test_cli_import_reaches_the_running_server(tmp_path, monkeypatch):
+    async def load_schedule():
+        async with AsyncSessionLocal() as db:
+            await scheduler.load(db)
+            await plate_index.warm_up(db)
+    # The server as after startup: index and schedule hold what the database had then
+    asyncio.run(load_schedule())
+
+    def urlopen(request, timeout):
+        # The reload goes to the test app instead of over the network
+        response = client.post(urlparse(request.full_url).path, headers=dict(request.header_items()))
+        assert response.status_code == 200
+        return io.BytesIO(response.content)
+    monkeypatch.setattr(manage, "urlopen", urlopen)
+
+    deadline = datetime.now() + timedelta(seconds=1)
+    path = tmp_path / "plates.csv"
+    path.write_text(f"plate_number,description,deadline\nCLI001,From the CLI,{deadline.isoformat()}\n")
+    args = argparse.Namespace(path=str(path), format=None, user_id=1, chunk_size=100, server="http://server")
+    asyncio.run(manage.import_plates(args))
+
+    plates = client.get("/plates/", params={"plate_number__contains": "CLI0"}).json()
+    assert [plate["plate_number"] for plate in plates] == ["CLI001"]
+    time.sleep(max(0, (deadline - datetime.now()).total_seconds()) + 0.05)
+    assert asyncio.run(scheduler.close_due()) == 1
+    db = TestingSessionLocal()
+    assert not db.query(AutoPlate).filter(AutoPlate.plate_number == "CLI001").one().is_active
+    db.close()
@@ -0,0 +1,153 @@
+import sys
+import os
+import asyncio
+import json
+import tempfile
+from collections import Counter
+from decimal import Decimal
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cluster import Broker, Cluster, ClusterError, HashRing, LocalBackend, cluster
+from order_book import order_books
+from bid_feed import hub
+from response_cache import response_cache, CachedResponse, plate_group
+from models import AutoPlate
+from schemas import BidCreate
+from database import AsyncSessionLocal
+import bidding
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+
+def test_hash_ring_spreads_plates_and_moves_few_when_growing():
+    four = HashRing(range(4))
+    owners = Counter(four.owner(plate_id) for plate_id in range(20000))
+    assert set(owners) == {0, 1, 2, 3}
+    assert max(owners.values()) < 1.3 * min(owners.values())
+    # Same answer in every process, and a fifth worker takes about a fifth of the plates
+    assert [HashRing(range(4)).owner(plate_id) for plate_id in range(100)] == [four.owner(plate_id) for plate_id in range(100)]
+    five = HashRing(range(5))
+    moved = sum(four.owner(plate_id) != five.owner(plate_id) for plate_id in range(20000))
+    assert moved < 20000 * 0.3
+    assert all(five.owner(plate_id) == 4 for plate_id in range(20000) if four.owner(plate_id) != five.owner(plate_id))
+
+
+def test_workers_broadcast_and_call_through_the_broker():
+    async def scenario():
+        path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), "cluster.sock")
+        broker = Broker(path)
+        await broker.start()
+        workers = [Cluster("local", worker_id, 2, LocalBackend(path)) for worker_id in range(2)]
+        received = [[], []]
+        for worker in workers:
+            worker.subscribe("note", received[worker.worker_id].append)
+
+        async def double(payload):
+            return {"value": payload["value"] * 2}
+        workers[1].serve("double", double)
+        for worker in workers:
+            await worker.start()
+        try:
+            workers[0].publish("note", {"n": 1})
+            assert await workers[0].call(1, "double", {"value": 21}) == {"value": 42}
+            with pytest.raises(ClusterError, match="no double service"):
+                await workers[1].call(0, "double", {"value": 1})
+            # Broadcasts skip the sender
+            assert received == [[], [{"n": 1}]]
+        finally:
+            for worker in workers:
+                await worker.stop()
+            await broker.stop()
+    asyncio.run(scenario())
+
+
+def test_broker_disconnects_a_worker_that_stops_reading():
+    async def scenario():
+        path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), "cluster.sock")
+        broker = Broker(path, drain_timeout=0.05)
+        await broker.start()
+        connections = []
+        for name in ("slow", "fast", "sender"):
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(f"{name}\n".encode())
+            connections.append((reader, writer))
+        fast_reader, sender = connections[1][0], connections[2][1]
+        try:
+            await asyncio.sleep(0.05)
+            # Far more than the socket buffers hold, and "slow" never reads
+            message = b"*\t" + b"x" * (1024 * 1024) + b"\n"
+            for _ in range(8):
+                sender.write(message)
+                await sender.drain()
+                assert len(await fast_reader.readexactly(len(message) - 2)) == len(message) - 2
+            assert broker.disconnected == 1
+            assert set(broker._workers) == {"fast", "sender"}
+        finally:
+            for _, writer in connections:
+                writer.close()
+            await broker.stop()
+    asyncio.run(scenario())
+
+def test_other_workers_bids_and_invalidations_reach_local_state():
+    order_books.clear()
+    order_books.load([])
+    response_cache.clear()
+
+    async def scenario():
+        subscription = hub.subscribe(7)
+        await response_cache.backend.set(plate_group(7), "detail", CachedResponse(b"{}"))
+        event = {"type": "bid", "plate_id": 7, "bid_id": 3, "user_id": 2, "amount": 150.5,
+                 "created_at": "2026-01-01T12:00:00", "highest_amount": 150.5}
+        message = json.dumps(event)
+        await cluster.dispatch({"t": "feed", "s": 1, "p": {"plate_id": 7, "message": message, "closing": False}})
+        await cluster.dispatch({"t": "invalidate", "s": 1, "p": [plate_group(7)]})
+        assert await subscription.get(timeout=1) == message
+        assert await response_cache.backend.get(plate_group(7), "detail") is None
+        hub.unsubscribe(subscription)
+        return await order_books.highest_amount(None, 7)
+    assert asyncio.run(scenario()) == Decimal("150.5")
+    order_books.clear()
+
+
+def test_batch_bids_are_applied_by_each_plates_owner(monkeypatch):
+    seed([make_user(1, "bidder")], [make_plate(plate_id, f"OWN{plate_id}") for plate_id in range(1, 7)])
+    ring = HashRing(range(2))
+    ours = [plate_id for plate_id in range(1, 7) if ring.owner(plate_id) == 0]
+    theirs = [plate_id for plate_id in range(1, 7) if ring.owner(plate_id) == 1]
+    assert ours and theirs
+
+    async def scenario():
+        path = os.path.join(tempfile.mkdtemp(prefix="bidin-"), "cluster.sock")
+        broker = Broker(path)
+        await broker.start()
+        workers = [Cluster("local", worker_id, 2, LocalBackend(path)) for worker_id in range(2)]
+        workers[1].serve("accept_bids", bidding._accept_forwarded_batch)
+        monkeypatch.setattr(bidding, "cluster", workers[0])
+        for worker in workers:
+            await worker.start()
+        try:
+            bids = [BidCreate(plate_id=plate_id, amount=100) for plate_id in ours + theirs]
+            # A later bid on a plate in the forwarded share supersedes the earlier one there too
+            bids.append(BidCreate(plate_id=theirs[0], amount=120))
+            async with AsyncSessionLocal() as db:
+                results = await bidding.accept_bids(db, 1, bids)
+            return results, workers[0].calls, workers[1].served
+        finally:
+            for worker in workers:
+                await worker.stop()
+            await broker.stop()
+    results, calls, served = asyncio.run(scenario())
+
+    # One call carries the other worker's share, and the answers keep the batch's order
+    assert (calls, served) == (1, 1)
+    assert [item.index for item in results] == list(range(len(ours) + len(theirs) + 1))
+    statuses = {item.index: item.status_code for item in results}
+    assert statuses.pop(len(ours)) == 409
+    assert set(statuses.values()) == {200}
+    assert results[-1].bid.plate_id == theirs[0] and results[-1].bid.amount == Decimal("120")
+    db = TestingSessionLocal()
+    assert {plate.id: float(plate.current_highest_amount) for plate in db.query(AutoPlate)} == {
+        plate_id: 120.0 if plate_id == theirs[0] else 100.0 for plate_id in range(1, 7)
+    }
+    db.close()
@@ -0,0 +1,33 @@
+import sys
+import os
+from sqlalchemy import text
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseSettings, build_engine, engine_options
+
+
+def test_settings_from_env_and_pool_options(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://bidin@db/bidin")
+    monkeypatch.setenv("DATABASE_READ_URL", "postgresql://bidin@replica/bidin")
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("SQLITE_JOURNAL_MODE", "DELETE")
+    settings = DatabaseSettings.from_env()
+    assert settings.read_url == "postgresql://bidin@replica/bidin"
+    assert settings.journal_mode == "DELETE" and settings.synchronous == "NORMAL"
+
+    options = engine_options(settings, settings.url)
+    assert options["pool_size"] == 20 and options["max_overflow"] == 10 and options["pool_pre_ping"]
+    assert engine_options(settings, "sqlite:///./x.db")["pool_pre_ping"] is False
+    assert "pool_size" not in engine_options(settings, "sqlite:///:memory:")
+
+
+def test_sqlite_pragmas_applied_on_connect(tmp_path):
+    settings = DatabaseSettings(url=f"sqlite:///{tmp_path / 'pragmas.db'}", busy_timeout_ms=1234)
+    engine = build_engine(settings)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+        # NORMAL
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+    engine.dispose()
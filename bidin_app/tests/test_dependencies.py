@@ -0,0 +1,65 @@
+import sys
+import os
+import asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ASYNC_DATABASE_URL
+from models import User
+from cache import TTLCache
+from dependencies import create_user_token, get_current_user
+from conftest import seed
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+statements = []
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _record(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def setup_function(function):
+    seed()
+    statements.clear()
+
+
+def test_ttl_cache_expiry_and_lru_eviction():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.evictions == 1
+    now[0] = 11
+    assert cache.get("a") is None
+
+
+def test_cached_principal_needs_no_queries_and_is_invalidated_on_update():
+    async def scenario():
+        async with AsyncTestingSessionLocal() as db:
+            user = User(username="alice", email="alice@example.com", hashed_password="x", is_staff=False)
+            db.add(user)
+            await db.commit()
+            token = create_user_token(user)
+
+            principal = await get_current_user(token, db)
+            assert principal.id == user.id and not principal.is_staff
+
+            statements.clear()
+            assert await get_current_user(token, db) == principal
+            assert statements == []
+
+            user.is_staff = True
+            await db.commit()
+            assert (await get_current_user(token, db)).is_staff
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import sys
+import os
+import asyncio
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashing
+from main import app
+from hashing import PasswordHasher, HasherBusy, password_context
+from conftest import seed
+
+
+def test_hash_and_verify_in_process_pool():
+    async def scenario():
+        hasher = PasswordHasher(workers=2, queue_limit=4, rounds=4)
+        try:
+            hashed = await hasher.hash("secret")
+            assert await hasher.verify_and_update("secret", hashed) == (True, None)
+            assert (await hasher.verify_and_update("wrong", hashed))[0] is False
+            assert hasher.metrics()["completed"] == 3
+        finally:
+            hasher.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_rehash_when_cost_changes():
+    async def scenario():
+        hasher = PasswordHasher(workers=0, rounds=5)
+        try:
+            old_hash = password_context(4).hash("secret")
+            valid, new_hash = await hasher.verify_and_update("secret", old_hash)
+            assert valid
+            assert new_hash is not None and new_hash.startswith("$2b$05$")
+        finally:
+            hasher.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_rejects_with_429_when_saturated():
+    async def scenario():
+        hasher = PasswordHasher(workers=0, queue_limit=1, rounds=4)
+        try:
+            results = await asyncio.gather(
+                *(hasher.hash("secret") for _ in range(4)), return_exceptions=True
+            )
+        finally:
+            hasher.shutdown()
+        rejected = [r for r in results if isinstance(r, HasherBusy)]
+        assert len(rejected) == 2
+        assert rejected[0].retry_after == 1
+        assert hasher.metrics()["rejected"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_saturated_hasher_answers_429(monkeypatch):
+    seed()
+    monkeypatch.setattr(hashing.hasher, "in_flight", hashing.hasher.capacity)
+    response = TestClient(app).post("/auth/register", data={"username": "busy", "email": "busy@example.com",
+                                                            "password": "secret"})
+    assert response.status_code == 429 and response.headers["Retry-After"] == "1"
@@ -0,0 +1,66 @@
+import sys
+import os
+import logging
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+import metrics
+from metrics import bids, http_latency, http_queries, http_requests, Histogram
+from conftest import seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "bidder")],
+        [make_plate(1, "MET001", "Metered")],
+    ))
+
+
+def test_requests_and_bids_are_counted():
+    assert client.get("/plates/1").status_code == 200
+    assert client.get("/plates/1").status_code == 200
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).status_code == 200
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 100}, headers=tokens[1]).status_code == 400
+
+    # One series per route template, not per plate id
+    assert http_requests.get("GET", "/plates/{plate_id}", "200") == 2
+    assert http_latency.count("GET", "/plates/{plate_id}") == 2
+    # The second detail read is a cache hit and never reaches the database
+    entry = http_queries.values[("GET", "/plates/{plate_id}")]
+    assert entry[0] == 1 and sum(entry[1:-1]) == 1
+    assert bids.get("single", "accepted", "200") == 1
+    assert bids.get("single", "rejected", "400") == 1
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert '# TYPE bidin_http_request_duration_seconds histogram' in text
+    assert 'bidin_http_request_duration_seconds_count{method="GET",route="/plates/{plate_id}"} 2' in text
+    assert 'bidin_bids_total{source="single",outcome="rejected",status="400"} 1' in text
+    assert 'bidin_response_cache_hits_total{backend="memory"} 1' in text
+    assert 'bidin_password_hash_seconds_bucket{le="+Inf"}' in text
+    assert 'bidin_password_hash_queue_depth 0' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("h", "help", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "/x")
+    lines = histogram.render()
+    assert 'h_bucket{route="/x",le="0.1"} 2' in lines
+    assert 'h_bucket{route="/x",le="1.0"} 3' in lines
+    assert 'h_bucket{route="/x",le="+Inf"} 4' in lines
+    assert 'h_count{route="/x"} 4' in lines
+
+
+def test_slow_requests_log_their_sql(caplog, monkeypatch):
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_MS", 0.001)
+    with caplog.at_level(logging.WARNING, logger="bidin.slow_requests"):
+        assert client.get("/plates/1").status_code == 200
+    assert "slow request GET /plates/1 -> 200" in caplog.text
+    assert "FROM auto_plates" in caplog.text
@@ -0,0 +1,79 @@
+import sys
+import os
+import asyncio
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ASYNC_DATABASE_URL
+from models import User, Bid
+from order_book import PlateOrderBook, OrderBookRegistry
+from conftest import seed, make_plate
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def setup_function(function):
+    seed(
+        [User(id=i, username=f"user{i}", email=f"user{i}@example.com") for i in (1, 2, 3)],
+        [make_plate(1, "ABC123", "Test", created_by_id=None)],
+        [Bid(id=1, plate_id=1, user_id=1, amount=100), Bid(id=2, plate_id=1, user_id=2, amount=150)],
+    )
+
+
+def test_plate_order_book_ranking():
+    book = PlateOrderBook(1)
+    book.add(1, 100, 1)
+    book.add(2, 150, 2)
+    book.add(3, 150, 3)
+    assert book.highest_amount() == 150
+    assert book.leader() == 2
+    assert book.ranked_bidders() == [(2, 150), (3, 150), (1, 100)]
+
+    book.add(1, 200, 1)
+    assert book.leader() == 1
+    book.remove(1)
+    assert book.ranked_bidders() == [(2, 150), (3, 150)]
+
+
+def test_registry_warm_up_and_record():
+    async def scenario():
+        registry = OrderBookRegistry()
+        async with AsyncTestingSessionLocal() as db:
+            await registry.warm_up(db)
+            assert await registry.highest_amount(db, 1) == 150
+            # Warm registries answer for plates without bids without going to the database
+            assert await registry.highest_amount(db, 99) is None
+            # and keep no book for them, so made-up plate ids can't grow it
+            for plate_id in range(100, 200):
+                await registry.highest_amount(db, plate_id)
+            assert list(registry._books) == [1]
+
+            bid = Bid(plate_id=1, user_id=3, amount=175)
+            db.add(bid)
+            await db.commit()
+            registry.record(bid)
+            assert await registry.highest_amount(db, 1) == 175
+
+            registry.remove(1, 3)
+            assert await registry.highest_amount(db, 1) == 150
+
+    asyncio.run(scenario())
+
+
+def test_registry_invalidate_reloads_from_database():
+    async def scenario():
+        registry = OrderBookRegistry()
+        async with AsyncTestingSessionLocal() as db:
+            assert await registry.highest_amount(db, 1) == 150
+
+            await db.execute(delete(Bid).where(Bid.id == 2))
+            await db.commit()
+            assert await registry.highest_amount(db, 1) == 150
+            registry.invalidate(1)
+            assert await registry.highest_amount(db, 1) == 100
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import sys
+import os
+import json
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate
+from main import app
+from plate_search import plate_index, PlateSearchIndex
+from response_cache import response_cache
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+
+
+def setup_module(module):
+    deadline = datetime.now() + timedelta(days=1)
+    # Pairs of plates share a deadline so the id tie-breaker is exercised
+    seed(
+        [make_user(1, "admin", is_staff=True)],
+        [make_plate(i, f"AA{i:03d}", f"Plate {i}", deadline=deadline + timedelta(hours=i // 2))
+         for i in range(1, 8)]
+        + [make_plate(8, "ZZ999", "Closed", deadline=deadline, is_active=False)],
+    )
+
+
+def collect_pages(params):
+    ids, cursor = [], None
+    while True:
+        response = client.get("/plates/", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        ids += [plate["id"] for plate in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids
+
+
+def test_keyset_pages_cover_every_active_plate_once():
+    assert collect_pages({"limit": 3}) == [1, 2, 3, 4, 5, 6, 7]
+    assert collect_pages({"limit": 2, "ordering": "-deadline"}) == [7, 6, 5, 4, 3, 2, 1]
+
+
+def test_fields_projection():
+    response = client.get("/plates/", params={"fields": "id,plate_number", "limit": 2})
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "plate_number": "AA001"}, {"id": 2, "plate_number": "AA002"}]
+    assert client.get("/plates/", params={"fields": "id,hashed_password"}).status_code == 400
+
+
+def test_ndjson_stream():
+    response = client.get("/plates/", params={"format": "ndjson", "fields": "id,deadline"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [1, 2, 3, 4, 5, 6, 7]
+    assert set(rows[0]) == {"id", "deadline"}
+
+
+def test_invalid_cursor():
+    assert client.get("/plates/", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_index_and_sql_search_agree():
+    searches = [
+        {"plate_number__contains": "a00"},
+        {"plate_number__contains": "7"},
+        {"plate_number__startswith": "aa00"},
+        {"plate_number__startswith": "7A"},
+        {"plate_number__pattern": "7?7?7"},
+        {"plate_number__pattern": "7?7"},
+        {"plate_number__pattern": "A?C", "plate_number__contains": "B7"},
+        # LIKE wildcards are plain characters in contains and startswith
+        {"plate_number__contains": "%"},
+        {"plate_number__contains": "7_7"},
+        {"plate_number__startswith": "_"},
+        # So is the index's start-of-plate marker
+        {"plate_number__contains": "^AA"},
+        {"plate_number__startswith": "AA"},
+        {"plate_number__startswith": "^AA"},
+    ]
+    db = TestingSessionLocal()
+    deadline = datetime.now() + timedelta(days=2)
+    db.add_all([
+        AutoPlate(id=10 + i, plate_number=number, description="Vanity", deadline=deadline, created_by_id=1)
+        for i, number in enumerate(["777AB", "7A7B7", "X7Y7Z7", "B7A7C", "Q^AA0"])
+    ])
+    db.commit()
+    try:
+        plate_index.clear()
+        response_cache.clear()
+        sql = [collect_pages(search) for search in searches]
+        plate_index.load(db.query(AutoPlate.id, AutoPlate.plate_number).all())
+        response_cache.clear()
+        assert plate_index.search(pattern="7?7?7") == {11, 12}
+        assert [collect_pages(search) for search in searches] == sql
+    finally:
+        plate_index.clear()
+        response_cache.clear()
+        db.query(AutoPlate).filter(AutoPlate.id >= 10).delete()
+        db.commit()
+        db.close()
+    assert sql[4] == [11, 12] and sql[6] == [13]
+
+
+def test_index_tracks_edits():
+    index = PlateSearchIndex()
+    index.load([(1, "ABC123"), (2, "XYZ123")])
+    assert index.search(contains="c12") == {1}
+    index.add(1, "QQQ999")
+    assert index.search(contains="c12") == set()
+    assert index.search(startswith="QQQ") == {1}
+    index.remove(2)
+    assert index.search(contains="123") == set()
+    # Too short to use the index
+    assert index.search(contains="9") is None
@@ -0,0 +1,75 @@
+import sys
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate, Bid
+from main import app
+from proxy_bidding import Proxy, resolve, increment_for
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+T0 = datetime(2030, 1, 1)
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(user_id, f"bidder{user_id}") for user_id in (1, 2, 3)],
+        [make_plate(1, "PROXY1", "Proxy")],
+    ))
+
+
+def proxy(user_id, max_amount, minutes=0):
+    return Proxy(user_id, Decimal(max_amount), T0 + timedelta(minutes=minutes), user_id)
+
+
+def test_resolve_prices_at_one_increment_over_the_runner_up():
+    assert increment_for(Decimal("99")) == 1 and increment_for(Decimal("100")) == 5
+    # Alone on the plate: opens at the minimum
+    assert resolve(Decimal(0), None, [proxy(1, 500)]).price == 1
+    # Against a direct leader at 120 (increment 5)
+    assert resolve(Decimal(120), 3, [proxy(1, 500)]).price == 125
+    # Against another proxy: runner-up shown at its maximum
+    result = resolve(Decimal(0), None, [proxy(1, 300), proxy(2, 500)])
+    assert (result.leader_id, result.price, result.runner_up_id, result.runner_up_amount) == (2, 305, 1, 300)
+    # Capped at the winner's maximum
+    assert resolve(Decimal(0), None, [proxy(1, 300), proxy(2, 302)]).price == 302
+    # Equal maximums: the earlier one leads at that price
+    result = resolve(Decimal(0), None, [proxy(2, 300, minutes=5), proxy(1, 300)])
+    assert (result.leader_id, result.price, result.runner_up_id) == (1, 300, None)
+    # Nothing to do when the leader's proxy is unchallenged or every proxy is beaten
+    assert resolve(Decimal(10), 1, [proxy(1, 300)]) is None
+    assert resolve(Decimal(400), 3, [proxy(1, 300)]) is None
+
+
+def plate_state():
+    db = TestingSessionLocal()
+    plate = db.get(AutoPlate, 1)
+    bids = {bid.user_id: float(bid.amount) for bid in db.query(Bid).filter(Bid.plate_id == 1)}
+    db.close()
+    return float(plate.current_highest_amount), plate.leading_user_id, plate.bid_count, bids
+
+
+def test_proxies_answer_registrations_and_direct_bids():
+    response = client.post("/bids/proxy", json={"plate_id": 1, "max_amount": 300}, headers=tokens[1])
+    assert response.status_code == 200 and response.json()["leading"]
+    assert plate_state() == (1, 1, 1, {1: 1})
+
+    second = client.post("/bids/proxy", json={"plate_id": 1, "max_amount": 200}, headers=tokens[2]).json()
+    assert not second["leading"] and second["current_highest_amount"] == 205
+    assert plate_state() == (205, 1, 2, {1: 205, 2: 200})
+
+    # A direct bid below the maximum is accepted and immediately answered
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 250}, headers=tokens[3]).status_code == 200
+    assert plate_state() == (255, 1, 3, {1: 255, 2: 200, 3: 250})
+    # Matching the earlier maximum exactly loses the tie
+    assert client.put("/bids/3", json={"plate_id": 1, "amount": 300}, headers=tokens[3]).status_code == 400
+    assert client.put("/bids/3", json={"plate_id": 1, "amount": 310}, headers=tokens[3]).status_code == 200
+    assert plate_state()[:2] == (310, 3)
+
+    lowered = client.post("/bids/proxy", json={"plate_id": 1, "max_amount": 250}, headers=tokens[1])
+    assert lowered.status_code == 400
@@ -0,0 +1,74 @@
+import sys
+import os
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import selectinload
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate, Bid
+from main import app
+from database import AsyncSessionLocal
+from conftest import TestingSessionLocal, seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+BIDDERS = 30
+
+
+def setup_function(function):
+    bidder_ids = range(2, BIDDERS + 2)
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True)] + [make_user(i, f"bidder{i}") for i in bidder_ids],
+        [make_plate(1, "NPLUS1", "Busy"), make_plate(2, "QUIET2", "Quiet")],
+        [Bid(plate_id=1, user_id=i, amount=100 + i) for i in bidder_ids],
+    ))
+    # Authenticate everyone once, so the budgets below don't include the principal lookup
+    for headers in tokens.values():
+        client.get("/bids/", headers=headers)
+
+
+def test_plate_detail_names_every_bidder_in_fixed_queries(query_budget):
+    with query_budget(2):
+        body = client.get("/plates/1", params={"limit": BIDDERS}).json()
+    assert len(body["bids"]) == BIDDERS
+    assert all(bid["username"] == f"bidder{bid['user']}" for bid in body["bids"])
+    # Served from the response cache until the next write
+    with query_budget(0):
+        assert client.get("/plates/1", params={"limit": BIDDERS}).status_code == 200
+
+
+def test_endpoint_budgets(query_budget):
+    with query_budget(1):
+        assert client.get("/plates/", params={"ordering": "-price"}).status_code == 200
+    with query_budget(1):
+        assert client.get("/bids/", headers=tokens[2]).status_code == 200
+    with query_budget(6):
+        assert client.post("/bids/", json={"plate_id": 2, "amount": 50}, headers=tokens[2]).status_code == 200
+    with query_budget(1):
+        assert client.get("/analytics/top-prices").status_code == 200
+    # Deleting a plate withdraws and detaches its bids in fixed statements, however many there are
+    with query_budget(5):
+        assert client.delete("/plates/1", headers=tokens[1]).status_code == 200
+    db = TestingSessionLocal()
+    assert db.query(Bid).filter(Bid.plate_id.is_(None)).count() == BIDDERS
+    db.close()
+
+
+def test_relationships_load_only_when_asked(query_budget):
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            bid = await db.get(Bid, 1)
+            with pytest.raises(InvalidRequestError):
+                bid.user
+            with query_budget(2):
+                plate = (await db.execute(
+                    select(AutoPlate).where(AutoPlate.id == 1)
+                    .options(selectinload(AutoPlate.bids).joinedload(Bid.user))
+                )).scalar_one()
+            return [bid.user.username for bid in plate.bids]
+
+    assert len(asyncio.run(scenario())) == BIDDERS
@@ -0,0 +1,87 @@
+import sys
+import os
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+from main import app
+from dependencies import principal_cache
+from rate_limit import rate_limiter, MemoryBackend, Rate
+from metrics import db_queries
+from conftest import seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "bidder")],
+        [make_plate(1, "RLT001", "Throttled")],
+    ))
+
+
+def test_token_bucket_refills_and_evicts_idle_buckets():
+    now = [0.0]
+    backend = MemoryBackend(maxsize=2, shards=1, timer=lambda: now[0])
+    rate = Rate.parse("2/10")
+    assert backend.take_now("a", rate) == 0 and backend.take_now("a", rate) == 0
+    # Empty: the next token arrives in 5 seconds
+    assert backend.take_now("a", rate) == 5.0
+    now[0] = 5.0
+    assert backend.take_now("a", rate) == 0
+
+    backend.take_now("b", rate)
+    backend.take_now("a", rate)
+    backend.take_now("c", rate)
+    # "b" was the idle one
+    assert len(backend) == 2 and backend.evictions == 1
+    assert Rate.parse("off") is None
+
+
+def test_throttled_bids_get_429_before_any_query(monkeypatch):
+    monkeypatch.setattr(rate_limit, "bid_user_rate", Rate.parse("2/60"))
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).status_code == 200
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 160}, headers=tokens[2]).status_code == 400
+
+    before = db_queries.get()
+    response = client.post("/bids/", json={"plate_id": 1, "amount": 170}, headers=tokens[2])
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) == 30
+    assert db_queries.get() == before
+    # Other users have their own bucket
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 170}, headers=tokens[1]).status_code == 200
+    assert rate_limiter.metrics()["limited"] == {"bid_user": 1}
+
+
+def test_throttled_plate_is_shed_before_authentication(monkeypatch):
+    monkeypatch.setattr(rate_limit, "bid_plate_rate", Rate.parse("1/60"))
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).status_code == 200
+    # A user the principal cache hasn't seen: authenticating would take a query
+    principal_cache.clear()
+    before = db_queries.get()
+    response = client.post("/bids/", json={"plate_id": 1, "amount": 170}, headers=tokens[1])
+    assert response.status_code == 429 and db_queries.get() == before
+    assert rate_limiter.metrics()["limited"] == {"bid_plate": 1}
+
+
+def test_repeated_bids_in_a_batch_do_not_starve_other_bidders(monkeypatch):
+    monkeypatch.setattr(rate_limit, "bid_plate_rate", Rate.parse("3/60"))
+    batch = {"bids": [{"plate_id": 1, "amount": amount} for amount in (100, 110, 120)]}
+    assert client.post("/bids/batch", json=batch, headers=tokens[2]).status_code == 200
+    # The batch took one of the plate's three tokens, not three
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 130}, headers=tokens[1]).status_code == 200
+    bid_id = client.get("/bids/", headers=tokens[1]).json()[0]["id"]
+    assert client.put(f"/bids/{bid_id}", json={"plate_id": 1, "amount": 140}, headers=tokens[1]).status_code == 200
+    assert client.put(f"/bids/{bid_id}", json={"plate_id": 1, "amount": 150}, headers=tokens[1]).status_code == 429
+
+
+def test_login_is_throttled_per_username_and_address(monkeypatch):
+    monkeypatch.setattr(rate_limit, "login_username_rate", Rate.parse("1/60"))
+    form = {"username": "nobody", "password": "wrong"}
+    assert client.post("/auth/login", data=form).status_code == 400
+    assert client.post("/auth/login", data=form).status_code == 429
+    assert client.post("/auth/login", data={**form, "username": "NOBODY"}).status_code == 429
+    # The account itself isn't locked for everyone else
+    elsewhere = TestClient(app, client=("203.0.113.7", 50000))
+    assert elsewhere.post("/auth/login", data=form).status_code == 400
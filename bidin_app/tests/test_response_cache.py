@@ -0,0 +1,70 @@
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from response_cache import response_cache, ResponseCache, MemoryBackend, CachedResponse
+from conftest import seed, make_user, make_plate
+
+client = TestClient(app)
+tokens = {}
+
+
+def setup_function(function):
+    tokens.update(seed(
+        [make_user(1, "admin", is_staff=True), make_user(2, "bidder")],
+        [make_plate(1, "CCH001", "Cached")],
+    ))
+
+
+def test_writes_invalidate_cached_pages():
+    assert client.get("/plates/").headers["X-Cache"] == "MISS"
+    assert client.get("/plates/", params={"ordering": "price"}).headers["X-Cache"] == "MISS"
+    assert client.get("/plates/").headers["X-Cache"] == "HIT"
+    detail = client.get("/plates/1")
+    assert detail.headers["X-Cache"] == "MISS"
+    cached = client.get("/plates/1", headers={"If-None-Match": detail.headers["ETag"]})
+    assert cached.status_code == 304 and cached.headers["X-Cache"] == "HIT"
+
+    assert client.post("/bids/", json={"plate_id": 1, "amount": 150}, headers=tokens[2]).status_code == 200
+    listing = client.get("/plates/")
+    assert listing.headers["X-Cache"] == "MISS" and listing.json()[0]["current_highest_amount"] == 150
+    detail = client.get("/plates/1")
+    assert detail.headers["X-Cache"] == "MISS" and detail.json()["bid_count"] == 1
+
+    plate = {"plate_number": "CCH002", "description": "New", "deadline": (datetime.now() + timedelta(days=2)).isoformat()}
+    assert client.post("/plates/", json=plate, headers=tokens[1]).status_code == 200
+    assert [row["plate_number"] for row in client.get("/plates/").json()] == ["CCH001", "CCH002"]
+    # A missing plate is not cached
+    assert client.get("/plates/99").status_code == 404
+    assert response_cache.metrics()["hits"] == 2
+
+
+def test_concurrent_misses_share_one_fill():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend(maxsize=10, ttl=60))
+        calls = []
+
+        async def fill():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return CachedResponse(b"[]")
+
+        results = await asyncio.gather(*(cache.get_or_fill("plates", "key", fill) for _ in range(10)))
+        assert len(calls) == 1
+        assert sorted(status for _, status in results) == ["HIT"] * 9 + ["MISS"]
+        assert cache.metrics()["coalesced"] == 9
+
+        # A write landing while a fill runs keeps the (possibly older) result out of the cache
+        async def racing_fill():
+            await cache.invalidate(["plate:1"])
+            return CachedResponse(b"{}")
+
+        await cache.get_or_fill("plate:1", "key", racing_fill)
+        assert (await cache.get_or_fill("plate:1", "key", racing_fill))[1] == "MISS"
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import sys
+import os
+import asyncio
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AutoPlate, Bid
+from database import AsyncSessionLocal
+from scheduler import AuctionScheduler
+from bid_feed import hub
+from conftest import TestingSessionLocal, seed, make_user
+
+
+def setup_function(function):
+    seed([make_user(user_id, f"user{user_id}") for user_id in (1, 2)])
+
+
+def plate_states():
+    db = TestingSessionLocal()
+    states = {plate.id: (plate.is_active, plate.winner_id) for plate in db.query(AutoPlate)}
+    db.close()
+    return states
+
+
+def test_due_plates_close_in_batches_and_record_winner():
+    past = datetime.now() - timedelta(seconds=1)
+    db = TestingSessionLocal()
+    db.add_all([AutoPlate(id=i, plate_number=f"DUE{i:03}", description="due", deadline=past,
+                          created_by_id=1) for i in range(1, 8)])
+    db.add(AutoPlate(id=8, plate_number="LATER", description="later",
+                     deadline=datetime.now() + timedelta(days=1), created_by_id=1))
+    db.add(Bid(plate_id=1, user_id=2, amount=500))
+    db.commit()
+    db.query(AutoPlate).filter(AutoPlate.id == 1).update({"leading_user_id": 2, "bid_count": 1})
+    db.commit()
+    db.close()
+
+    async def scenario():
+        scheduler = AuctionScheduler(batch_size=3, batch_pause=0)
+        async with AsyncSessionLocal() as session:
+            await scheduler.load(session)
+        subscription = hub.subscribe(1)
+        closed = await scheduler.close_due()
+        return scheduler, closed, await subscription.get(timeout=1), await subscription.get(timeout=1)
+
+    scheduler, closed, event, end = asyncio.run(scenario())
+    assert closed == 7
+    assert '"winner_id": 2' in event and end is None
+    states = plate_states()
+    assert states[1] == (False, 2)
+    assert all(states[i] == (False, None) for i in range(2, 8))
+    assert states[8] == (True, None)
+    assert len(scheduler) == 1
+
+
+def test_rescheduled_deadline_supersedes_old_entry():
+    deadline = datetime.now() - timedelta(seconds=1)
+    db = TestingSessionLocal()
+    db.add(AutoPlate(id=1, plate_number="MOVED", description="moved", deadline=deadline, created_by_id=1))
+    db.commit()
+    db.close()
+
+    scheduler = AuctionScheduler()
+    scheduler.schedule(1, deadline)
+    scheduler.schedule(1, datetime.now() + timedelta(hours=1))
+    assert scheduler.pop_due(datetime.now(), 10) == []
+    assert scheduler.pop_due(datetime.now() + timedelta(hours=2), 10) == [1]
+
+    # A plate whose stored deadline moved on is left open even if its old entry fires
+    db = TestingSessionLocal()
+    db.query(AutoPlate).filter(AutoPlate.id == 1).update({"deadline": datetime.now() + timedelta(hours=1)})
+    db.commit()
+    db.close()
+    assert asyncio.run(scheduler.close_plates([1])) == []
+    assert plate_states()[1] == (True, None)
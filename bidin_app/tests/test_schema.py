@@ -0,0 +1,49 @@
+import sys
+import os
+import asyncio
+import sqlite3
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema import upgrade_database
+
+# The tables as the first release created them
+ORIGINAL_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR, email VARCHAR,
+                    hashed_password VARCHAR, is_staff BOOLEAN);
+CREATE TABLE auto_plates (id INTEGER NOT NULL PRIMARY KEY, plate_number VARCHAR(10), description TEXT,
+                          deadline DATETIME, created_by_id INTEGER REFERENCES users (id), is_active BOOLEAN);
+CREATE TABLE bids (id INTEGER NOT NULL PRIMARY KEY, amount NUMERIC(10, 2), user_id INTEGER REFERENCES users (id),
+                   plate_id INTEGER REFERENCES auto_plates (id), created_at DATETIME,
+                   CONSTRAINT unique_user_plate UNIQUE (user_id, plate_id));
+INSERT INTO users VALUES (1, 'admin', 'admin@example.com', 'x', 1), (2, 'alice', 'alice@example.com', 'x', 0);
+INSERT INTO auto_plates VALUES (1, 'OLD001', 'Old', '2030-01-01 00:00:00', 1, 1);
+INSERT INTO bids VALUES (1, 250, 2, 1, '2024-01-01 00:00:00');
+"""
+
+
+def test_upgrade_adds_tables_and_columns_and_fills_summaries(tmp_path):
+    path = tmp_path / "old.db"
+    connection = sqlite3.connect(path)
+    connection.executescript(ORIGINAL_SCHEMA)
+    connection.close()
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        try:
+            added = await upgrade_database(engine)
+            again = await upgrade_database(engine)
+            async with engine.connect() as conn:
+                summary = (await conn.execute(text(
+                    "SELECT current_highest_amount, bid_count, leading_user_id FROM auto_plates"))).one()
+                events = (await conn.execute(text("SELECT count(*) FROM bid_events"))).scalar()
+            return added, again, tuple(summary), events
+        finally:
+            await engine.dispose()
+
+    added, again, summary, events = asyncio.run(scenario())
+    assert "auto_plates.current_highest_amount" in added and "auto_plates.winner_id" in added
+    assert again == []
+    assert summary == (250, 1, 2) and events == 0
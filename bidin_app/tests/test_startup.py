@@ -0,0 +1,33 @@
+import sys
+import os
+import subprocess
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, create_app, AppSettings
+from conftest import seed
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_function(function):
+    seed()
+
+
+def test_heavy_modules_load_after_import():
+    script = "import sys, main; print(sorted(m for m in ('jose', 'passlib', 'jinja2') if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", script], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_ready_only_after_the_warm_up():
+    # No lifespan has run for the module's app
+    assert TestClient(app).get("/readyz").status_code == 503
+
+    fresh = create_app(AppSettings(prewarm_connections=2))
+    with TestClient(fresh) as client:
+        assert client.get("/readyz").json() == {"status": "ready"}
+        assert fresh.openapi_schema is not None
+        assert client.get("/login").status_code == 200
+    assert not fresh.state.ready